@@ -1,74 +1,619 @@
 """
 API-based LLM for fast text generation using external services
+
+Providers speaking the OpenAI chat completions protocol (Groq, OpenAI, any
+OpenAI-compatible server such as vLLM or llama.cpp, and mock_llm_server.py)
+are registered by name in PROVIDERS. ApiLLM calls them in order, failing over
+to the next one when a provider is rate-limited, failing or too slow.
 """
 
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
 import requests
+from requests.adapters import HTTPAdapter
 import config
+from rate_limiter import get_rate_limiter, RateLimitTimeout
 
 
-class ApiLLM:
-    """LLM using external API (Groq, OpenAI, etc.)"""
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """Generation failed"""
+
+
+class LLMRequestError(LLMError):
+    """Request rejected by the provider (4xx other than 429): retrying won't help"""
+
+
+class LLMRateLimitError(LLMError):
+    """Still rate limited (429) after all retries"""
+
+
+class LLMServerError(LLMError):
+    """Provider error (5xx) or connection failure after all retries"""
+
+
+class LLMResponseError(LLMError):
+    """Provider answered with an unexpected payload"""
+
+
+# Shared keep-alive session (one connection pool for every provider and workspace)
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Get or create the pooled HTTP session (singleton pattern)"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=config.API_POOL_SIZE, pool_maxsize=config.API_POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class OpenAICompatibleProvider:
+    """Chat completions client for an OpenAI-compatible API"""
     
-    def __init__(self):
-        print(f"\nInitializing API LLM: {config.API_PROVIDER}")
+    def __init__(self, name, base_url, api_key, model, context_tokens, tokenizer=None,
+                 max_retries=config.API_MAX_RETRIES, timeout=config.API_TIMEOUT):
+        self.name = name
+        self.api_url = base_url.rstrip('/') + "/chat/completions"
+        self.api_key = api_key
+        self.model = model
+        self.tokenizer_name = tokenizer
+        self.max_retries = max_retries
+        self.timeout = timeout
+        
+        self.max_input_tokens = context_tokens - config.MAX_NEW_TOKENS
+        self._tokenizer = None
+        self._tokenizer_lock = threading.Lock()
         
-        if config.API_PROVIDER == "groq":
-            if not config.GROQ_API_KEY:
-                raise ValueError("GROQ_API_KEY not set in .env file. Get one free at https://console.groq.com")
-            self.api_url = "https://api.groq.com/openai/v1/chat/completions"
-            self.api_key = config.GROQ_API_KEY
-            self.model = config.GROQ_MODEL
-            print(f"✓ Using Groq API with model: {self.model}")
-        else:
-            raise ValueError(f"API provider '{config.API_PROVIDER}' not supported yet")
+        # Identify the generation settings (generation cache key)
+        self.provider = name
+        self.model_name = model
+        self.temperature = config.TEMPERATURE
+        
+        self.session = get_session()
+        self.rate_limiter = get_rate_limiter(name)  # None when the provider has no configured quota
+        self._local = threading.local()  # last_attempts is per thread (concurrent batch calls)
+        
+        self._usage_lock = threading.Lock()
+        self._usage = {'requests': 0, 'failures': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'latency_ms': 0.0}
     
-    def generate(self, prompt: str, max_new_tokens: int = config.MAX_NEW_TOKENS) -> str:
+    @property
+    def tokenizer(self):
         """
-        Generate text using API
+        Tokenizer of the API model, loaded on first use (False if unavailable)
+
+        Only a tokenizer already in the local Hugging Face cache is used, unless
+        API_TOKENIZER_DOWNLOAD allows fetching it from the Hub. Threads arriving
+        while it loads wait for it, so every prompt is budgeted the same way.
+        """
+        if self._tokenizer is None:
+            with self._tokenizer_lock:
+                if self._tokenizer is None:
+                    self._tokenizer = self._load_tokenizer()
+        return self._tokenizer
+    
+    def _load_tokenizer(self):
+        if not self.tokenizer_name:
+            return False
+        try:
+            from transformers import AutoTokenizer
+            return AutoTokenizer.from_pretrained(
+                self.tokenizer_name, local_files_only=not config.API_TOKENIZER_DOWNLOAD
+            )
+        except Exception as e:
+            print(f"⚠ Tokenizer {self.tokenizer_name} non disponibile, conteggio token stimato: {e}")
+            return False
+    
+    @property
+    def last_attempts(self):
+        """Per-attempt status and latency of this thread's last call"""
+        return getattr(self._local, 'attempts', [])
+    
+    def count_tokens(self, text: str) -> int:
+        """Number of tokens the model sees for text (prompt budgeting)"""
+        if self.tokenizer:
+            return len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+        # Fallback estimate: ~3.5 characters per token for Italian/English text
+        return math.ceil(len(text) / 3.5)
+    
+    def _record_usage(self, ok, latency_ms, usage=None):
+        with self._usage_lock:
+            self._usage['requests'] += 1
+            self._usage['failures'] += 0 if ok else 1
+            self._usage['latency_ms'] += latency_ms
+            if usage:
+                self._usage['prompt_tokens'] += usage.get('prompt_tokens', 0)
+                self._usage['completion_tokens'] += usage.get('completion_tokens', 0)
+    
+    def usage(self):
+        """Calls, failures, token usage, mean latency since startup and current quota utilization"""
+        with self._usage_lock:
+            stats = dict(self._usage)
+        total_latency = stats.pop('latency_ms')
+        stats['mean_latency_ms'] = round(total_latency / stats['requests'], 1) if stats['requests'] else 0.0
+        if self.rate_limiter:
+            stats['rate_limit'] = self.rate_limiter.stats()
+        return stats
+    
+    def _estimate_tokens(self, prompt, max_new_tokens):
+        """Tokens debited from the quota before a call: prompt plus expected completion"""
+        return self.count_tokens(prompt) + min(max_new_tokens, config.RATE_LIMIT_COMPLETION_TOKENS)
+    
+    def _acquire_quota(self, tokens, deadline=None):
+        """
+        Queue for the shared quota (no-op without a rate limiter)
         
-        Args:
-            prompt: Input prompt
-            max_new_tokens: Maximum tokens to generate
+        Calls with a deadline (web requests) queue at most
+        RATE_LIMIT_REQUEST_MAX_WAIT seconds; the others (batch jobs, CLI)
+        up to RATE_LIMIT_MAX_WAIT.
+        """
+        if not self.rate_limiter:
+            return
+        max_wait = config.RATE_LIMIT_MAX_WAIT
+        if deadline is not None:
+            max_wait = max(0.0, min(config.RATE_LIMIT_REQUEST_MAX_WAIT, deadline - time.monotonic()))
+        try:
+            waited = self.rate_limiter.acquire(tokens, max_wait=max_wait)
+        except RateLimitTimeout as e:
+            raise LLMRateLimitError(str(e))
+        if waited > 0.5:
+            print(f"⏳ [{self.name}] In coda per la quota: {waited:.1f}s")
+    
+    def _settle_quota(self, estimated_tokens, usage):
+        """Replace the upfront estimate with the provider's reported usage"""
+        if self.rate_limiter and usage and usage.get('total_tokens') is not None:
+            self.rate_limiter.settle(estimated_tokens, usage['total_tokens'])
+    
+    def _backoff(self, attempt, retry_after=None):
+        """Seconds to sleep before the next attempt: Retry-After if given, else full-jitter exponential"""
+        if retry_after is not None:
+            return min(retry_after, config.API_BACKOFF_MAX)
+        return random.uniform(0, min(config.API_BACKOFF_MAX, config.API_BACKOFF_BASE * (2 ** attempt)))
+    
+    def _post(self, payload, stream=False, tokens=0, deadline=None):
+        """
+        POST to the chat completions API with retries
+        
+        Every attempt first queues for the shared quota (tokens is the
+        estimated cost, refunded when the attempt fails). Retries connection errors, timeouts, 429 and 5xx with
+        jittered exponential backoff, honoring Retry-After; a 429 pauses the
+        quota for every process. Each attempt is recorded in last_attempts.
+        
+        With a deadline (time.monotonic() value), request timeouts are cut
+        to the time left and no retry is attempted that couldn't start
+        before it: the last error is raised instead.
         
         Returns:
-            Generated text
+            requests.Response with a 2xx status
+        
+        Raises:
+            LLMRequestError, LLMRateLimitError, LLMServerError
         """
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        attempts = self._local.attempts = []
+        error = LLMServerError(f"Tempo massimo per la chiamata a {self.name} esaurito")
+        
+        for attempt in range(self.max_retries + 1):
+            if deadline is not None and deadline <= time.monotonic():
+                break
+            self._acquire_quota(tokens, deadline)
+            try:
+                timeout = self.timeout
+                if deadline is not None:
+                    timeout = min(timeout, max(0.1, deadline - time.monotonic()))
+                start = time.perf_counter()
+                retry_after = None
+                try:
+                    response = self.session.post(
+                        self.api_url, json=payload, headers=headers,
+                        timeout=timeout, stream=stream
+                    )
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    latency_ms = (time.perf_counter() - start) * 1000
+                    attempts.append({'attempt': attempt + 1, 'status': None,
+                                     'latency_ms': latency_ms, 'error': str(e)})
+                    print(f"⚠ [{self.name}] Tentativo {attempt + 1}: errore di connessione dopo {latency_ms:.0f} ms: {e}")
+                    error = LLMServerError(f"Connessione a {self.name} fallita: {e}")
+                else:
+                    latency_ms = (time.perf_counter() - start) * 1000
+                    attempts.append({'attempt': attempt + 1, 'status': response.status_code,
+                                     'latency_ms': latency_ms, 'error': None})
+                    
+                    if response.ok:
+                        return response
+                    
+                    detail = self._error_detail(response)
+                    print(f"⚠ [{self.name}] Tentativo {attempt + 1}: HTTP {response.status_code} dopo {latency_ms:.0f} ms: {detail}")
+                    
+                    if response.status_code not in RETRYABLE_STATUS:
+                        self._record_usage(False, latency_ms)
+                        raise LLMRequestError(f"HTTP {response.status_code}: {detail}")
+                    
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    if response.status_code == 429:
+                        error = LLMRateLimitError(f"Rate limit {self.name} superato: {detail}")
+                        if self.rate_limiter:
+                            self.rate_limiter.block(retry_after if retry_after is not None else self._backoff(attempt))
+                    else:
+                        error = LLMServerError(f"HTTP {response.status_code}: {detail}")
+                    response.close()
+            except BaseException:
+                self._settle_quota(tokens, {'total_tokens': 0})  # the call fails here: refund the estimate
+                raise
+            
+            self._record_usage(False, latency_ms)
+            self._settle_quota(tokens, {'total_tokens': 0})  # a failed attempt generates nothing
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt, retry_after)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    print(f"   ✋ Nessun nuovo tentativo: tempo massimo della chiamata esaurito")
+                    break
+                print(f"   ↻ Nuovo tentativo tra {delay:.1f}s")
+                time.sleep(delay)
         
+        raise error
+    
+    def _error_detail(self, response):
+        """Error body for logging"""
+        try:
+            return response.json()
+        except ValueError:
+            return response.text[:500]
+    
+    def _payload(self, prompt, max_new_tokens, stream=False):
         payload = {
             "model": self.model,
             "messages": [
                 {"role": "user", "content": prompt}
             ],
             "max_tokens": max_new_tokens,
-            "temperature": 0.7,
+            "temperature": self.temperature,
             "top_p": 0.9
         }
+        if stream:
+            payload["stream"] = True
+        return payload
+    
+    def generate(self, prompt: str, max_new_tokens: int = config.MAX_NEW_TOKENS, deadline: float = None) -> str:
+        """
+        Generate text using API
+        
+        Args:
+            prompt: Input prompt
+            max_new_tokens: Maximum tokens to generate
+            deadline: time.monotonic() value by which retries must stop (see _post)
+        
+        Returns:
+            Generated text
+        
+        Raises:
+            LLMError subclasses when the API call fails after retries
+        """
+        estimated_tokens = self._estimate_tokens(prompt, max_new_tokens)
+        response = self._post(self._payload(prompt, max_new_tokens), tokens=estimated_tokens, deadline=deadline)
+        latency_ms = self.last_attempts[-1]['latency_ms']
         
         try:
-            response = requests.post(self.api_url, json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-            
             result = response.json()
             generated_text = result['choices'][0]['message']['content']
-            
-            print(f"\n📏 Tokens usati: ~{result['usage']['total_tokens']} | Lunghezza risposta: {len(generated_text)} caratteri")
-            
-            return generated_text.strip()
-            
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Errore API: {e}")
-            # Print full error response for debugging
-            if hasattr(e, 'response') and e.response is not None:
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            self._record_usage(False, latency_ms)
+            self._settle_quota(estimated_tokens, {'total_tokens': 0})
+            raise LLMResponseError(f"Risposta {self.name} non valida: {e}")
+        
+        usage = result.get('usage') or {}
+        self._record_usage(True, latency_ms, usage)
+        self._settle_quota(estimated_tokens, usage)
+        
+        total_latency = sum(a['latency_ms'] for a in self.last_attempts)
+        print(f"\n📏 [{self.name}] Tokens usati: ~{usage.get('total_tokens', '?')} | Lunghezza risposta: {len(generated_text)} caratteri"
+              f" | Tentativi: {len(self.last_attempts)} ({total_latency:.0f} ms)")
+        
+        return generated_text.strip()
+    
+    def generate_stream(self, prompt: str, max_new_tokens: int = config.MAX_NEW_TOKENS, deadline: float = None):
+        """
+        Stream generated text using the provider's server-sent events (stream: true)
+        
+        Args:
+            prompt: Input prompt
+            max_new_tokens: Maximum tokens to generate
+            deadline: time.monotonic() value by which the stream must have started (see _post)
+        
+        Yields:
+            Text pieces as they arrive
+        
+        Raises:
+            LLMError subclasses when the API call fails after retries
+        """
+        start = time.perf_counter()
+        first_token_ms = None
+        length = 0
+        usage = None
+        
+        estimated_tokens = self._estimate_tokens(prompt, max_new_tokens)
+        response = self._post(self._payload(prompt, max_new_tokens, stream=True), stream=True, tokens=estimated_tokens,
+                              deadline=deadline)
+        # Server-sent events are always UTF-8; without a charset requests would decode them as ISO-8859-1
+        response.encoding = 'utf-8'
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                
                 try:
-                    error_detail = e.response.json()
-                    print(f"❌ Dettaglio errore: {error_detail}")
-                except:
-                    print(f"❌ Response text: {e.response.text}")
-            return f"Errore nella generazione della risposta: {str(e)}"
+                    event = json.loads(data)
+                    delta = event['choices'][0].get('delta', {}) if event.get('choices') else {}
+                except (ValueError, KeyError, IndexError, AttributeError) as e:
+                    raise LLMResponseError(f"Evento di streaming non valido: {e}")
+                # Groq reports streaming usage under x_groq on the last chunk
+                usage = event.get('usage') or (event.get('x_groq') or {}).get('usage') or usage
+                
+                piece = delta.get('content')
+                if piece:
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - start) * 1000
+                    length += len(piece)
+                    yield piece
+        except requests.exceptions.RequestException as e:
+            self._record_usage(False, (time.perf_counter() - start) * 1000)
+            self._settle_quota(estimated_tokens, {'total_tokens': 0})
+            raise LLMServerError(f"Streaming interrotto: {e}")
+        except LLMResponseError:
+            self._record_usage(False, (time.perf_counter() - start) * 1000)
+            self._settle_quota(estimated_tokens, {'total_tokens': 0})
+            raise
+        finally:
+            response.close()
+        
+        total_ms = (time.perf_counter() - start) * 1000
+        self._record_usage(True, total_ms, usage)
+        self._settle_quota(estimated_tokens, usage)
+        print(f"\n📏 [{self.name}] Streaming: primo token dopo {first_token_ms or 0:.0f} ms | Totale {total_ms:.0f} ms | Lunghezza risposta: {length} caratteri")
+
+
+# ============== PROVIDER REGISTRY ==============
+
+PROVIDERS = {}  # name -> factory(**options) returning a provider
+
+
+def register_provider(name):
+    """Register a provider factory under a name usable in config.API_PROVIDER"""
+    def decorator(factory):
+        PROVIDERS[name] = factory
+        return factory
+    return decorator
+
+
+def create_provider(name, **options):
+    """Instantiate a registered provider (options are passed to its constructor)"""
+    if name not in PROVIDERS:
+        raise ValueError(f"API provider '{name}' not supported yet (available: {', '.join(sorted(PROVIDERS))})")
+    return PROVIDERS[name](**options)
+
+
+@register_provider("groq")
+def groq_provider(**options):
+    if not config.GROQ_API_KEY:
+        raise ValueError("GROQ_API_KEY not set in .env file. Get one free at https://console.groq.com")
+    return OpenAICompatibleProvider(
+        "groq", config.GROQ_BASE_URL, config.GROQ_API_KEY, config.GROQ_MODEL,
+        config.GROQ_CONTEXT_TOKENS, tokenizer=config.GROQ_TOKENIZER, **options
+    )
+
+
+@register_provider("openai")
+def openai_provider(**options):
+    if not config.OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY not set in .env file")
+    return OpenAICompatibleProvider(
+        "openai", "https://api.openai.com/v1", config.OPENAI_API_KEY, config.OPENAI_MODEL,
+        config.OPENAI_CONTEXT_TOKENS, **options
+    )
+
+
+@register_provider("openai_compatible")
+def openai_compatible_provider(**options):
+    if not config.OPENAI_COMPATIBLE_BASE_URL:
+        raise ValueError("OPENAI_COMPATIBLE_BASE_URL not set in .env file")
+    return OpenAICompatibleProvider(
+        "openai_compatible", config.OPENAI_COMPATIBLE_BASE_URL, config.OPENAI_COMPATIBLE_API_KEY,
+        config.OPENAI_COMPATIBLE_MODEL, config.OPENAI_COMPATIBLE_CONTEXT_TOKENS, **options
+    )
+
+
+@register_provider("mock")
+def mock_provider(**options):
+    # mock_llm_server.py: deterministic, no network or API key needed
+    return OpenAICompatibleProvider(
+        "mock", f"http://127.0.0.1:{config.MOCK_LLM_PORT}/v1", "mock", "mock-llm",
+        config.MOCK_LLM_CONTEXT_TOKENS, **options
+    )
+
+
+class ApiLLM:
+    """LLM using external APIs, with ordered failover across providers"""
+    
+    FAILOVER_ERRORS = (LLMRateLimitError, LLMServerError, LLMResponseError)
+    
+    def __init__(self, provider_names=None):
+        if provider_names is None:
+            provider_names = [config.API_PROVIDER] + [
+                name for name in config.API_FALLBACK_PROVIDERS if name != config.API_PROVIDER
+            ]
+        print(f"\nInitializing API LLM: {' → '.join(provider_names)}")
+        
+        self.providers = []
+        for position, name in enumerate(provider_names):
+            # Fail fast on every provider that has a fallback after it
+            options = {}
+            if position < len(provider_names) - 1:
+                options = {'max_retries': config.API_FAILOVER_RETRIES, 'timeout': config.API_FAILOVER_TIMEOUT}
+            try:
+                self.providers.append(create_provider(name, **options))
+            except ValueError as e:
+                if position == 0:
+                    raise
+                print(f"⚠ Provider di riserva '{name}' non disponibile: {e}")
+        
+        primary = self.providers[0]
+        print(f"✓ Using {primary.name} API with model: {primary.model}")
+        
+        # Identify the generation settings (generation cache key): the primary's
+        self.provider = primary.provider
+        self.model = primary.model
+        self.model_name = primary.model_name
+        self.temperature = primary.temperature
+        # The prompt must fit whichever provider ends up serving it
+        self.max_input_tokens = min(p.max_input_tokens for p in self.providers)
+        
+        self.failovers = 0
+        self.last_provider = None
+        self._cooldown_until = {}  # provider name -> time before which it is tried last
+        self._lock = threading.Lock()
+    
+    def count_tokens(self, text: str) -> int:
+        """Number of tokens the primary model sees for text (prompt budgeting)"""
+        return self.providers[0].count_tokens(text)
+    
+    @property
+    def last_attempts(self):
+        """Attempts of the last provider called"""
+        for provider in self.providers:
+            if provider.name == self.last_provider:
+                return provider.last_attempts
+        return []
+    
+    def _ordered_providers(self):
+        """Providers in configured order, those cooling down after a failure last"""
+        now = time.time()
+        with self._lock:
+            cooling = {name for name, until in self._cooldown_until.items() if until > now}
+        return ([p for p in self.providers if p.name not in cooling] +
+                [p for p in self.providers if p.name in cooling])
+    
+    def _failed(self, provider, error, has_next):
+        with self._lock:
+            self._cooldown_until[provider.name] = time.time() + config.API_FAILOVER_COOLDOWN
+            if has_next:
+                self.failovers += 1
+        if has_next:
+            print(f"↪ Failover: {provider.name} non disponibile ({error.__class__.__name__}), provo il successivo")
+    
+    def generate(self, prompt: str, max_new_tokens: int = config.MAX_NEW_TOKENS, prefix: str = None,
+                 segments: list = None, time_limit: float = None) -> str:
+        """
+        Generate text with the first provider that answers
+        
+        prefix and segments are accepted for interface parity with LocalLLM
+        and ignored: providers cache repeated prompt prefixes on their side,
+        and their context windows hold the whole prompt budget.
+        
+        time_limit caps the whole call in seconds, failover included
+        (interactive calls must answer before the web worker times out);
+        None lets every provider use all of its retries.
+        
+        Raises:
+            LLMError subclasses when every provider fails
+        """
+        deadline = time.monotonic() + time_limit if time_limit else None
+        providers = self._ordered_providers()
+        for position, provider in enumerate(providers):
+            try:
+                response = provider.generate(prompt, max_new_tokens, deadline=deadline)
+            except self.FAILOVER_ERRORS as e:
+                self._failed(provider, e, position < len(providers) - 1)
+                if position == len(providers) - 1:
+                    raise
+                continue
+            self.last_provider = provider.name
+            return response
+    
+    def generate_stream(self, prompt: str, max_new_tokens: int = config.MAX_NEW_TOKENS, prefix: str = None,
+                        segments: list = None, time_limit: float = None):
+        """
+        Stream text from the first provider that starts answering (prefix and segments are ignored, as in generate)
+        
+        Failover only happens before the first piece: once text has been
+        sent to the caller, a failure is raised. time_limit caps the time
+        until the stream starts, as in generate.
+        """
+        deadline = time.monotonic() + time_limit if time_limit else None
+        providers = self._ordered_providers()
+        for position, provider in enumerate(providers):
+            stream = provider.generate_stream(prompt, max_new_tokens, deadline=deadline)
+            try:
+                first = next(stream, None)
+            except self.FAILOVER_ERRORS as e:
+                self._failed(provider, e, position < len(providers) - 1)
+                if position == len(providers) - 1:
+                    raise
+                continue
+            
+            self.last_provider = provider.name
+            if first is not None:
+                yield first
+                yield from stream
+            return
+    
+    def generate_batch(self, prompts, max_new_tokens: int = config.MAX_NEW_TOKENS,
+                       max_workers: int = config.BATCH_GENERATION_WORKERS):
+        """
+        Generate several prompts concurrently
+        
+        Returns:
+            One entry per prompt, in order: the generated text, or the LLMError raised for it
+        """
+        def run(prompt):
+            try:
+                return self.generate(prompt, max_new_tokens)
+            except LLMError as e:
+                return e
+        
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm') as executor:
+            return list(executor.map(run, prompts))
+    
+    def usage(self):
+        """Per-provider usage and the number of failovers since startup"""
+        return {
+            'providers': {provider.name: provider.usage() for provider in self.providers},
+            'failovers': self.failovers
+        }
     
     def generate_with_context(self, query: str, context_chunks: list) -> str:
         """
@@ -0,0 +1,124 @@
+"""
+Local generation throughput: tokens/sec of LocalLLM per generation mode
+
+Loads config.LLM_MODEL once per mode (one at a time, to bound memory) and
+times the same prompt in each. The "baseline" mode reproduces the old
+behaviour (no KV cache, fp32); "batched" adds the continuous-batching
+scheduler. With --concurrency, that many threads generate at once and the
+aggregate rate (all generated tokens over wall time) is reported, which is
+what batch drafting sees.
+
+The "match" column is an output-parity check for causal models: the first
+mode greedily decodes a reference continuation, and every mode then predicts
+each of its tokens from the same preceding text. It reports the share of
+positions where the mode picks the reference token (1.00 = same draft).
+
+Usage:
+    python benchmark_local_llm.py
+    python benchmark_local_llm.py --max-new-tokens 256 --runs 3 --mode kv-cache-int8 --mode batched \\
+        --concurrency 1 --concurrency 4 --concurrency 8
+"""
+
+import argparse
+import gc
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+import config
+from local_llm import LocalLLM
+
+
+# mode -> LocalLLM options
+MODES = {
+    'baseline': dict(use_cache=False, quantize=False, batching=False),
+    'kv-cache': dict(use_cache=True, quantize=False, batching=False),
+    'kv-cache-int8': dict(use_cache=True, quantize=True, batching=False),
+    'batched': dict(use_cache=True, quantize=True, batching=True),
+}
+
+PROMPT = """You are the admissions office of a university. Answer the student's email politely and completely.
+
+STUDENT EMAIL:
+Buongiorno, vorrei sapere quali sono i requisiti di ammissione al corso di laurea, le scadenze per
+l'iscrizione e se è possibile frequentare le lezioni online. Grazie.
+
+RESPONSE:
+"""
+
+
+def greedy_match(llm, max_new_tokens, reference):
+    """
+    Top-1 agreement of llm with a reference greedy continuation of PROMPT
+
+    Returns:
+        (reference token ids, share of matching positions), with the reference
+        decoded by llm itself when none is given yet
+    """
+    inputs = llm.tokenizer(PROMPT, return_tensors="pt").to(config.DEVICE)
+    prompt_length = inputs['input_ids'].shape[-1]
+    with torch.no_grad():
+        if reference is None:
+            reference = llm.model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False,
+                                           pad_token_id=llm.tokenizer.eos_token_id)
+        logits = llm.model(input_ids=reference).logits
+    predicted = logits[0, prompt_length - 1:-1].argmax(-1)
+    return reference, (predicted == reference[0, prompt_length:]).float().mean().item()
+
+
+def run_mode(mode, max_new_tokens, runs, concurrency_levels, reference=None):
+    """Aggregate tokens/sec of one mode at each concurrency level (after one warm-up generation)"""
+    print(f"\n⏱ Modalità '{mode}'")
+    llm = LocalLLM(**MODES[mode])
+    llm.generate(PROMPT, max_new_tokens=8)  # warm-up
+
+    match = None
+    if llm.is_causal:
+        reference, match = greedy_match(llm, max_new_tokens, reference)
+
+    # Without the scheduler concurrent model.generate calls are serialized, as in production
+    workers = lambda concurrency: concurrency if llm.scheduler else 1
+
+    rows = []
+    for concurrency in concurrency_levels:
+        def one(_):
+            return llm.count_tokens(llm.generate(PROMPT, max_new_tokens=max_new_tokens))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers(concurrency)) as executor:
+            tokens = sum(executor.map(one, range(runs * concurrency)))
+        rows.append((mode, concurrency, llm.use_cache, llm.quantized, tokens / (time.perf_counter() - start), match))
+
+    del llm
+    gc.collect()
+    return rows, reference
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LocalLLM tokens/sec per generation mode")
+    parser.add_argument('--mode', action='append', dest='modes', choices=list(MODES),
+                        help="Mode to benchmark, repeatable (default: all)")
+    parser.add_argument('--max-new-tokens', type=int, default=128)
+    parser.add_argument('--runs', type=int, default=2, help="Generations per concurrent caller")
+    parser.add_argument('--concurrency', type=int, action='append', dest='concurrency',
+                        help="Concurrent callers, repeatable (default: 1)")
+    args = parser.parse_args()
+
+    rows = []
+    reference = None
+    for mode in args.modes or list(MODES):
+        mode_rows, reference = run_mode(mode, args.max_new_tokens, args.runs, args.concurrency or [1], reference)
+        rows.extend(mode_rows)
+
+    baseline = rows[0][4]
+    print(f"\n{config.LLM_MODEL} on {config.DEVICE}, up to {args.max_new_tokens} new tokens")
+    print(f"{'Mode':<16}{'callers':>8}{'KV cache':>10}{'int8':>7}{'tok/s':>9}{'speedup':>10}{'match':>8}")
+    print("-" * 68)
+    for mode, concurrency, use_cache, quantized, rate, match in rows:
+        print(f"{mode:<16}{concurrency:>8}{'yes' if use_cache else 'no':>10}{'yes' if quantized else 'no':>7}"
+              f"{rate:>9.2f}{rate / baseline:>9.2f}x{'-' if match is None else f'{match:.2f}':>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Import-time and memory budget of an API-mode process
+
+Imports the modules the web app loads at startup in a fresh interpreter and
+fails (exit status 1) when a heavy ML library (torch, transformers,
+sentence_transformers) is imported eagerly, or when import time or peak RSS
+exceed their budgets. Run it before deploying: every cold start of an
+auto-stopped machine pays this cost.
+
+Usage:
+    python check_import_budget.py
+    python check_import_budget.py --module flask_app --max-seconds 2.5 --max-rss-mb 200
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+# Modules the web app imports at startup in API mode
+DEFAULT_MODULES = ["flask_app"]
+
+# Only needed for embeddings (first search) or the local LLM
+HEAVY_MODULES = ["torch", "transformers", "sentence_transformers", "tensorflow", "accelerate"]
+
+CHILD = """
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    importlib.import_module(name)
+seconds = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+rss_mb = rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+print(json.dumps({'seconds': seconds, 'rss_mb': rss_mb, 'modules': sorted(sys.modules)}))
+"""
+
+
+def slowest_imports(stderr, count=8):
+    """Packages with the most import time (self time of all their modules), from -X importtime output"""
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # header line
+        package = name.strip().split(".")[0]
+        totals[package] = totals.get(package, 0) + int(self_us)
+    return sorted(((us, package) for package, us in totals.items()), reverse=True)[:count]
+
+
+def check(modules, max_seconds, max_rss_mb):
+    """Measure the imports in a child interpreter; returns the list of budget violations"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD, *modules],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        print("\n".join(errors[-20:]))
+        return [f"import of {', '.join(modules)} failed"]
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    heavy = [name for name in HEAVY_MODULES if name in report['modules']]
+
+    print(f"\n📦 Import di {', '.join(modules)}: {report['seconds']:.2f}s, RSS massimo {report['rss_mb']:.0f} MB")
+    print("   Pacchetti più lenti da importare:")
+    for microseconds, name in slowest_imports(result.stderr):
+        print(f"   {microseconds / 1e6:>7.3f}s  {name}")
+
+    violations = []
+    if heavy:
+        violations.append(f"heavy modules imported eagerly: {', '.join(heavy)}")
+    if report['seconds'] > max_seconds:
+        violations.append(f"import time {report['seconds']:.2f}s > budget {max_seconds}s")
+    if report['rss_mb'] > max_rss_mb:
+        violations.append(f"peak RSS {report['rss_mb']:.0f} MB > budget {max_rss_mb} MB")
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail when API-mode startup imports exceed their budget")
+    parser.add_argument('--module', action='append', dest='modules',
+                        help="Module imported at startup, repeatable (default: flask_app)")
+    parser.add_argument('--max-seconds', type=float, default=2.5)
+    parser.add_argument('--max-rss-mb', type=float, default=200)
+    args = parser.parse_args()
+
+    violations = check(args.modules or DEFAULT_MODULES, args.max_seconds, args.max_rss_mb)
+    if violations:
+        for violation in violations:
+            print(f"❌ {violation}")
+        sys.exit(1)
+    print("✓ Import entro il budget")
+
+
+if __name__ == "__main__":
+    main()
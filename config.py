@@ -3,7 +3,6 @@ Configuration file for the RAG system
 """
 
 import os
-import torch
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -11,15 +10,48 @@ load_dotenv()
 
 # Model Configuration
 EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"  # ~80MB
+EMBEDDING_DIMENSION = 384  # vector size of EMBEDDING_MODEL (new FAISS indexes are created without loading it)
 
 # LLM Configuration - API-based (FAST!)
 USE_API_LLM = True  # Use API instead of local model
-API_PROVIDER = "groq"  # Options: "groq", "openai", "anthropic"
+API_PROVIDER = os.getenv('API_PROVIDER', 'groq')  # Options: "groq", "openai", "openai_compatible", "mock"
+API_FALLBACK_PROVIDERS = [p.strip() for p in os.getenv('API_FALLBACK_PROVIDERS', '').split(',') if p.strip()]  # tried in order
 GROQ_API_KEY = os.getenv('GROQ_API_KEY', '')  # Get free key at console.groq.com
 GROQ_MODEL = "llama-3.1-8b-instant"  # Fast, current, and high quality
+GROQ_BASE_URL = os.getenv('GROQ_BASE_URL', 'https://api.groq.com/openai/v1')  # point at mock_llm_server.py for load tests
+GROQ_CONTEXT_TOKENS = 131072  # context window of GROQ_MODEL
+GROQ_TOKENIZER = "NousResearch/Meta-Llama-3.1-8B-Instruct"  # tokenizer matching GROQ_MODEL (prompt token budget)
+API_TOKENIZER_DOWNLOAD = os.getenv('API_TOKENIZER_DOWNLOAD', 'False').lower() == 'true'  # fetch a missing tokenizer from the HF Hub; off = local cache only, else ~3.5 chars/token estimate
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+OPENAI_CONTEXT_TOKENS = 128000
+OPENAI_COMPATIBLE_BASE_URL = os.getenv('OPENAI_COMPATIBLE_BASE_URL', '')  # e.g. http://localhost:8000/v1 (vLLM, llama.cpp)
+OPENAI_COMPATIBLE_API_KEY = os.getenv('OPENAI_COMPATIBLE_API_KEY', 'none')
+OPENAI_COMPATIBLE_MODEL = os.getenv('OPENAI_COMPATIBLE_MODEL', '')
+OPENAI_COMPATIBLE_CONTEXT_TOKENS = int(os.getenv('OPENAI_COMPATIBLE_CONTEXT_TOKENS', 8192))
+MOCK_LLM_PORT = int(os.getenv('MOCK_LLM_PORT', 8765))  # python mock_llm_server.py (tests and load runs)
+MOCK_LLM_CONTEXT_TOKENS = 8192
+
+# API HTTP client
+API_TIMEOUT = 30  # seconds per request attempt
+API_MAX_RETRIES = 4  # retries on 429/5xx/connection errors (total attempts = retries + 1)
+API_BACKOFF_BASE = 1.0  # seconds, doubled each retry (full jitter)
+API_BACKOFF_MAX = 30  # seconds, cap for backoff and Retry-After waits
+API_POOL_SIZE = 10  # keep-alive connections kept per host
+API_FAILOVER_RETRIES = 1  # retries on a provider before failing over to the next one
+API_FAILOVER_TIMEOUT = 15  # seconds per attempt on a provider that has a fallback (slow = failover)
+API_FAILOVER_COOLDOWN = 60  # seconds a failed provider is tried after the others
+API_REQUEST_DEADLINE = 60  # seconds a web request's LLM call may take, retries and failover included (< gunicorn --timeout 120)
 
 # Local LLM fallback (if USE_API_LLM = False)
 LLM_MODEL = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"  # ~2.2GB - faster on CPU, decent quality
+LOCAL_MAX_INPUT_TOKENS = 2048  # prompt tokens kept by LocalLLM
+LOCAL_USE_KV_CACHE = True  # reuse attention keys/values while decoding (checked at load, off if the model can't)
+LOCAL_QUANTIZE_INT8 = False  # CPU only: dynamic int8 quantization of linear layers except lm_head (faster, smaller weights; check drafts with benchmark_local_llm.py first)
+LOCAL_NUM_THREADS = int(os.getenv('LOCAL_NUM_THREADS', 0))  # torch CPU threads (0 = CPUs available to this process)
+LOCAL_BATCHING_ENABLED = True  # causal models: one scheduler thread batches concurrent generations (continuous batching)
+LOCAL_MAX_BATCH_SIZE = 8  # sequences decoded together; more wait in the queue
+LOCAL_PREFIX_CACHE_ENTRIES = 8  # prompt prefixes (system prompt + language instruction) whose KV cache is kept; 0 = off
 
 # Alternative LLM options:
 # LLM_MODEL = "microsoft/Phi-3-mini-4k-instruct"  # ~3.8GB - better quality but SLOW on CPU
@@ -27,8 +59,16 @@ LLM_MODEL = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"  # ~2.2GB - faster on CPU, dece
 # LLM_MODEL = "HuggingFaceH4/zephyr-7b-beta"  # ~7GB - best quality but needs GPU
 
 # Device Configuration
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"Using device: {DEVICE}")
+# DEVICE is resolved on first access: importing torch costs seconds and >100 MB,
+# and API-mode processes only need it once the embedding model is loaded
+def __getattr__(name):
+    if name == 'DEVICE':
+        global DEVICE
+        import torch
+        DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+        print(f"Using device: {DEVICE}")
+        return DEVICE
+    raise AttributeError(f"module 'config' has no attribute '{name}'")
 
 # ChromaDB Configuration
 CHROMA_DB_DIR = "./chroma_db"
@@ -40,15 +80,77 @@ COLLECTION_ENROLLMENT_DOCS = "enrollment_docs_collection"
 COLLECTION_CORRECTIONS = "corrections_collection"  # Feedback-based corrections
 
 # Text Chunking Configuration
-CHUNK_SIZE = 300  # characters per chunk (reduced for better context)
-CHUNK_OVERLAP = 50  # overlap between chunks
+CHUNKING_MODE = "sentence"  # "sentence" (paragraph/sentence aware, token-sized), "content" or "character"
+CHUNK_SIZE = 300  # characters per chunk (reduced for better context) - "character" mode
+CHUNK_OVERLAP = 50  # overlap between chunks - "character" mode
+CHUNK_MAX_TOKENS = 254  # embedding tokens per chunk - MiniLM truncates at 256 incl. [CLS]/[SEP]
+CHUNK_OVERLAP_SENTENCES = 1  # sentences repeated at the start of the next chunk
+ENROLLMENT_CHUNKING_MODE = "content"  # content-defined boundaries, stable under edits (incremental re-index)
+CHUNK_CDC_MIN_TOKENS = 64  # "content" mode: no content-defined cut before this many tokens
+CHUNK_CDC_AVG_SENTENCES = 4  # "content" mode: expected sentences between content-defined cuts
+EMBEDDING_BATCH_SIZE = 64  # chunks embedded and added per batch while indexing
+
+# Document Loading Configuration
+LOADER_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # extraction processes (1 = load serially)
+LOADER_FILE_TIMEOUT = 120  # seconds before a single file's extraction is abandoned
+WATCH_POLL_INTERVAL = 2  # seconds between scans of the documents folder in watch mode
+WATCH_DEBOUNCE = 3  # seconds the folder must be quiet before re-indexing (lets copies finish)
 
 # Retrieval Configuration
 TOP_K_RESULTS = 3  # number of relevant chunks to retrieve
 
+# Near-Duplicate Suppression (MinHash + LSH)
+DEDUP_ENABLED = True  # store identical chunks once, with multiple source references
+DEDUP_THRESHOLD = 0.85  # estimated Jaccard similarity of word 3-grams to share a search cluster
+MINHASH_NUM_PERM = 64  # signature length
+MINHASH_BANDS = 16  # LSH bands (MINHASH_NUM_PERM must be divisible by this)
+DEDUP_SEARCH_OVERFETCH = 3  # search fetches top_k * this, then keeps one result per cluster
+
 # Generation Configuration
 MAX_NEW_TOKENS = 1024  # Increased for complete email responses (~700-800 words)
 TEMPERATURE = 0.7  # creativity (0.0 = deterministic, 1.0 = creative)
+BATCH_GENERATION_WORKERS = 4  # concurrent LLM calls when generating drafts in batch
+
+# Prompt Token Budget (counted with the LLM's tokenizer)
+# Sized for LOCAL_MAX_INPUT_TOKENS; scaled up in proportion for LLMs with a larger context window
+PROMPT_MAX_TOKENS = 1200  # whole prompt: instructions, email, corrections, facts, style example
+PROMPT_EMAIL_MAX_TOKENS = 600  # student email is cut beyond this (never crowded out by context)
+PROMPT_CORRECTIONS_MAX_TOKENS = 200  # corrections, filled first from the remaining budget
+PROMPT_FACTS_MAX_TOKENS = 500  # enrollment document chunks, whole sentences only
+PROMPT_STYLE_MAX_TOKENS = 120  # historical response example, lowest priority
+
+# Generation Cache (exact prompt match)
+LLM_CACHE_ENABLED = True  # reuse the stored response when the same prompt is generated again
+LLM_CACHE_PATH = os.path.join(CHROMA_DB_DIR, "llm_cache.sqlite")
+LLM_CACHE_TTL = 7 * 24 * 3600  # seconds a cached response stays valid
+LLM_CACHE_MAX_ENTRIES = 5000  # least recently used entries are evicted beyond this
+
+# Semantic Answer Cache (near-identical questions, per workspace)
+SEMANTIC_CACHE_ENABLED = True  # reuse the answer to a similar email when retrieval returns the same chunks
+SEMANTIC_CACHE_THRESHOLD = 0.95  # cosine similarity of email embeddings (drafts are still reviewed before sending)
+SEMANTIC_CACHE_TTL = 7 * 24 * 3600  # seconds a cached answer stays valid
+SEMANTIC_CACHE_MAX_ENTRIES = 2000  # least recently used answers are evicted beyond this
+
+# API Rate Limits (token buckets shared by every worker process)
+API_RATE_LIMITS = {  # provider -> (requests per minute, tokens per minute); 0 = unlimited
+    'groq': (int(os.getenv('GROQ_RPM', 30)), int(os.getenv('GROQ_TPM', 6000))),
+    'openai': (int(os.getenv('OPENAI_RPM', 0)), int(os.getenv('OPENAI_TPM', 0))),
+}
+RATE_LIMIT_PATH = os.path.join(CHROMA_DB_DIR, "rate_limits.sqlite")
+RATE_LIMIT_MAX_WAIT = 60  # seconds a batch/CLI call queues for quota before failing (or failing over)
+RATE_LIMIT_REQUEST_MAX_WAIT = 10  # same, for calls made while a web request waits (see API_REQUEST_DEADLINE)
+RATE_LIMIT_COMPLETION_TOKENS = 400  # expected completion length debited upfront, settled with actual usage
+
+# Language Detection
+LANGUAGE_DETECT_SEED = 0  # langdetect samples n-grams at random: a fixed seed makes results repeatable
+LANGUAGE_DETECT_MAX_CHARS = 2000  # characters of an email read for detection (the opening is enough)
+LANGUAGE_CACHE_ENTRIES = 4096  # detected languages kept per process, keyed by text hash
+
+# Enrollment Document Upload Configuration
+UPLOAD_DIR = "./uploads"  # uploaded PDF/DOCX files are streamed here before extraction
+UPLOAD_MAX_MB = 50  # maximum request size for uploads
+UPLOAD_WORKERS = 2  # background threads extracting and indexing uploads
+JOB_TTL = 3600  # seconds a finished background job stays pollable before it is dropped
 
 # Email System Configuration
 EMAIL_CHECK_INTERVAL = 300  # seconds (5 minutes)
@@ -3,8 +3,24 @@ Document loader for various file formats
 """
 
 import os
-from typing import List
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterator, List, Optional
 from pathlib import Path
+import config
+
+
+def _load_in_worker(documents_dir: str, file_path: str) -> List[dict]:
+    """Extract one file's page/paragraph records in a worker process"""
+    return list(DocumentLoader(documents_dir).iter_records(file_path))
+
+
+def _kill_executor(executor: ProcessPoolExecutor):
+    """Shut down a pool without waiting for stuck extractions"""
+    for process in list((getattr(executor, '_processes', None) or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
 
 
 class DocumentLoader:
@@ -21,29 +37,11 @@ class DocumentLoader:
     
     def load_pdf(self, file_path: str) -> str:
         """Load a PDF file"""
-        try:
-            from pypdf import PdfReader
-            reader = PdfReader(file_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-        except ImportError:
-            print("pypdf not installed. Install with: pip install pypdf")
-            return ""
+        return "".join(record['text'] + "\n" for record in self.iter_pdf_pages(file_path))
     
     def load_docx(self, file_path: str) -> str:
         """Load a Word document"""
-        try:
-            from docx import Document
-            doc = Document(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text
-        except ImportError:
-            print("python-docx not installed. Install with: pip install python-docx")
-            return ""
+        return "".join(record['text'] + "\n" for record in self.iter_docx_paragraphs(file_path))
     
     def load_document(self, file_path: str) -> str:
         """Load a document based on its extension"""
@@ -59,6 +57,189 @@ class DocumentLoader:
             print(f"Unsupported file format: {ext}")
             return ""
     
+    def iter_txt_paragraphs(self, file_path: str) -> Iterator[dict]:
+        """Yield {'text', 'paragraph'} records of a text file, reading line by line"""
+        with open(file_path, 'r', encoding='utf-8') as f:
+            paragraph = 0
+            lines = []
+            for line in f:
+                if line.strip():
+                    lines.append(line)
+                    continue
+                if lines:
+                    yield {'text': "".join(lines).strip(), 'paragraph': paragraph}
+                    paragraph += 1
+                    lines = []
+            if lines:
+                yield {'text': "".join(lines).strip(), 'paragraph': paragraph}
+    
+    def iter_pdf_pages(self, file_path: str) -> Iterator[dict]:
+        """Yield {'text', 'page'} records of a PDF, one page at a time (1-based)"""
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            print("pypdf not installed. Install with: pip install pypdf")
+            return
+        
+        reader = PdfReader(file_path)
+        for page_number, page in enumerate(reader.pages, 1):
+            yield {'text': page.extract_text() or "", 'page': page_number}
+    
+    def iter_docx_paragraphs(self, file_path: str) -> Iterator[dict]:
+        """Yield {'text', 'paragraph'} records of a Word document"""
+        try:
+            from docx import Document
+        except ImportError:
+            print("python-docx not installed. Install with: pip install python-docx")
+            return
+        
+        doc = Document(file_path)
+        for index, paragraph in enumerate(doc.paragraphs):
+            yield {'text': paragraph.text, 'paragraph': index}
+    
+    def iter_records(self, file_path: str) -> Iterator[dict]:
+        """
+        Stream a document as page/paragraph records with source offsets
+        
+        PDF records carry 'page', DOCX and TXT records carry 'paragraph'.
+        Empty records are skipped.
+        """
+        ext = Path(file_path).suffix.lower()
+        
+        if ext == '.txt':
+            records = self.iter_txt_paragraphs(file_path)
+        elif ext == '.pdf':
+            records = self.iter_pdf_pages(file_path)
+        elif ext == '.docx':
+            records = self.iter_docx_paragraphs(file_path)
+        else:
+            print(f"Unsupported file format: {ext}")
+            return
+        
+        for record in records:
+            if record['text'].strip():
+                yield record
+    
+    def list_files(self) -> List[str]:
+        """Paths of the files in the documents directory"""
+        if not os.path.exists(self.documents_dir):
+            print(f"Documents directory not found: {self.documents_dir}")
+            return []
+        
+        paths = (os.path.join(self.documents_dir, name) for name in os.listdir(self.documents_dir))
+        return [path for path in paths if os.path.isfile(path)]
+    
+    def iter_documents_parallel(self, max_workers: int = config.LOADER_WORKERS,
+                                timeout: float = config.LOADER_FILE_TIMEOUT,
+                                paths: Optional[List[str]] = None) -> Iterator[dict]:
+        """
+        Extract documents in a process pool and yield them in completion order
+        
+        At most max_workers files are in flight, so each one starts as soon as
+        it is submitted and its deadline is measured from submission. When a
+        file exceeds the timeout it is skipped and the pool is replaced (its
+        worker can't be interrupted); the other in-flight files are retried.
+        
+        Args:
+            max_workers: Number of extraction processes
+            timeout: Seconds allowed per file
+            paths: Files to load (default: the whole documents directory)
+        
+        Yields:
+            Dicts with 'filename', 'records' (see iter_records) and 'path'
+        """
+        queue = deque(self.list_files() if paths is None else paths)
+        loaded = 0
+        timed_out = []
+        failed = []
+        
+        while queue:
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+            in_flight = {}
+            restart = False
+            
+            try:
+                while (queue or in_flight) and not restart:
+                    while queue and len(in_flight) < max_workers:
+                        path = queue.popleft()
+                        future = executor.submit(_load_in_worker, self.documents_dir, path)
+                        in_flight[future] = (path, time.monotonic() + timeout)
+                    
+                    next_deadline = min(deadline for _, deadline in in_flight.values())
+                    done, _ = wait(in_flight, timeout=max(0.0, next_deadline - time.monotonic()),
+                                   return_when=FIRST_COMPLETED)
+                    
+                    for future in done:
+                        path, _ = in_flight.pop(future)
+                        filename = os.path.basename(path)
+                        try:
+                            records = future.result()
+                        except Exception as e:
+                            print(f"❌ Error loading {filename}: {e}")
+                            failed.append(filename)
+                            continue
+                        
+                        print(f"Loaded: {filename}")
+                        if records:
+                            loaded += 1
+                            yield {
+                                'filename': filename,
+                                'records': records,
+                                'path': path
+                            }
+                    
+                    now = time.monotonic()
+                    for future, (path, deadline) in list(in_flight.items()):
+                        if deadline <= now and not future.done():
+                            print(f"⏱ Timeout loading {os.path.basename(path)} after {timeout}s, skipped")
+                            timed_out.append(os.path.basename(path))
+                            del in_flight[future]
+                            restart = True
+                
+                # Retry the healthy in-flight files in a fresh pool
+                queue.extendleft(path for path, _ in in_flight.values())
+            finally:
+                _kill_executor(executor)
+        
+        print(f"\nLoaded {loaded} documents ({len(timed_out)} timed out, {len(failed)} failed)")
+    
+    def iter_documents(self, paths: Optional[List[str]] = None) -> Iterator[dict]:
+        """
+        Serially stream the documents directory, one file in memory at a time
+        
+        A file's records are read in full before it is yielded, as in
+        iter_documents_parallel, so an unreadable or corrupt file is skipped
+        (and not yielded, hence retried by the next incremental run) instead
+        of failing in the middle of chunking and embedding.
+        
+        Args:
+            paths: Files to load (default: the whole documents directory)
+        
+        Yields:
+            Dicts with 'filename', 'records' and 'path'
+        """
+        loaded = 0
+        failed = []
+        for file_path in (self.list_files() if paths is None else paths):
+            filename = os.path.basename(file_path)
+            print(f"Loading: {filename}")
+            try:
+                records = list(self.iter_records(file_path))
+            except Exception as e:
+                print(f"❌ Error loading {filename}: {e}")
+                failed.append(filename)
+                continue
+            
+            if records:
+                loaded += 1
+                yield {
+                    'filename': filename,
+                    'records': records,
+                    'path': file_path
+                }
+        
+        print(f"\nLoaded {loaded} documents ({len(failed)} failed)")
+    
     def load_all_documents(self) -> List[dict]:
         """Load all documents from the documents directory"""
         documents = []
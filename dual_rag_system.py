@@ -6,9 +6,14 @@ Uses two separate knowledge bases:
 """
 
 from vector_store import VectorStore
-from local_llm import LocalLLM
 from api_llm import ApiLLM
 from language_detector import LanguageDetector
+from llm_cache import get_generation_cache, SemanticAnswerCache
+from text_chunker import chunk_hash
+from prompt_budget import PromptBudget
+from collections import Counter
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import config
 
 
@@ -47,9 +52,12 @@ class DualRAGSystem:
         if config.USE_API_LLM:
             self.llm = ApiLLM()
         else:
+            from local_llm import LocalLLM  # torch and transformers are only imported in local mode
             self.llm = LocalLLM()
         
         self.language_detector = LanguageDetector()
+        self.generation_cache = get_generation_cache() if config.LLM_CACHE_ENABLED else None
+        self.answer_cache = SemanticAnswerCache(workspace_id) if config.SEMANTIC_CACHE_ENABLED else None
         
         print("\n" + "=" * 60)
         print("✓ Dual RAG System Pronto!")
@@ -78,32 +86,148 @@ class DualRAGSystem:
         
         self.historical_emails_store.add_documents(chunks)
     
-    def index_enrollment_document(self, doc_data):
+    def index_enrollment_document(self, doc_data, progress=None):
         """
         Index an enrollment document
         
+        Documents carrying a 'doc_id' go through update_enrollment_document,
+        so a later edit can reuse the chunks that did not change.
+        
         Args:
             doc_data: Dict with 'content', 'metadata'
+            progress: Optional callback, see update_enrollment_document
+        
+        Returns:
+            Dict with 'added', 'removed', 'reused' chunk counts
         """
+        if doc_data.get('doc_id') is not None:
+            return self.update_enrollment_document(doc_data, progress=progress)
+        
         # Chunk large documents
         from text_chunker import TextChunker
         chunker = TextChunker()
         
         documents = [{
             'content': doc_data['content'],  # Changed from 'text' to 'content'
-            'metadata': {
-                'type': 'enrollment_doc',
-                'title': doc_data.get('title', 'Untitled'),
-                'document_type': doc_data.get('document_type', 'general'),
-                'country': doc_data.get('country', 'ALL'),
-                'program': doc_data.get('program', 'ALL'),
-                'language': doc_data.get('language', 'it'),
-                'priority': doc_data.get('priority', 'medium')
-            }
+            'metadata': self._enrollment_metadata(doc_data)
         }]
         
-        chunks = chunker.chunk_documents(documents)
-        self.enrollment_docs_store.add_documents(chunks)
+        total = self.enrollment_docs_store.add_document_batches(chunker.iter_chunk_batches(documents))
+        print(f"Created {total} chunks from {len(documents)} documents")
+        return {'added': total, 'removed': 0, 'reused': 0}
+    
+    def update_enrollment_document(self, doc_data, progress=None):
+        """
+        Re-index an enrollment document, embedding only the chunks that changed
+        
+        The content is re-chunked with content-defined boundaries and each chunk
+        is matched by hash against the chunks already stored for 'doc_id':
+        matches are kept (metadata refreshed, no embedding), stored chunks with
+        no match are removed, and new chunks are embedded in batches.
+        
+        Args:
+            doc_data: Dict with 'doc_id', 'content' and metadata fields
+            progress: Optional callback progress(added_chunks), called after each embedded batch
+        
+        Returns:
+            Dict with 'added', 'removed', 'reused' chunk counts
+        """
+        from text_chunker import TextChunker, chunk_hash
+        chunker = TextChunker(mode=config.ENROLLMENT_CHUNKING_MODE)
+        store = self.enrollment_docs_store
+        doc_id = doc_data['doc_id']
+        base_metadata = self._enrollment_metadata(doc_data)
+        base_metadata['doc_id'] = doc_id
+        
+        # Stored references for this document (own chunks or merged duplicates)
+        existing = Counter()
+        for source in store.find_sources(doc_id=doc_id):
+            existing[source.get('chunk_hash')] += 1
+            source.update(base_metadata)
+        
+        # First pass: hashes only, to find what to keep and what is stale
+        # before anything new can be merged into a stale chunk
+        pending = Counter(existing)
+        reused = 0
+        for chunk in chunker.iter_chunks(doc_data['content']):
+            h = chunk_hash(chunk['text'])
+            if pending[h] > 0:
+                pending[h] -= 1
+                reused += 1
+        stale = {h: n for h, n in pending.items() if n > 0}
+        removed = store.remove_sources({'doc_id': doc_id}, hash_counts=stale, save=False)
+        
+        # Second pass: embed the chunks that are not already stored
+        keep = Counter(existing)
+        keep.subtract(stale)
+        added = 0
+        batch = []
+        for chunk in chunker.iter_chunks(doc_data['content']):
+            h = chunk_hash(chunk['text'])
+            if keep[h] > 0:
+                keep[h] -= 1
+                continue
+            
+            batch.append({'text': chunk['text'], 'metadata': dict(base_metadata, chunk_hash=h)})
+            if len(batch) >= config.EMBEDDING_BATCH_SIZE:
+                store.add_documents(batch, save=False)
+                added += len(batch)
+                batch = []
+                if progress:
+                    progress(added)
+        
+        if batch:
+            store.add_documents(batch, save=False)
+            added += len(batch)
+            if progress:
+                progress(added)
+        
+        store.save()
+        if removed:
+            self._invalidate_answer_cache()
+        
+        print(f"♻️ Documento {doc_id}: {reused} chunk riutilizzati, {added} aggiunti, {removed} rimossi")
+        return {'added': added, 'removed': removed, 'reused': reused}
+    
+    def remove_enrollment_document(self, doc_id):
+        """
+        Remove all chunks of an enrollment document from the index
+        
+        Chunks shared with other documents (identical text) are kept for them.
+        
+        Returns:
+            Number of chunk references removed
+        """
+        removed = self.enrollment_docs_store.remove_sources({'doc_id': doc_id})
+        if removed:
+            self._invalidate_answer_cache()
+        return removed
+    
+    def _invalidate_answer_cache(self):
+        """Drop cached answers citing chunks that are no longer indexed"""
+        if self.answer_cache is None:
+            return
+        
+        valid_chunk_ids = {
+            chunk_hash(text)
+            for store in (self.historical_emails_store, self.enrollment_docs_store, self.corrections_store)
+            for text in store.documents
+        }
+        dropped = self.answer_cache.prune(valid_chunk_ids)
+        if dropped:
+            print(f"🧹 Cache risposte: {dropped} risposte invalidate")
+    
+    def _enrollment_metadata(self, doc_data):
+        """Chunk metadata for an enrollment document"""
+        return {
+            'type': 'enrollment_doc',
+            'title': doc_data.get('title', 'Untitled'),
+            'document_type': doc_data.get('document_type', 'general'),
+            'country': doc_data.get('country', 'ALL'),
+            'program': doc_data.get('program', 'ALL'),
+            'language': doc_data.get('language', 'it'),
+            'priority': doc_data.get('priority', 'medium')
+        }
     
     def index_correction(self, correction_data):
         """
@@ -129,7 +253,8 @@ class DualRAGSystem:
         
         self.corrections_store.add_documents(chunks)
     
-    def generate_email_response(self, incoming_email, top_k_style=2, top_k_facts=3, top_k_corrections=2):
+    def generate_email_response(self, incoming_email, top_k_style=2, top_k_facts=3, top_k_corrections=2,
+                                regenerate=False, time_limit=None):
         """
         Generate response to incoming email using dual RAG
         
@@ -137,71 +262,263 @@ class DualRAGSystem:
             incoming_email: Dict with email details
             top_k_style: Number of historical emails to retrieve
             top_k_facts: Number of enrollment docs to retrieve
+            regenerate: Skip the generation cache and call the LLM again
+            time_limit: Seconds the LLM call may take, retries included (web requests); None = no limit
         
         Returns:
             Dict with response and metadata
         """
+        generation = self._prepare_generation(incoming_email, top_k_style, top_k_facts, top_k_corrections)
+        response = self._generate(generation, regenerate, time_limit)
+        return self._build_result(generation, response)
+    
+    def generate_email_response_stream(self, incoming_email, top_k_style=2, top_k_facts=3, top_k_corrections=2,
+                                       regenerate=False, time_limit=None):
+        """
+        Stream the response to an incoming email as it is generated
+        
+        Retrieval and prompt building are the same as generate_email_response.
+        A cached response is sent as a single piece. time_limit caps the time
+        until the LLM starts streaming.
+        
+        Yields:
+            ('token', text) for each generated piece, then ('done', result)
+            where result is the dict generate_email_response would return
+        """
+        generation = self._prepare_generation(incoming_email, top_k_style, top_k_facts, top_k_corrections)
+        
+        cached = None if regenerate else self._cache_lookup(generation)
+        if cached is not None:
+            yield 'token', cached
+            yield 'done', self._build_result(generation, cached)
+            return
+        
+        pieces = []
+        for piece in self.llm.generate_stream(generation['prompt'], prefix=generation['prompt_prefix'],
+                                              segments=generation['prompt_segments'], time_limit=time_limit):
+            pieces.append(piece)
+            yield 'token', piece
+        
+        response = "".join(pieces).strip()
+        self._cache_store(generation, response)
+        yield 'done', self._build_result(generation, response)
+    
+    def _generate(self, generation, regenerate=False, time_limit=None):
+        """LLM call for a prepared generation, through the generation cache"""
+        cached = None if regenerate else self._cache_lookup(generation)
+        if cached is not None:
+            return cached
+        
+        response = self.llm.generate(generation['prompt'], prefix=generation['prompt_prefix'],
+                                     segments=generation['prompt_segments'], time_limit=time_limit)
+        self._cache_store(generation, response)
+        return response
+    
+    def _cache_key(self, prompt):
+        """Generation cache key for a prompt with the current LLM settings"""
+        return self.generation_cache.make_key(
+            self.llm.provider, self.llm.model_name, self.llm.temperature, config.MAX_NEW_TOKENS, prompt
+        )
+    
+    def _cache_lookup(self, generation):
+        """Cached response for the generation's prompt, or for a near-identical email, if any"""
+        response = None
+        
+        if self.generation_cache is not None:
+            response = self.generation_cache.get(self._cache_key(generation['prompt']))
+            if response is not None:
+                print(f"⚡ Risposta dalla cache (hit rate {self.generation_cache.stats()['hit_rate']:.0%})")
+        
+        if response is None and self.answer_cache is not None:
+            response = self.answer_cache.lookup(
+                generation['query_vector'], generation['chunk_ids'], generation['context_key']
+            )
+        
+        generation['cached'] = response is not None
+        return response
+    
+    def _cache_store(self, generation, response):
+        """Remember a generated response for the generation's prompt and email"""
+        if not response:
+            return
+        if self.generation_cache is not None:
+            self.generation_cache.set(self._cache_key(generation['prompt']), response)
+        if self.answer_cache is not None:
+            self.answer_cache.add(
+                generation['query_vector'], generation['chunk_ids'], generation['context_key'], response
+            )
+    
+    def generate_email_responses(self, incoming_emails, max_workers=config.BATCH_GENERATION_WORKERS,
+                                 top_k_style=2, top_k_facts=3, top_k_corrections=2, regenerate=False):
+        """
+        Generate responses for many emails
+        
+        Retrieval runs in batch (one embedding pass, one FAISS search per
+        knowledge base) and prompts are built up front; only the LLM calls
+        run concurrently, at most max_workers at a time.
+        
+        Args:
+            incoming_emails: List of email dicts as for generate_email_response
+            max_workers: Maximum concurrent LLM calls
+            regenerate: Skip the generation cache and call the LLM again
+        
+        Yields:
+            (position, result, error) in completion order: result is the dict
+            generate_email_response would return, or None with the exception
+        """
+        contexts = self._retrieve_batch(
+            [email['body'] for email in incoming_emails],
+            top_k_style, top_k_facts, top_k_corrections
+        )
+        languages = self._email_languages(incoming_emails)
+        generations = [
+            self._prepare_generation(email, top_k_style, top_k_facts, top_k_corrections, retrieved=ctx,
+                                     language=language)
+            for email, ctx, language in zip(incoming_emails, contexts, languages)
+        ]
+        
+        # A local model without its batching scheduler generates one prompt at a time anyway
+        workers = max_workers if config.USE_API_LLM or getattr(self.llm, 'scheduler', None) else 1
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='generate') as executor:
+            futures = {
+                executor.submit(self._generate, generation, regenerate): position
+                for position, generation in enumerate(generations)
+            }
+            for future in as_completed(futures):
+                position = futures[future]
+                try:
+                    response = future.result()
+                except Exception as e:
+                    yield position, None, e
+                    continue
+                yield position, self._build_result(generations[position], response), None
+    
+    def _email_languages(self, incoming_emails):
+        """Stored detected_language of each email; emails without one are detected in a single batch"""
+        languages = [email.get('detected_language') for email in incoming_emails]
+        missing = [i for i, lang in enumerate(languages) if not lang or lang == 'unknown']
+        if missing:
+            detected = self.language_detector.detect_many([incoming_emails[i]['body'] for i in missing])
+            for i, lang in zip(missing, detected):
+                languages[i] = lang
+        return languages
+    
+    def _retrieve_batch(self, email_bodies, top_k_style, top_k_facts, top_k_corrections):
+        """(query_vector, historical, factual, corrections) for each email body"""
+        if not email_bodies:
+            return []
+        
+        print(f"\n🔍 Ricerca contesti per {len(email_bodies)} email...")
+        # All stores share the same embedding model: embed the queries once
+        query_vectors = self.historical_emails_store.embed_texts(email_bodies)
+        
+        return list(zip(
+            query_vectors,
+            self.historical_emails_store.search_vectors(query_vectors, top_k=top_k_style),
+            self.enrollment_docs_store.search_vectors(query_vectors, top_k=top_k_facts),
+            self.corrections_store.search_vectors(query_vectors, top_k=top_k_corrections)
+        ))
+    
+    def _prepare_generation(self, incoming_email, top_k_style, top_k_facts, top_k_corrections, retrieved=None,
+                            language=None):
+        """
+        Detect language, retrieve contexts and build the prompt
+        
+        retrieved: precomputed (query_vector, historical, factual, corrections) from _retrieve_batch
+        language: precomputed language code from _email_languages
+        """
         email_body = incoming_email['body']
         email_subject = incoming_email.get('subject', '')
         
-        # Detect language
-        detected_lang = self.language_detector.detect_language(email_body)
+        # Detect language (or reuse the one stored when the email was fetched)
+        detected_lang = language or self._email_languages([incoming_email])[0]
         student_info = self.language_detector.extract_student_info(email_body)
         
         print(f"\n🌐 Lingua rilevata: {self.language_detector.get_language_name(detected_lang)}")
         print(f"📋 Tipo query: {', '.join(student_info['query_type']) if student_info['query_type'] else 'generale'}")
         
-        # Retrieve from historical emails (for style)
-        print(f"\n🔍 Ricerca email storiche...")
-        historical_contexts = self.historical_emails_store.search(
-            email_body,
-            top_k=top_k_style
-        )
-        print(f"   → Trovate {len(historical_contexts)} email")
-        
-        # Retrieve from enrollment documents (for facts)
-        print(f"📚 Ricerca documenti iscrizione...")
-        print(f"   → Vector store contiene: {self.enrollment_docs_store.get_collection_count()} chunks")
-        factual_contexts = self.enrollment_docs_store.search(
-            email_body,
-            top_k=top_k_facts
-        )
-        print(f"   → Trovati {len(factual_contexts)} documenti")
-        if factual_contexts:
-            for i, ctx in enumerate(factual_contexts[:2], 1):  # Show first 2
-                print(f"   → Doc {i}: distanza={ctx.get('distance', 'N/A'):.3f}, titolo={ctx['metadata'].get('title', 'N/A')}")
+        if retrieved is not None:
+            query_vector, historical_contexts, factual_contexts, correction_contexts = retrieved
         else:
-            print(f"   ⚠ Nessun documento trovato - possibile problema di ricerca")
-        
-        # Retrieve from corrections (to prevent mistakes)
-        print(f"🔧 Ricerca correzioni...")
-        print(f"   → Vector store contiene: {self.corrections_store.get_collection_count()} chunks")
-        correction_contexts = self.corrections_store.search(
-            email_body,
-            top_k=top_k_corrections
-        )
-        print(f"   → Trovate {len(correction_contexts)} correzioni")
-        
-        # Build prompts
-        style_context = self._format_style_context(historical_contexts)
-        factual_context = self._format_factual_context(factual_contexts)
+            # All stores share the same embedding model: embed the email once
+            query_vector = self.historical_emails_store.embed_text(email_body)
+            
+            # Retrieve from historical emails (for style)
+            print(f"\n🔍 Ricerca email storiche...")
+            historical_contexts = self.historical_emails_store.search_vectors(
+                [query_vector],
+                top_k=top_k_style
+            )[0]
+            print(f"   → Trovate {len(historical_contexts)} email")
+            
+            # Retrieve from enrollment documents (for facts)
+            print(f"📚 Ricerca documenti iscrizione...")
+            print(f"   → Vector store contiene: {self.enrollment_docs_store.get_collection_count()} chunks")
+            factual_contexts = self.enrollment_docs_store.search_vectors(
+                [query_vector],
+                top_k=top_k_facts
+            )[0]
+            print(f"   → Trovati {len(factual_contexts)} documenti")
+            if factual_contexts:
+                for i, ctx in enumerate(factual_contexts[:2], 1):  # Show first 2
+                    print(f"   → Doc {i}: distanza={ctx.get('distance', 'N/A'):.3f}, titolo={ctx['metadata'].get('title', 'N/A')}")
+            else:
+                print(f"   ⚠ Nessun documento trovato - possibile problema di ricerca")
+            
+            # Retrieve from corrections (to prevent mistakes)
+            print(f"🔧 Ricerca correzioni...")
+            print(f"   → Vector store contiene: {self.corrections_store.get_collection_count()} chunks")
+            correction_contexts = self.corrections_store.search_vectors(
+                [query_vector],
+                top_k=top_k_corrections
+            )[0]
+            print(f"   → Trovate {len(correction_contexts)} correzioni")
         
         # Generate response with language instruction
         lang_instruction = self.language_detector.get_system_prompt_for_language(detected_lang)
+        base_instruction = self._get_base_instruction()
         
-        prompt = self._build_generation_prompt(
+        segments = self._build_generation_prompt(
             email_body,
             email_subject,
-            style_context,
-            factual_context,
+            historical_contexts,
+            factual_contexts,
             lang_instruction,
-            correction_contexts  # Pass corrections to prompt builder
+            correction_contexts,  # Pass corrections to prompt builder
+            base_instruction=base_instruction
         )
+        prompt = "".join(text for text, _ in segments)
         
         print(f"\n🤖 Generazione risposta in {self.language_detector.get_language_name(detected_lang)}...")
         print(f"📏 Lunghezza prompt: {len(prompt)} caratteri")
         print(f"📝 Contesti recuperati: {len(historical_contexts)} storici, {len(factual_contexts)} documenti")
-        response = self.llm.generate(prompt)
+        
+        # Semantic answer cache: same retrieved chunks under the same instructions
+        chunk_ids = frozenset(
+            chunk_hash(ctx['text'])
+            for ctx in historical_contexts + factual_contexts + correction_contexts
+        )
+        context_key = hashlib.sha1(f"{detected_lang}\n{base_instruction}".encode('utf-8')).hexdigest()
+        
+        return {
+            'prompt': prompt,
+            'prompt_prefix': self._prompt_prefix(base_instruction, lang_instruction),
+            'prompt_segments': segments,
+            'query_vector': query_vector,
+            'chunk_ids': chunk_ids,
+            'context_key': context_key,
+            'detected_language': detected_lang,
+            'student_info': student_info,
+            'historical_contexts': historical_contexts,
+            'factual_contexts': factual_contexts
+        }
+    
+    def _build_result(self, generation, response):
+        """Assemble the generate_email_response result for a generated text"""
+        prompt = generation['prompt']
+        historical_contexts = generation['historical_contexts']
+        factual_contexts = generation['factual_contexts']
         
         # DEBUG: Show prompt details
         print(f"\n{'='*60}")
@@ -215,47 +532,51 @@ class DualRAGSystem:
         
         return {
             'response': response,
-            'detected_language': detected_lang,
+            'detected_language': generation['detected_language'],
             'confidence_score': confidence,
-            'query_type': student_info['query_type'],
+            'cached': generation.get('cached', False),
+            'query_type': generation['student_info']['query_type'],
             'retrieved_contexts': {
                 'historical': [ctx['text'] for ctx in historical_contexts],
                 'factual': [ctx['text'] for ctx in factual_contexts]
             }
         }
     
-    def _format_style_context(self, contexts):
-        """Format historical email contexts - simplified"""
+    def _format_style_context(self, contexts, budget):
+        """Response part of the best historical email, as a style example, if budget remains"""
         if not contexts:
-            return "No previous examples available."
+            return ""
         
         # Only use the BEST match to avoid confusion
-        ctx = contexts[0]
-        return f"Example response style:\n{ctx['text'][:400]}...\n"
+        example = contexts[0]['text'].split("RISPOSTA:", 1)[-1]
+        return budget.fit(example, limit=self._prompt_limit(config.PROMPT_STYLE_MAX_TOKENS))
     
-    def _format_factual_context(self, contexts):
-        """Format enrollment document contexts - provide more detail"""
-        if not contexts:
+    def _format_factual_context(self, contexts, budget):
+        """Enrollment document chunks in rank order, whole sentences, within budget"""
+        formatted = self._fit_contexts(contexts, budget, self._prompt_limit(config.PROMPT_FACTS_MAX_TOKENS))
+        if not formatted:
             return "No specific information available."
-        
-        # Combine top 2 chunks with REDUCED size to fit in prompt
-        formatted = ""
-        for ctx in contexts[:2]:  # Reduced from 3 to 2
-            formatted += f"{ctx['text'][:300]}\n\n"  # Reduced from 500 to 300
-        return formatted.strip()
+        return "\n\n".join(formatted)
     
-    def _format_corrections_context(self, contexts):
+    def _format_corrections_context(self, contexts, budget):
         """Format corrections to highlight common mistakes"""
-        if not contexts:
-            return ""
-        
-        formatted = ""
-        for ctx in contexts:
-            formatted += f"- {ctx['text'][:400]}\n"
-        return formatted.strip()
+        formatted = self._fit_contexts(contexts, budget, self._prompt_limit(config.PROMPT_CORRECTIONS_MAX_TOKENS))
+        return "\n".join(f"- {text}" for text in formatted)
     
-    def _build_generation_prompt(self, email_body, subject, style_ctx, factual_ctx, lang_instruction, correction_contexts=None):
-        """Build the complete prompt for LLM"""
+    def _fit_contexts(self, contexts, budget, limit):
+        """Texts of contexts, in order, until the section limit or the budget runs out"""
+        formatted = []
+        for ctx in contexts or []:
+            before = budget.remaining
+            text = budget.fit(ctx['text'], limit=limit)
+            if not text:
+                break
+            limit -= before - budget.remaining
+            formatted.append(text)
+        return formatted
+    
+    def _get_base_instruction(self):
+        """Workspace system prompt from the database, or the default one"""
         # Get custom system prompt from database if available
         from database import SystemSettings, db
         custom_prompt = None
@@ -272,28 +593,98 @@ class DualRAGSystem:
         
         # Use custom prompt if available, otherwise use default
         if custom_prompt:
-            base_instruction = custom_prompt
-        else:
-            base_instruction = "Sei un assistente email per ITS MAKER ACADEMY FOUNDATION."
+            return custom_prompt
+        return "Sei un assistente email per ITS MAKER ACADEMY FOUNDATION."
+    
+    def _build_generation_prompt(self, email_body, subject, historical_contexts, factual_contexts, lang_instruction,
+                                 correction_contexts=None, base_instruction=None):
+        """
+        Build the complete prompt for LLM within the token budget
         
+        Tokens are counted with the LLM's tokenizer. The instructions and the
+        student's email are always included; the remaining budget goes to
+        corrections, then facts, then the style example. Section caps grow
+        with the LLM's context window (see _prompt_limit).
+        
+        Returns:
+            (text, shrink order) segments of the prompt, see _prompt_segments
+        """
+        if base_instruction is None:
+            base_instruction = self._get_base_instruction()
+        
+        budget = PromptBudget(self.llm.count_tokens,
+                              min(self._prompt_limit(config.PROMPT_MAX_TOKENS), self.llm.max_input_tokens))
+        budget.reserve("".join(text for text, _ in self._prompt_segments(base_instruction, lang_instruction,
+                                                                         "", "", "", "")))
+        
+        email_text = budget.fit(email_body, limit=self._prompt_limit(config.PROMPT_EMAIL_MAX_TOKENS), partial=True)
+        if len(email_text) < len(email_body.strip()):
+            email_text += " [...]"
+        
+        corrections_ctx = self._format_corrections_context(correction_contexts, budget)
+        factual_ctx = self._format_factual_context(factual_contexts, budget)
+        style_ctx = self._format_style_context(historical_contexts, budget)
+        
+        segments = self._prompt_segments(base_instruction, lang_instruction, factual_ctx, corrections_ctx, style_ctx,
+                                         email_text)
+        prompt = "".join(text for text, _ in segments)
+        print(f"📏 Prompt: {self.llm.count_tokens(prompt)} token (budget {budget.max_tokens})")
+        return segments
+    
+    def _prompt_limit(self, tokens):
+        """
+        A PROMPT_* cap scaled to the LLM's context window
+        
+        The caps are sized for the local model (LOCAL_MAX_INPUT_TOKENS); API
+        models with a much larger window get proportionally larger caps, so a
+        long email or full context chunks are not cut needlessly.
+        """
+        return int(tokens * max(1.0, self.llm.max_input_tokens / config.LOCAL_MAX_INPUT_TOKENS))
+    
+    def _prompt_segments(self, base_instruction, lang_instruction, factual_ctx, corrections_ctx, style_ctx, email_text):
+        """
+        Fill the prompt template, as (text, shrink order) segments
+        
+        If the prompt still exceeds a local model's context window (e.g. a
+        very long system prompt), the style example is shrunk first, then the
+        facts, then the corrections (order None: never shrunk).
+        """
         # Build prompt with corrections to prevent mistakes
         corrections_text = ""
-        if correction_contexts:
-            corrections_text = "\n\nIMPORTANT CORRECTIONS:\n" + self._format_corrections_context(correction_contexts)
+        if corrections_ctx:
+            corrections_text = "\n\nIMPORTANT CORRECTIONS:\n" + corrections_ctx
+        
+        style_text = ""
+        if style_ctx:
+            style_text = f"\n\nEXAMPLE RESPONSE STYLE:\n{style_ctx}"
         
         # Simplified, more compact prompt
-        prompt = f"""{base_instruction}
+        return [
+            (self._prompt_prefix(base_instruction, lang_instruction), None),
+            (factual_ctx, 1),
+            (corrections_text, 2),
+            (style_text, 0),
+            (f"""
 
-{lang_instruction}
+STUDENT EMAIL:
+{email_text}
 
-INFORMATION:
-{factual_ctx}{corrections_text}
+RESPONSE:""", None)
+        ]
+    
+    def _prompt_prefix(self, base_instruction, lang_instruction):
+        """Start of every prompt for a workspace and language (its KV cache is reused by a local LLM)"""
+        return f"""{base_instruction}
 
-STUDENT EMAIL:
-{email_body}
+{lang_instruction}
 
-RESPONSE:"""
-        return prompt
+INFORMATION:
+"""
+    
+    def invalidate_prompt_prefix(self):
+        """Forget cached prompt prefixes after the workspace system prompt changed"""
+        if hasattr(self.llm, 'clear_prefix_cache'):
+            self.llm.clear_prefix_cache()
     
     def _calculate_confidence(self, historical_contexts, factual_contexts):
         """
@@ -321,10 +712,15 @@ RESPONSE:"""
             'historical_emails_count': self.historical_emails_store.get_collection_count(),
             'enrollment_docs_count': self.enrollment_docs_store.get_collection_count(),
             'llm_model': config.LLM_MODEL,
-            'embedding_model': config.EMBEDDING_MODEL
+            'embedding_model': config.EMBEDDING_MODEL,
+            'generation_cache': self.generation_cache.stats() if self.generation_cache else None,
+            'answer_cache': self.answer_cache.stats() if self.answer_cache else None,
+            'llm_usage': self.llm.usage() if hasattr(self.llm, 'usage') else None
         }
     
     def clear_all(self):
         """Clear both knowledge bases"""
         self.historical_emails_store.clear_collection()
         self.enrollment_docs_store.clear_collection()
+        if self.answer_cache is not None:
+            self.answer_cache.clear()
@@ -0,0 +1,234 @@
+"""
+Retrieval recall evaluation: exact FAISS search vs approximate index configurations
+
+Runs offline against the FAISS files in config.CHROMA_DB_DIR. A sample of
+historical email queries is held out, exact flat top-k over the workspace's
+stored vectors is taken as ground truth, and every alternate configuration
+is scored on recall@k, MRR and per-query latency.
+
+Usage:
+    python evaluate_retrieval.py --workspace 1
+    python evaluate_retrieval.py --workspace 1 --corpus historical --k 5 \\
+        --config "HNSW32:efSearch=64" --config "IVF16,Flat:nprobe=4"
+"""
+
+import argparse
+import os
+import pickle
+import random
+import time
+
+import faiss
+import numpy as np
+
+import config
+
+
+# Index factory strings evaluated when no --config is given.
+# Search-time parameters follow the colon (faiss.ParameterSpace syntax).
+DEFAULT_CONFIGS = [
+    "HNSW32:efSearch=16",
+    "HNSW32:efSearch=64",
+    "IVF16,Flat:nprobe=1",
+    "IVF16,Flat:nprobe=4",
+    "SQ8",
+    "IVF16,SQ8:nprobe=4",
+]
+
+CORPUS_COLLECTIONS = {
+    'historical': config.COLLECTION_HISTORICAL_EMAILS,
+    'enrollment': config.COLLECTION_ENROLLMENT_DOCS,
+    'corrections': config.COLLECTION_CORRECTIONS,
+}
+
+
+def collection_name_for(base_name, workspace_id):
+    """Workspace-specific collection name, same scheme as DualRAGSystem"""
+    if workspace_id:
+        return f"{base_name}_ws{workspace_id}"
+    return base_name
+
+
+def load_collection(collection_name):
+    """
+    Load stored vectors and texts for a collection
+
+    Returns:
+        (vectors as float32 array of shape (n, d), list of document texts)
+    """
+    index_path = os.path.join(config.CHROMA_DB_DIR, f"{collection_name}.index")
+    metadata_path = os.path.join(config.CHROMA_DB_DIR, f"{collection_name}.pkl")
+
+    if not os.path.exists(index_path) or not os.path.exists(metadata_path):
+        raise FileNotFoundError(f"Collection '{collection_name}' not found in {config.CHROMA_DB_DIR}")
+
+    index = faiss.read_index(index_path)
+    with open(metadata_path, 'rb') as f:
+        documents = pickle.load(f)['documents']
+
+    vectors = index.reconstruct_n(0, index.ntotal).astype('float32')
+    return vectors, documents
+
+
+def extract_student_query(historical_text):
+    """Recover the student question from an indexed historical email"""
+    prefix = "DOMANDA STUDENTE:"
+    body = historical_text
+    if body.startswith(prefix):
+        body = body[len(prefix):]
+    return body.split("\n\nRISPOSTA:", 1)[0].strip()
+
+
+def build_queries(historical_vectors, historical_docs, sample_ids, embed_queries):
+    """
+    Build query vectors for the held-out historical emails
+
+    With embed_queries the student question is re-embedded on its own (this is
+    what production searches with); otherwise the stored vectors are reused so
+    no embedding model is needed.
+    """
+    if not embed_queries:
+        return historical_vectors[sample_ids]
+
+    from vector_store import get_embedding_model
+    texts = [extract_student_query(historical_docs[i]) for i in sample_ids]
+    embeddings = get_embedding_model().encode(texts, convert_to_tensor=False)
+    return np.asarray(embeddings, dtype='float32')
+
+
+def parse_config(spec):
+    """Split 'IVF16,Flat:nprobe=4' into ('IVF16,Flat', 'nprobe=4')"""
+    factory, _, params = spec.partition(':')
+    return factory.strip(), params.strip()
+
+
+def build_index(factory, params, vectors):
+    """Train and fill an index from a faiss factory string"""
+    index = faiss.index_factory(vectors.shape[1], factory, faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    if params:
+        faiss.ParameterSpace().set_index_parameters(index, params)
+    return index
+
+
+def timed_search(index, queries, k):
+    """Search one query at a time (as the app does) and record latencies in ms"""
+    results = np.full((len(queries), k), -1, dtype='int64')
+    latencies = []
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, ids = index.search(queries[i:i + 1], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results[i] = ids[0]
+    return results, np.asarray(latencies)
+
+
+def score(ground_truth, results, k):
+    """
+    Compute recall@k and MRR against exact results
+
+    recall@k: overlap between approximate and exact top-k, averaged over queries
+    MRR: reciprocal rank of the exact nearest neighbour in the approximate list
+    """
+    recalls = []
+    reciprocal_ranks = []
+    for exact, approx in zip(ground_truth, results):
+        exact_set = set(int(i) for i in exact if i >= 0)
+        approx_list = [int(i) for i in approx if i >= 0]
+        if not exact_set:
+            continue
+        recalls.append(len(exact_set.intersection(approx_list)) / len(exact_set))
+
+        best = int(exact[0])
+        rank = approx_list.index(best) + 1 if best in approx_list else None
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+
+    if not recalls:
+        return 0.0, 0.0
+    return float(np.mean(recalls)), float(np.mean(reciprocal_ranks))
+
+
+def evaluate(workspace_id, corpus, k, sample_size, configs, embed_queries, seed):
+    """Run the comparison and print a report"""
+    historical_name = collection_name_for(config.COLLECTION_HISTORICAL_EMAILS, workspace_id)
+    corpus_name = collection_name_for(CORPUS_COLLECTIONS[corpus], workspace_id)
+
+    print(f"\n📂 Caricamento '{historical_name}'...")
+    historical_vectors, historical_docs = load_collection(historical_name)
+    if len(historical_docs) == 0:
+        print("⚠ Nessuna email storica: impossibile costruire le query")
+        return
+
+    rng = random.Random(seed)
+    sample_ids = sorted(rng.sample(range(len(historical_docs)), min(sample_size, len(historical_docs))))
+
+    if corpus == 'historical':
+        # Hold the sampled emails out of the corpus so they can't match themselves
+        held_out = set(sample_ids)
+        keep = [i for i in range(len(historical_docs)) if i not in held_out]
+        corpus_vectors = historical_vectors[keep]
+    else:
+        print(f"📂 Caricamento '{corpus_name}'...")
+        corpus_vectors, _ = load_collection(corpus_name)
+
+    if len(corpus_vectors) == 0:
+        print("⚠ Corpus vuoto dopo l'esclusione delle query")
+        return
+
+    queries = build_queries(historical_vectors, historical_docs, sample_ids, embed_queries)
+    k = min(k, len(corpus_vectors))
+
+    print(f"✓ {len(queries)} query, {len(corpus_vectors)} vettori nel corpus, dim={corpus_vectors.shape[1]}, k={k}")
+
+    exact = faiss.IndexFlatL2(corpus_vectors.shape[1])
+    exact.add(corpus_vectors)
+    ground_truth, exact_latency = timed_search(exact, queries, k)
+
+    rows = [("Flat (exact)", 1.0, 1.0, exact_latency)]
+    for spec in configs:
+        factory, params = parse_config(spec)
+        try:
+            index = build_index(factory, params, corpus_vectors)
+        except Exception as e:
+            # e.g. IVF with more lists than vectors
+            print(f"⚠ Configurazione '{spec}' saltata: {e}")
+            continue
+        results, latency = timed_search(index, queries, k)
+        recall, mrr = score(ground_truth, results, k)
+        rows.append((spec, recall, mrr, latency))
+
+    print(f"\n{'Config':<28}{'recall@' + str(k):>10}{'MRR':>8}{'mean ms':>10}{'p95 ms':>10}")
+    print("-" * 66)
+    for name, recall, mrr, latency in rows:
+        print(f"{name:<28}{recall:>10.3f}{mrr:>8.3f}{latency.mean():>10.3f}{np.percentile(latency, 95):>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare exact and approximate FAISS retrieval offline")
+    parser.add_argument('--workspace', type=int, default=None, help="Workspace id (omit for global collections)")
+    parser.add_argument('--corpus', choices=sorted(CORPUS_COLLECTIONS), default='enrollment',
+                        help="Collection searched by the held-out queries")
+    parser.add_argument('--k', type=int, default=config.TOP_K_RESULTS, help="Top-k to evaluate")
+    parser.add_argument('--sample', type=int, default=100, help="Number of held-out historical queries")
+    parser.add_argument('--config', action='append', dest='configs',
+                        help="faiss factory string with optional ':params', repeatable")
+    parser.add_argument('--stored-vectors', action='store_true',
+                        help="Reuse stored historical vectors as queries instead of embedding the question")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    evaluate(
+        workspace_id=args.workspace,
+        corpus=args.corpus,
+        k=args.k,
+        sample_size=args.sample,
+        configs=args.configs or DEFAULT_CONFIGS,
+        embed_queries=not args.stored_vectors,
+        seed=args.seed
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,25 @@ Flask API backend per sistema email RAG
 Interfaccia in italiano
 """
 
-from flask import Flask, request, jsonify, send_from_directory, session
+from flask import Flask, request, jsonify, send_from_directory, session, Response, stream_with_context
 from flask_cors import CORS
 from database import db, Email, EmailDraft, HistoricalEmail, EnrollmentDocument, SystemSettings, Correction, Workspace, User
 from email_connector import EmailConnector
 from dual_rag_system import DualRAGSystem
+from document_loader import DocumentLoader
 from language_detector import LanguageDetector
+from api_llm import LLMError, LLMRateLimitError
+from llm_cache import answer_cache_path
+from werkzeug.utils import secure_filename
+from concurrent.futures import ThreadPoolExecutor
 import config
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
+import threading
+import time
+import uuid
+import click
 from functools import wraps
 
 
@@ -20,6 +29,7 @@ app = Flask(__name__, static_folder='frontend/build', static_url_path='')
 app.config['SECRET_KEY'] = config.FLASK_SECRET_KEY
 app.config['SQLALCHEMY_DATABASE_URI'] = config.DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['MAX_CONTENT_LENGTH'] = config.UPLOAD_MAX_MB * 1024 * 1024
 
 # CORS Configuration - Allow credentials and specific origins in production
 allowed_origins = os.getenv('ALLOWED_ORIGINS', '*').split(',')
@@ -42,8 +52,20 @@ def sanitize_text(text, max_len=None):
 # Initialize components
 email_connector = None
 rag_systems = {}  # Cache of workspace-specific RAG systems
+rag_systems_lock = threading.Lock()  # gthread workers: one RAG system per workspace, even on concurrent first use
 language_detector = LanguageDetector()
 
+# Background jobs for uploaded enrollment documents
+upload_jobs = {}  # job_id -> stato del job (interrogato dal frontend)
+upload_jobs_lock = threading.Lock()
+upload_executor = ThreadPoolExecutor(max_workers=config.UPLOAD_WORKERS, thread_name_prefix='upload')
+indexing_lock = threading.Lock()  # vector store writes (upload jobs and request threads) one at a time
+
+# Background batch draft generation
+batch_jobs = {}  # job_id -> stato del job (interrogato dal frontend)
+batch_jobs_lock = threading.Lock()
+batch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='batch')  # one batch at a time
+
 
 def cleanup_workspace_vector_stores(workspace_id):
     """Delete FAISS index files for a workspace"""
@@ -72,6 +94,13 @@ def cleanup_workspace_vector_stores(workspace_id):
             deleted_count += 1
             print(f"  ✓ Rimosso: {pattern}.pkl")
     
+    # Cached answers cite the deleted chunks
+    answer_cache = answer_cache_path(workspace_id)
+    if os.path.exists(answer_cache):
+        os.remove(answer_cache)
+        deleted_count += 1
+        print(f"  ✓ Rimosso: {os.path.basename(answer_cache)}")
+    
     return deleted_count
 
 
@@ -118,27 +147,28 @@ def get_rag_system(workspace_id):
     if not workspace:
         raise ValueError(f"Workspace {workspace_id} does not exist")
     
-    if workspace_id not in rag_systems:
-        print(f"🔄 Inizializzazione RAG system per workspace {workspace_id}...")
-        try:
-            rag_systems[workspace_id] = DualRAGSystem(workspace_id=workspace_id)
-        except Exception as e:
-            # If RAG initialization fails (corrupted indexes), try to recover
-            print(f"⚠️ Errore inizializzazione RAG system: {e}")
-            print(f"🔧 Tentativo di recupero eliminando vector stores corrotti...")
-            
-            # Delete corrupted vector store files
-            cleanup_workspace_vector_stores(workspace_id)
-            
-            # Try again with fresh indexes
+    with rag_systems_lock:
+        if workspace_id not in rag_systems:
+            print(f"🔄 Inizializzazione RAG system per workspace {workspace_id}...")
             try:
                 rag_systems[workspace_id] = DualRAGSystem(workspace_id=workspace_id)
-                print(f"✓ RAG system ricreato con successo")
-            except Exception as retry_error:
-                print(f"❌ Impossibile inizializzare RAG system: {retry_error}")
-                raise ValueError(f"Cannot initialize RAG system for workspace {workspace_id}: {retry_error}")
-    
-    return rag_systems[workspace_id]
+            except Exception as e:
+                # If RAG initialization fails (corrupted indexes), try to recover
+                print(f"⚠️ Errore inizializzazione RAG system: {e}")
+                print(f"🔧 Tentativo di recupero eliminando vector stores corrotti...")
+                
+                # Delete corrupted vector store files
+                cleanup_workspace_vector_stores(workspace_id)
+                
+                # Try again with fresh indexes
+                try:
+                    rag_systems[workspace_id] = DualRAGSystem(workspace_id=workspace_id)
+                    print(f"✓ RAG system ricreato con successo")
+                except Exception as retry_error:
+                    print(f"❌ Impossibile inizializzare RAG system: {retry_error}")
+                    raise ValueError(f"Cannot initialize RAG system for workspace {workspace_id}: {retry_error}")
+        
+        return rag_systems[workspace_id]
 
 
 def init_components():
@@ -421,8 +451,8 @@ def delete_user(user_id):
         # Delete user's workspaces and their vector stores
         for workspace in user.workspaces:
             # Clean up vector stores
-            if workspace.id in rag_systems:
-                del rag_systems[workspace.id]
+            with rag_systems_lock:
+                rag_systems.pop(workspace.id, None)
             cleanup_workspace_vector_stores(workspace.id)
         
         db.session.delete(user)
@@ -456,17 +486,20 @@ def fetch_emails():
         
         emails = email_connector.fetch_unread_emails()
         
+        # Controlla se già esistono
+        emails = [
+            email_data for email_data in emails
+            if not Email.query.filter_by(message_id=email_data['message_id']).first()
+        ]
+        
+        # Rileva le lingue in un'unica chiamata
+        bodies = [sanitize_text(email_data.get('body', ''), max_len=20000) for email_data in emails]
+        languages = language_detector.detect_many(bodies)
+        
         nuove_email = []
-        for email_data in emails:
-            # Controlla se già esiste
-            exists = Email.query.filter_by(message_id=email_data['message_id']).first()
-            if exists:
-                continue
-            
-            # Rileva lingua ed estrai info
-            body_clean = sanitize_text(email_data.get('body', ''), max_len=20000)
+        for email_data, body_clean, detected_lang in zip(emails, bodies, languages):
+            # Estrai info
             subject_clean = sanitize_text(email_data.get('subject', ''), max_len=500)
-            detected_lang = language_detector.detect_language(body_clean)
             student_info = language_detector.extract_student_info(body_clean)
             
             # Crea record email
@@ -559,8 +592,9 @@ def generate_manual_response():
             'sender_name': sanitize_text(data.get('mittente', 'Manuale'), max_len=255)
         }
         
-        # Genera risposta
-        result = rag_system.generate_email_response(incoming_email)
+        # Genera risposta (rigenera=True ignora la cache)
+        result = rag_system.generate_email_response(incoming_email, regenerate=bool(data.get('rigenera')),
+                                                    time_limit=config.API_REQUEST_DEADLINE)
         
         return jsonify({
             'successo': True,
@@ -569,6 +603,11 @@ def generate_manual_response():
             'confidenza': result['confidence_score']
         })
     
+    except LLMRateLimitError as e:
+        return jsonify({'errore': str(e)}), 429
+    except LLMError as e:
+        print(f"❌ Errore LLM: {e}")
+        return jsonify({'errore': str(e)}), 502
     except Exception as e:
         print(f"❌ Errore generazione manuale: {e}")
         import traceback
@@ -598,11 +637,13 @@ def generate_draft(email_id):
             'subject': email.subject,
             'body': email.body,
             'sender_email': email.sender_email,
-            'sender_name': email.sender_name
+            'sender_name': email.sender_name,
+            'detected_language': email.detected_language
         }
         
-        # Genera risposta
-        result = rag_system.generate_email_response(incoming_email)
+        # Genera risposta (rigenera=True ignora la cache)
+        result = rag_system.generate_email_response(incoming_email, regenerate=bool(data.get('rigenera')),
+                                                    time_limit=config.API_REQUEST_DEADLINE)
         
         # Crea bozza
         draft = EmailDraft(
@@ -622,11 +663,246 @@ def generate_draft(email_id):
             'bozza': draft.to_dict()
         })
     
+    except LLMRateLimitError as e:
+        db.session.rollback()
+        return jsonify({'errore': str(e)}), 429
+    except LLMError as e:
+        db.session.rollback()
+        print(f"❌ Errore LLM: {e}")
+        return jsonify({'errore': str(e)}), 502
     except Exception as e:
         db.session.rollback()
         return jsonify({'errore': str(e)}), 500
 
 
+@app.route('/api/drafts/generate/<int:email_id>/stream', methods=['GET'])
+def generate_draft_stream(email_id):
+    """Genera bozza in streaming (Server-Sent Events): token man mano, bozza salvata alla fine"""
+    email = Email.query.get_or_404(email_id)
+    workspace_id = request.args.get('workspace_id', 1, type=int)
+    regenerate = request.args.get('rigenera', '').lower() in ('1', 'true')
+    
+    # Controlla se bozza già esiste
+    if email.draft:
+        return jsonify({'errore': 'Bozza già esistente'}), 400
+    
+    incoming_email = {
+        'subject': email.subject,
+        'body': email.body,
+        'sender_email': email.sender_email,
+        'sender_name': email.sender_name,
+        'detected_language': email.detected_language
+    }
+    
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    
+    def stream():
+        try:
+            rag_system = get_rag_system(workspace_id)
+            events = rag_system.generate_email_response_stream(incoming_email, regenerate=regenerate,
+                                                               time_limit=config.API_REQUEST_DEADLINE)
+            for kind, payload in events:
+                if kind == 'token':
+                    yield sse('token', {'testo': payload})
+                    continue
+                
+                result = payload
+                draft = EmailDraft(
+                    email_id=email.id,
+                    generated_response=result['response'],
+                    response_language=result['detected_language'],
+                    retrieved_contexts=json.dumps(result['retrieved_contexts']),
+                    confidence_score=result['confidence_score'],
+                    status='pending'
+                )
+                db.session.add(draft)
+                db.session.commit()
+                yield sse('done', {'successo': True, 'bozza': draft.to_dict()})
+        
+        except LLMRateLimitError as e:
+            db.session.rollback()
+            yield sse('errore', {'errore': str(e), 'status': 429})
+        except LLMError as e:
+            db.session.rollback()
+            print(f"❌ Errore LLM: {e}")
+            yield sse('errore', {'errore': str(e), 'status': 502})
+        except Exception as e:
+            db.session.rollback()
+            yield sse('errore', {'errore': str(e), 'status': 500})
+    
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def generate_drafts_batch(workspace_id, email_ids=None, max_workers=config.BATCH_GENERATION_WORKERS, progress=None,
+                          regenerate=False):
+    """
+    Genera bozze per più email (richiede app context)
+    
+    Retrieval in batch, chiamate LLM concorrenti (al massimo max_workers),
+    ogni bozza salvata appena pronta: un errore non fa perdere le altre.
+    
+    Args:
+        workspace_id: Workspace del RAG system
+        email_ids: Email da elaborare (None = tutte quelle senza bozza)
+        max_workers: Chiamate LLM contemporanee
+        progress: Callback opzionale con il riepilogo aggiornato
+        regenerate: Ignora la cache delle generazioni
+    
+    Returns:
+        Riepilogo con totale, completate, errori e throughput
+    """
+    rag_system = get_rag_system(workspace_id)
+    
+    query = Email.query.filter(~Email.draft.has())
+    if email_ids is not None:
+        query = query.filter(Email.id.in_(email_ids))
+    emails = query.order_by(Email.received_date.asc()).all()
+    
+    incoming_emails = [{
+        'subject': email.subject,
+        'body': email.body,
+        'sender_email': email.sender_email,
+        'sender_name': email.sender_name,
+        'detected_language': email.detected_language
+    } for email in emails]
+    email_ids_by_position = [email.id for email in emails]
+    
+    summary = {
+        'totale': len(emails),
+        'completate': 0,
+        'errori': 0,
+        'saltate': len(set(email_ids)) - len(emails) if email_ids is not None else 0,
+        'dalla_cache': 0,
+        'secondi': 0.0,
+        'email_al_minuto': 0.0
+    }
+    if progress:
+        progress(dict(summary))
+    
+    start = time.perf_counter()
+    for position, result, error in rag_system.generate_email_responses(incoming_emails, max_workers=max_workers,
+                                                                      regenerate=regenerate):
+        email_id = email_ids_by_position[position]
+        if error is None:
+            try:
+                draft = EmailDraft(
+                    email_id=email_id,
+                    generated_response=result['response'],
+                    response_language=result['detected_language'],
+                    retrieved_contexts=json.dumps(result['retrieved_contexts']),
+                    confidence_score=result['confidence_score'],
+                    status='pending'
+                )
+                db.session.add(draft)
+                db.session.commit()
+                summary['completate'] += 1
+                summary['dalla_cache'] += int(result['cached'])
+            except Exception as e:
+                db.session.rollback()
+                error = e
+        
+        if error is not None:
+            summary['errori'] += 1
+            print(f"❌ Email {email_id}: {error}")
+        
+        elapsed = time.perf_counter() - start
+        done = summary['completate'] + summary['errori']
+        summary['secondi'] = round(elapsed, 1)
+        summary['email_al_minuto'] = round(done * 60 / elapsed, 1) if elapsed > 0 else 0.0
+        if progress:
+            progress(dict(summary))
+    
+    return summary
+
+
+def update_batch_job(job_id, **fields):
+    """Aggiorna lo stato di un job di generazione in batch"""
+    with batch_jobs_lock:
+        batch_jobs[job_id].update(fields, aggiornato=datetime.utcnow().isoformat())
+
+
+def process_batch_job(job_id, workspace_id, email_ids, max_workers, regenerate):
+    """Genera le bozze di un job in batch (eseguito in background)"""
+    with app.app_context():
+        try:
+            update_batch_job(job_id, stato='in_corso', messaggio='Generazione bozze...')
+            summary = generate_drafts_batch(
+                workspace_id,
+                email_ids,
+                max_workers=max_workers,
+                progress=lambda stats: update_batch_job(job_id, **stats),
+                regenerate=regenerate
+            )
+            update_batch_job(
+                job_id,
+                stato='completato',
+                messaggio=f"{summary['completate']} bozze generate, {summary['errori']} errori"
+            )
+        
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            update_batch_job(job_id, stato='errore', errore=str(e))
+        
+        finally:
+            db.session.remove()
+
+
+@app.route('/api/drafts/generate-batch', methods=['POST'])
+def generate_drafts_batch_endpoint():
+    """Genera bozze per più email in background (email_ids, oppure tutte quelle senza bozza)"""
+    try:
+        data = request.json or {}
+        workspace_id = data.get('workspace_id', 1)
+        email_ids = data.get('email_ids')
+        max_workers = data.get('concorrenza', config.BATCH_GENERATION_WORKERS)
+        
+        if email_ids is not None and (not isinstance(email_ids, list) or
+                                      not all(isinstance(i, int) for i in email_ids)):
+            return jsonify({'errore': 'email_ids deve essere una lista di id'}), 400
+        if not isinstance(max_workers, int) or max_workers < 1:
+            return jsonify({'errore': 'concorrenza deve essere un intero positivo'}), 400
+        # Il client può solo ridurre la concorrenza configurata sul server
+        max_workers = min(max_workers, config.BATCH_GENERATION_WORKERS)
+        if not Workspace.query.get(workspace_id):
+            return jsonify({'errore': f'Workspace {workspace_id} non trovato'}), 404
+        
+        job_id = uuid.uuid4().hex
+        with batch_jobs_lock:
+            prune_finished_jobs(batch_jobs)
+            batch_jobs[job_id] = {
+                'job_id': job_id,
+                'stato': 'in_coda',
+                'messaggio': 'In attesa di elaborazione',
+                'workspace_id': workspace_id,
+                'concorrenza': max_workers,
+                'creato': datetime.utcnow().isoformat()
+            }
+        
+        batch_executor.submit(process_batch_job, job_id, workspace_id, email_ids, max_workers,
+                              bool(data.get('rigenera')))
+        
+        return jsonify({'successo': True, 'job_id': job_id}), 202
+    
+    except Exception as e:
+        return jsonify({'errore': str(e)}), 500
+
+
+@app.route('/api/drafts/generate-batch/<job_id>', methods=['GET'])
+def get_batch_job(job_id):
+    """Stato di avanzamento di una generazione in batch"""
+    with batch_jobs_lock:
+        job = batch_jobs.get(job_id)
+        if not job:
+            return jsonify({'errore': 'Job non trovato'}), 404
+        return jsonify({'successo': True, 'job': dict(job)})
+
+
 @app.route('/api/drafts/<int:draft_id>', methods=['GET'])
 def get_draft(draft_id):
     """Ottieni bozza"""
@@ -857,14 +1133,15 @@ def add_historical_email():
         
         # Indicizza nel RAG
         rag_system = get_rag_system(workspace_id)
-        rag_system.index_historical_email({
-            'query': email.student_query,
-            'response': email.response,
-            'language': email.language,
-            'country': email.country,
-            'program': email.program,
-            'tags': email.tags
-        })
+        with indexing_lock:
+            rag_system.index_historical_email({
+                'query': email.student_query,
+                'response': email.response,
+                'language': email.language,
+                'country': email.country,
+                'program': email.program,
+                'tags': email.tags
+            })
         
         email.indexed = True
         db.session.commit()
@@ -944,15 +1221,17 @@ def add_enrollment_doc():
         print(f"📄 Lunghezza contenuto: {len(doc.content)} caratteri")
         try:
             rag_system = get_rag_system(workspace_id)
-            rag_system.index_enrollment_document({
-                'content': doc.content,
-                'title': doc.title,
-                'document_type': doc.document_type,
-                'country': doc.country,
-                'program': doc.program,
-                'language': doc.language,
-                'priority': doc.priority
-            })
+            with indexing_lock:
+                rag_system.index_enrollment_document({
+                    'doc_id': doc.id,
+                    'content': doc.content,
+                    'title': doc.title,
+                    'document_type': doc.document_type,
+                    'country': doc.country,
+                    'program': doc.program,
+                    'language': doc.language,
+                    'priority': doc.priority
+                })
             doc.indexed = True
             db.session.commit()
             print(f"✓ Documento indicizzato con successo")
@@ -971,6 +1250,156 @@ def add_enrollment_doc():
         return jsonify({'errore': str(e)}), 500
 
 
+ALLOWED_UPLOAD_EXTENSIONS = {'.pdf', '.docx', '.txt'}
+
+
+def prune_finished_jobs(jobs):
+    """Rimuovi i job terminati da più di config.JOB_TTL secondi (chiamare con il lock dei job)"""
+    cutoff = datetime.utcnow() - timedelta(seconds=config.JOB_TTL)
+    expired = [
+        job_id for job_id, job in jobs.items()
+        if job['stato'] in ('completato', 'errore')
+        and datetime.fromisoformat(job.get('aggiornato', job['creato'])) < cutoff
+    ]
+    for job_id in expired:
+        del jobs[job_id]
+
+
+def update_upload_job(job_id, **fields):
+    """Aggiorna lo stato di un job di upload"""
+    with upload_jobs_lock:
+        upload_jobs[job_id].update(fields, aggiornato=datetime.utcnow().isoformat())
+
+
+def process_uploaded_document(job_id, file_path, form):
+    """Estrai, salva e indicizza un documento caricato (eseguito in background)"""
+    with app.app_context():
+        try:
+            # Estrazione testo pagina per pagina
+            update_upload_job(job_id, stato='estrazione', messaggio='Estrazione testo...')
+            loader = DocumentLoader(config.UPLOAD_DIR)
+            parts = []
+            for record in loader.iter_records(file_path):
+                parts.append(record['text'])
+                update_upload_job(job_id, sezioni_estratte=len(parts))
+            content = sanitize_text("\n".join(parts), max_len=200000)
+            
+            if not content:
+                raise ValueError('Nessun testo estraibile dal file')
+            
+            doc = EnrollmentDocument(
+                workspace_id=form['workspace_id'],
+                title=form['titolo'],
+                filename=form['nome_file'],
+                content=content,
+                document_type=form['tipo_documento'],
+                country=form['paese'],
+                program=form['programma'],
+                language=form['lingua'],
+                priority=form['priorita']
+            )
+            db.session.add(doc)
+            db.session.commit()
+            update_upload_job(job_id, documento_id=doc.id, caratteri=len(content))
+            
+            # Chunking ed embedding
+            update_upload_job(job_id, stato='indicizzazione', messaggio='Indicizzazione...')
+            with indexing_lock:
+                rag_system = get_rag_system(form['workspace_id'])
+                stats = rag_system.index_enrollment_document({
+                    'doc_id': doc.id,
+                    'content': doc.content,
+                    'title': doc.title,
+                    'document_type': doc.document_type,
+                    'country': doc.country,
+                    'program': doc.program,
+                    'language': doc.language,
+                    'priority': doc.priority
+                }, progress=lambda added: update_upload_job(job_id, chunk_indicizzati=added))
+            
+            doc.indexed = True
+            db.session.commit()
+            
+            update_upload_job(
+                job_id,
+                stato='completato',
+                messaggio='Documento indicizzato',
+                chunk_indicizzati=stats['added'] + stats['reused'],
+                documento=doc.to_dict()
+            )
+            print(f"✓ Upload {job_id} completato: {doc.title}")
+        
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Errore upload {job_id}: {e}")
+            import traceback
+            traceback.print_exc()
+            update_upload_job(job_id, stato='errore', errore=str(e))
+        
+        finally:
+            db.session.remove()
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+
+@app.route('/api/enrollment-docs/upload', methods=['POST'])
+def upload_enrollment_doc():
+    """Carica un file PDF/DOCX: estrazione e indicizzazione in background"""
+    try:
+        uploaded = request.files.get('file')
+        if not uploaded or not uploaded.filename:
+            return jsonify({'errore': 'File richiesto'}), 400
+        
+        original_name = secure_filename(uploaded.filename)
+        ext = os.path.splitext(original_name)[1].lower()
+        if ext not in ALLOWED_UPLOAD_EXTENSIONS:
+            return jsonify({'errore': f'Formato non supportato: {ext}'}), 400
+        
+        form = {
+            'workspace_id': request.form.get('workspace_id', 1, type=int),
+            'titolo': sanitize_text(request.form.get('titolo') or original_name, max_len=255),
+            'nome_file': sanitize_text(original_name, max_len=255),
+            'tipo_documento': sanitize_text(request.form.get('tipo_documento', 'general'), max_len=100),
+            'paese': sanitize_text(request.form.get('paese', 'ALL'), max_len=100),
+            'programma': sanitize_text(request.form.get('programma', 'ALL'), max_len=255),
+            'lingua': sanitize_text(request.form.get('lingua', 'it'), max_len=10),
+            'priorita': sanitize_text(request.form.get('priorita', 'medium'), max_len=20)
+        }
+        
+        # Salva il file su disco a blocchi (senza caricarlo tutto in memoria)
+        job_id = uuid.uuid4().hex
+        os.makedirs(config.UPLOAD_DIR, exist_ok=True)
+        file_path = os.path.join(config.UPLOAD_DIR, f"{job_id}{ext}")
+        uploaded.save(file_path)
+        
+        with upload_jobs_lock:
+            prune_finished_jobs(upload_jobs)
+            upload_jobs[job_id] = {
+                'job_id': job_id,
+                'stato': 'in_coda',
+                'messaggio': 'In attesa di elaborazione',
+                'nome_file': original_name,
+                'creato': datetime.utcnow().isoformat()
+            }
+        
+        upload_executor.submit(process_uploaded_document, job_id, file_path, form)
+        
+        return jsonify({'successo': True, 'job_id': job_id}), 202
+    
+    except Exception as e:
+        return jsonify({'errore': str(e)}), 500
+
+
+@app.route('/api/enrollment-docs/upload/<job_id>', methods=['GET'])
+def get_upload_job(job_id):
+    """Stato di avanzamento di un upload"""
+    with upload_jobs_lock:
+        job = upload_jobs.get(job_id)
+        if not job:
+            return jsonify({'errore': 'Job non trovato'}), 404
+        return jsonify({'successo': True, 'job': dict(job)})
+
+
 @app.route('/api/enrollment-docs/<int:doc_id>', methods=['GET'])
 def get_enrollment_doc_detail(doc_id):
     """Ottieni dettagli completi documento iscrizione"""
@@ -1009,9 +1438,34 @@ def update_enrollment_doc(doc_id):
         
         db.session.commit()
         
+        # Re-indicizza solo i chunk modificati
+        stats = None
+        try:
+            rag_system = get_rag_system(doc.workspace_id)
+            with indexing_lock:
+                stats = rag_system.update_enrollment_document({
+                    'doc_id': doc.id,
+                    'content': doc.content,
+                    'title': doc.title,
+                    'document_type': doc.document_type,
+                    'country': doc.country,
+                    'program': doc.program,
+                    'language': doc.language,
+                    'priority': doc.priority
+                })
+            doc.indexed = True
+            db.session.commit()
+        except Exception as e:
+            print(f"❌ Errore re-indicizzazione incrementale: {e}")
+            import traceback
+            traceback.print_exc()
+        
         return jsonify({
             'successo': True,
-            'documento': doc.to_dict()
+            'documento': doc.to_dict(),
+            'chunk_riutilizzati': stats['reused'] if stats else 0,
+            'chunk_aggiunti': stats['added'] if stats else 0,
+            'chunk_rimossi': stats['removed'] if stats else 0
         })
     
     except Exception as e:
@@ -1024,9 +1478,18 @@ def delete_enrollment_doc(doc_id):
     """Elimina documento iscrizione"""
     try:
         doc = EnrollmentDocument.query.get_or_404(doc_id)
+        workspace_id = doc.workspace_id
         db.session.delete(doc)
         db.session.commit()
         
+        # Rimuovi i chunk del documento dal vector store
+        try:
+            rag_system = get_rag_system(workspace_id)
+            with indexing_lock:
+                rag_system.remove_enrollment_document(doc_id)
+        except Exception as e:
+            print(f"⚠ Impossibile rimuovere i chunk del documento {doc_id}: {e}")
+        
         return jsonify({'successo': True})
     
     except Exception as e:
@@ -1047,37 +1510,48 @@ def reindex_all_enrollment_docs():
         docs = EnrollmentDocument.query.filter_by(workspace_id=workspace_id).all()
         print(f"\n🔄 Re-indicizzazione {len(docs)} documenti per workspace {workspace_id}...")
         
-        success_count = 0
-        for doc in docs:
-            try:
-                print(f"📝 Indicizzazione: {doc.title}")
-                print(f"   📄 Lunghezza: {len(doc.content)} caratteri")
-                
-                rag_system.index_enrollment_document({
-                    'content': doc.content,
-                    'title': doc.title,
-                    'document_type': doc.document_type,
-                    'country': doc.country,
-                    'program': doc.program,
-                    'language': doc.language,
-                    'priority': doc.priority
-                })
-                
-                doc.indexed = True
-                success_count += 1
-                print(f"   ✓ Successo")
-            except Exception as e:
-                print(f"   ❌ Errore: {e}")
-                import traceback
-                traceback.print_exc()
-        
+        # Le scritture sul vector store non devono intrecciarsi con un upload in corso
+        with indexing_lock:
+            # Chunk indicizzati senza doc_id (versioni precedenti) non sono riconciliabili: rimuovili
+            legacy_removed = rag_system.enrollment_docs_store.remove_sources({'doc_id': None})
+            if legacy_removed:
+                print(f"🧹 Rimossi {legacy_removed} chunk senza riferimento al documento")
+            
+            success_count = 0
+            reused_count = 0
+            for doc in docs:
+                try:
+                    print(f"📝 Indicizzazione: {doc.title}")
+                    print(f"   📄 Lunghezza: {len(doc.content)} caratteri")
+                    
+                    stats = rag_system.index_enrollment_document({
+                        'doc_id': doc.id,
+                        'content': doc.content,
+                        'title': doc.title,
+                        'document_type': doc.document_type,
+                        'country': doc.country,
+                        'program': doc.program,
+                        'language': doc.language,
+                        'priority': doc.priority
+                    })
+                    
+                    doc.indexed = True
+                    success_count += 1
+                    reused_count += stats['reused']
+                    print(f"   ✓ Successo")
+                except Exception as e:
+                    print(f"   ❌ Errore: {e}")
+                    import traceback
+                    traceback.print_exc()
+            
         db.session.commit()
         print(f"\n✓ Re-indicizzati {success_count}/{len(docs)} documenti")
         
         return jsonify({
             'successo': True,
             'documenti_processati': len(docs),
-            'documenti_indicizzati': success_count
+            'documenti_indicizzati': success_count,
+            'chunk_riutilizzati': reused_count
         })
     
     except Exception as e:
@@ -1195,6 +1669,12 @@ def update_setting(key):
         
         db.session.commit()
         
+        if key == 'system_prompt':
+            # Cached prompt prefixes (local LLM) contain the old system prompt
+            for rag_workspace_id, rag_system in list(rag_systems.items()):
+                if not workspace_id or str(rag_workspace_id) == str(workspace_id):
+                    rag_system.invalidate_prompt_prefix()
+        
         return jsonify({
             'successo': True,
             'impostazione': setting.to_dict()
@@ -1250,14 +1730,15 @@ def add_correction():
         print(f"🔧 Indicizzazione correzione: {correction.title}")
         try:
             rag_system = get_rag_system(workspace_id)
-            rag_system.index_correction({
-                'title': correction.title,
-                'wrong_info': correction.wrong_info,
-                'correct_info': correction.correct_info,
-                'context': correction.context,
-                'category': correction.category,
-                'priority': correction.priority
-            })
+            with indexing_lock:
+                rag_system.index_correction({
+                    'title': correction.title,
+                    'wrong_info': correction.wrong_info,
+                    'correct_info': correction.correct_info,
+                    'context': correction.context,
+                    'category': correction.category,
+                    'priority': correction.priority
+                })
             correction.indexed = True
             db.session.commit()
             print(f"✓ Correzione indicizzata con successo")
@@ -1387,8 +1868,9 @@ def delete_workspace(workspace_id):
         workspace = Workspace.query.filter_by(id=workspace_id, user_id=user_id).first_or_404()
         
         # 1. Clean up RAG system from memory cache
-        if workspace_id in rag_systems:
-            del rag_systems[workspace_id]
+        with rag_systems_lock:
+            removed = rag_systems.pop(workspace_id, None)
+        if removed:
             print(f"🗑️ RAG system per workspace {workspace_id} rimosso dalla cache")
         
         # 2. Delete FAISS vector store files from disk
@@ -1516,6 +1998,27 @@ def health_check():
     }), 200
 
 
+# ============== CLI ==============
+
+@app.cli.command('generate-drafts')
+@click.option('--workspace', 'workspace_id', type=int, default=1, show_default=True, help='Workspace del RAG system')
+@click.option('--email-id', 'email_ids', type=int, multiple=True, help='Email da elaborare (ripetibile); default tutte quelle senza bozza')
+@click.option('--workers', type=int, default=config.BATCH_GENERATION_WORKERS, show_default=True, help='Chiamate LLM contemporanee')
+@click.option('--regenerate', is_flag=True, help='Ignora la cache delle generazioni')
+def generate_drafts_command(workspace_id, email_ids, workers, regenerate):
+    """Genera bozze per le email in attesa: flask --app flask_app generate-drafts"""
+    def report(stats):
+        done = stats['completate'] + stats['errori']
+        click.echo(f"📬 {done}/{stats['totale']} | ✓ {stats['completate']} | ✗ {stats['errori']} | "
+                   f"{stats['email_al_minuto']} email/min")
+    
+    summary = generate_drafts_batch(workspace_id, list(email_ids) or None, max_workers=workers, progress=report,
+                                    regenerate=regenerate)
+    click.echo(f"\n✓ Completato in {summary['secondi']}s: {summary['completate']} bozze "
+               f"({summary['dalla_cache']} dalla cache), {summary['errori']} errori, "
+               f"{summary['saltate']} già con bozza o inesistenti")
+
+
 # ============== INIZIALIZZAZIONE ==============
 
 with app.app_context():
@@ -39,6 +39,7 @@ function EmailDetail() {
   const [error, setError] = useState(null);
   const [message, setMessage] = useState(null);
   const [generating, setGenerating] = useState(false);
+  const [streamingText, setStreamingText] = useState('');
   const [isEditing, setIsEditing] = useState(false);
   const [editedResponse, setEditedResponse] = useState('');
   const [adminNotes, setAdminNotes] = useState('');
@@ -77,17 +78,33 @@ function EmailDetail() {
     }
   };
 
-  const handleGenerateDraft = async () => {
-    try {
-      setGenerating(true);
-      await axios.post(`/api/drafts/generate/${id}`);
+  const handleGenerateDraft = () => {
+    setGenerating(true);
+    setStreamingText('');
+
+    // Server-Sent Events: il testo appare man mano che viene generato
+    const source = new EventSource(`/api/drafts/generate/${id}/stream`);
+
+    source.addEventListener('token', (event) => {
+      const { testo } = JSON.parse(event.data);
+      setStreamingText((prev) => prev + testo);
+    });
+
+    source.addEventListener('done', async () => {
+      source.close();
       await loadEmail();
-      alert('Bozza generata con successo!');
-    } catch (err) {
-      alert('Errore nella generazione: ' + (err.response?.data?.errore || err.message));
-    } finally {
       setGenerating(false);
-    }
+      setStreamingText('');
+    });
+
+    const handleError = (event) => {
+      source.close();
+      setGenerating(false);
+      const detail = event.data ? JSON.parse(event.data).errore : 'connessione interrotta';
+      alert('Errore nella generazione: ' + detail);
+    };
+    source.addEventListener('errore', handleError);
+    source.onerror = handleError;
   };
 
   const handleUpdateDraft = async () => {
@@ -255,6 +272,14 @@ function EmailDetail() {
           >
             {generating ? 'Generazione in corso...' : 'Genera Bozza Risposta'}
           </Button>
+          {streamingText && (
+            <Typography
+              variant="body2"
+              sx={{ mt: 3, textAlign: 'left', whiteSpace: 'pre-wrap', fontFamily: 'monospace' }}
+            >
+              {streamingText}
+            </Typography>
+          )}
         </Paper>
       ) : (
         <Paper sx={{ p: 3 }}>
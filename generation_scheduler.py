@@ -0,0 +1,401 @@
+"""
+Continuous-batching scheduler for the local LLM
+
+One background thread owns the model. Requests from any number of threads
+are queued, and at every token boundary the scheduler admits waiting prompts
+into the running batch and drops finished sequences, so concurrent drafts
+share each forward pass instead of contending for the CPU with separate
+model.generate calls.
+
+Sequences of different lengths live in one left-padded KV cache with an
+attention mask; new prompts are prefilled in groups of similar length to keep
+padding (wasted compute) low. Prompts starting with a prefix held in a
+PrefixCache (e.g. the workspace system prompt) only prefill the rest. Only
+causal (decoder-only) models are supported.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from queue import Queue
+
+import torch
+
+import config
+
+
+# Prompts prefilled together differ in length by at most this factor
+PREFILL_LENGTH_RATIO = 1.25
+
+
+def cache_layers(cache):
+    """Per-layer (keys, values) tensors of a transformers cache object or legacy tuple"""
+    if hasattr(cache, 'layers'):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    if hasattr(cache, 'key_cache'):
+        return list(zip(cache.key_cache, cache.value_cache))
+    return [tuple(layer[:2]) for layer in cache]
+
+
+def model_cache(layers):
+    """Cache object the model accepts as past_key_values (new tensors are appended, layers stay untouched)"""
+    try:
+        from transformers import DynamicCache
+    except ImportError:
+        return tuple(layers)
+    cache = DynamicCache()
+    for index, (keys, values) in enumerate(layers):
+        cache.update(keys, values, index)
+    return cache
+
+
+class PrefixCache:
+    """LRU of KV caches of prompt prefixes: token ids -> per-layer (keys, values) with batch size 1"""
+
+    def __init__(self, model, max_entries=config.LOCAL_PREFIX_CACHE_ENTRIES, device=None):
+        self.model = model
+        self.max_entries = max_entries
+        self.device = device or config.DEVICE
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, prefix_ids):
+        """KV cache of prefix_ids (a tuple), computed with one forward pass on a miss"""
+        with self._lock:
+            layers = self._entries.get(prefix_ids)
+            if layers is not None:
+                self._entries.move_to_end(prefix_ids)
+                self.hits += 1
+                return layers
+            self.misses += 1
+
+        with torch.no_grad():
+            input_ids = torch.tensor([prefix_ids], device=self.device)
+            layers = cache_layers(self.model(input_ids=input_ids, use_cache=True).past_key_values)
+
+        with self._lock:
+            self._entries[prefix_ids] = layers
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return layers
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+
+class GenerationRequest:
+    """A queued prompt; result() blocks for the text, stream() yields it piece by piece"""
+
+    def __init__(self, input_ids, max_new_tokens, stream=False, prefix=()):
+        self.input_ids = input_ids
+        self.prefix = prefix  # leading input_ids whose KV cache comes from the PrefixCache
+        self.max_new_tokens = max_new_tokens
+        self.generated = []
+        self.seen = set(input_ids)  # token ids the repetition penalty applies to
+        self.future = Future()
+        self.pieces = Queue() if stream else None
+        self.emitted = ''
+        self.cancelled = False
+
+    def result(self):
+        return self.future.result()
+
+    def stream(self):
+        while True:
+            item = self.pieces.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def cancel(self):
+        """Stop generating (e.g. the streaming client went away)"""
+        self.cancelled = True
+
+
+class GenerationScheduler:
+    """Runs every generation of one causal model in a shared, continuously refilled batch"""
+
+    def __init__(self, model, tokenizer, temperature, top_p=0.9, repetition_penalty=1.1,
+                 max_batch_size=config.LOCAL_MAX_BATCH_SIZE, device=config.DEVICE, prefix_cache=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prefix_cache = prefix_cache
+        self.temperature = temperature
+        self.top_p = top_p
+        self.repetition_penalty = repetition_penalty
+        self.max_batch_size = max_batch_size
+        self.device = device
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+
+        self._waiting = deque()
+        self._condition = threading.Condition()
+
+        # Running batch: one row per request, all aligned on the right
+        self._running = []
+        self._cache = None  # per layer (keys, values), each [batch, heads, length, head_dim]
+        self._mask = None  # [batch, length], 0 on left padding
+        self._next_tokens = None  # [batch] sampled tokens not yet fed to the model
+
+        self._stats_lock = threading.Lock()
+        self.steps = 0
+        self.batch_rows = 0
+        self.tokens = 0
+        self.busy_seconds = 0.0
+
+        threading.Thread(target=self._loop, daemon=True, name='local-llm-scheduler').start()
+
+    def submit(self, input_ids, max_new_tokens, stream=False, prefix=()) -> GenerationRequest:
+        """
+        Queue a tokenized prompt (list of ids) for generation
+
+        prefix: leading ids of input_ids to take from the prefix cache
+        (ignored without one)
+        """
+        if self.prefix_cache is None or len(prefix) >= len(input_ids):
+            prefix = ()
+        request = GenerationRequest(list(input_ids), max_new_tokens, stream, tuple(prefix))
+        with self._condition:
+            self._waiting.append(request)
+            self._condition.notify()
+        return request
+
+    def stats(self) -> dict:
+        """Queue depth, mean batch size and aggregate tokens/sec since startup"""
+        with self._condition:
+            waiting = len(self._waiting)
+        with self._stats_lock:
+            return {
+                'running': len(self._running),
+                'waiting': waiting,
+                'steps': self.steps,
+                'mean_batch_size': round(self.batch_rows / self.steps, 2) if self.steps else 0.0,
+                'tokens': self.tokens,
+                'tokens_per_second': round(self.tokens / self.busy_seconds, 2) if self.busy_seconds else 0.0
+            }
+
+    # ============== SCHEDULER LOOP ==============
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while not self._waiting and not self._running:
+                    self._condition.wait()
+                admitted = []
+                while self._waiting and len(self._running) + len(admitted) < self.max_batch_size:
+                    admitted.append(self._waiting.popleft())
+
+            start = time.perf_counter()
+            try:
+                with torch.no_grad():
+                    if admitted:
+                        self._admit(admitted)
+                    if self._running:
+                        self._step()
+            except Exception as e:
+                print(f"❌ Errore generazione locale: {e}")
+                for request in self._running + [r for r in admitted if r not in self._running]:
+                    self._finish(request, error=e)
+                self._reset()
+            with self._stats_lock:
+                self.busy_seconds += time.perf_counter() - start
+
+    def _reset(self):
+        self._running = []
+        self._cache = None
+        self._mask = None
+        self._next_tokens = None
+
+    def _admit(self, requests):
+        """Prefill new prompts, grouped by shared prefix and similar length, and merge them into the batch"""
+        by_prefix = {}
+        for request in requests:
+            by_prefix.setdefault(request.prefix, []).append(request)
+
+        for prefix, same_prefix in by_prefix.items():
+            remaining = lambda r: len(r.input_ids) - len(prefix)
+            group = []
+            for request in sorted(same_prefix, key=remaining):
+                if group and remaining(request) > remaining(group[0]) * PREFILL_LENGTH_RATIO:
+                    self._prefill(group, prefix)
+                    group = []
+                group.append(request)
+            if group:
+                self._prefill(group, prefix)
+
+    def _prefill(self, requests, prefix=()):
+        """
+        One forward pass over the prompts of requests (after their shared prefix)
+
+        Rows are left-padded; with a prefix, the padding sits between the
+        cached prefix and the rest of the prompt, masked out like any other.
+        """
+        cached = len(prefix)
+        suffixes = [r.input_ids[cached:] for r in requests]
+        length = max(len(ids) for ids in suffixes)
+        input_ids = torch.full((len(requests), length), self.pad_token_id, dtype=torch.long)
+        mask = torch.zeros((len(requests), cached + length), dtype=torch.long)
+        mask[:, :cached] = 1
+        for row, ids in enumerate(suffixes):
+            input_ids[row, length - len(ids):] = torch.tensor(ids)
+            mask[row, cached + length - len(ids):] = 1
+        input_ids = input_ids.to(self.device)
+        mask = mask.to(self.device)
+        positions = (mask.cumsum(-1) - 1).clamp(min=0)[:, cached:]
+
+        past = None
+        if cached:
+            past = model_cache([
+                (k.expand(len(requests), -1, -1, -1), v.expand(len(requests), -1, -1, -1))
+                for k, v in self.prefix_cache.get(prefix)
+            ])
+        outputs = self.model(input_ids=input_ids, attention_mask=mask, position_ids=positions,
+                             past_key_values=past, use_cache=True)
+        cache = cache_layers(outputs.past_key_values)
+        next_tokens = self._sample(outputs.logits[:, -1, :], requests)
+
+        if self._running:
+            self._cache, self._mask = self._concat(self._cache, self._mask, cache, mask)
+            self._next_tokens = torch.cat([self._next_tokens, next_tokens])
+        else:
+            self._cache, self._mask, self._next_tokens = cache, mask, next_tokens
+        self._running.extend(requests)
+        self._accept(next_tokens, len(requests))
+
+    def _step(self):
+        """Feed every running sequence its last token and sample the next one"""
+        positions = self._mask.sum(-1, keepdim=True)
+        self._mask = torch.cat([self._mask, torch.ones_like(self._mask[:, :1])], dim=-1)
+
+        outputs = self.model(
+            input_ids=self._next_tokens[:, None], attention_mask=self._mask, position_ids=positions,
+            past_key_values=model_cache(self._cache), use_cache=True
+        )
+        self._cache = cache_layers(outputs.past_key_values)
+        self._next_tokens = self._sample(outputs.logits[:, -1, :], self._running)
+
+        with self._stats_lock:
+            self.steps += 1
+            self.batch_rows += len(self._running)
+        self._accept(self._next_tokens, len(self._running))
+
+    def _accept(self, tokens, count):
+        """Record the tokens sampled for the last count rows, then drop finished rows"""
+        offset = len(self._running) - count
+        for row, token in enumerate(tokens.tolist()):
+            request = self._running[offset + row]
+            request.generated.append(token)
+            request.seen.add(token)
+            self._emit(request)
+        with self._stats_lock:
+            self.tokens += count
+
+        keep = []
+        for row, request in enumerate(self._running):
+            done = (request.cancelled or request.generated[-1] == self.tokenizer.eos_token_id
+                    or len(request.generated) >= request.max_new_tokens)
+            if done:
+                self._finish(request)
+            else:
+                keep.append(row)
+
+        if len(keep) < len(self._running):
+            self._running = [self._running[row] for row in keep]
+            if not keep:
+                self._reset()
+                return
+            index = torch.tensor(keep, device=self._mask.device)
+            self._cache = [(k.index_select(0, index), v.index_select(0, index)) for k, v in self._cache]
+            self._mask = self._mask.index_select(0, index)
+            self._next_tokens = self._next_tokens.index_select(0, index)
+            self._trim()
+
+    def _trim(self):
+        """Drop left columns that are padding in every remaining row"""
+        start = int((self._mask.sum(0) > 0).nonzero()[0])
+        if start:
+            self._cache = [(k[:, :, start:], v[:, :, start:]) for k, v in self._cache]
+            self._mask = self._mask[:, start:]
+
+    # ============== TOKENS AND RESULTS ==============
+
+    def _sample(self, logits, requests):
+        """Repetition penalty, temperature and top-p per row, as LocalLLM.generate samples"""
+        logits = logits.float()
+        if self.repetition_penalty != 1.0:
+            for row, request in enumerate(requests):
+                ids = torch.tensor(sorted(request.seen), device=logits.device)
+                scores = logits[row, ids]
+                logits[row, ids] = torch.where(scores < 0, scores * self.repetition_penalty,
+                                               scores / self.repetition_penalty)
+
+        if self.temperature <= 0:
+            return logits.argmax(-1)
+
+        logits = logits / self.temperature
+        sorted_logits, sorted_ids = logits.sort(-1, descending=True)
+        cumulative = sorted_logits.softmax(-1).cumsum(-1)
+        # Drop tokens once the tokens before them already reach top_p (the first is always kept)
+        remove = cumulative - sorted_logits.softmax(-1) >= self.top_p
+        sorted_logits = sorted_logits.masked_fill(remove, float('-inf'))
+        choice = torch.multinomial(sorted_logits.softmax(-1), 1)
+        return sorted_ids.gather(-1, choice).squeeze(-1)
+
+    def _emit(self, request):
+        """Send newly decoded text to a streaming request"""
+        if request.pieces is None:
+            return
+        text = self.tokenizer.decode(request.generated, skip_special_tokens=True)
+        if text.endswith('�'):
+            return  # incomplete multi-byte character: wait for the next token
+        if len(text) > len(request.emitted):
+            request.pieces.put(text[len(request.emitted):])
+            request.emitted = text
+
+    def _finish(self, request, error=None):
+        if request.future.done():
+            return
+        if error is not None:
+            request.future.set_exception(error)
+            if request.pieces is not None:
+                request.pieces.put(error)
+            return
+        request.future.set_result(self.tokenizer.decode(request.generated, skip_special_tokens=True).strip())
+        if request.pieces is not None:
+            request.pieces.put(None)
+
+    # ============== KV CACHE ==============
+
+    @staticmethod
+    def _concat(cache, mask, new_cache, new_mask):
+        """Stack two batches, left-padding the shorter one"""
+        length = max(mask.shape[1], new_mask.shape[1])
+
+        def pad(tensor, dim, by):
+            if by == 0:
+                return tensor
+            shape = list(tensor.shape)
+            shape[dim] = by
+            return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+        pad_old, pad_new = length - mask.shape[1], length - new_mask.shape[1]
+        layers = [
+            (torch.cat([pad(k, 2, pad_old), pad(nk, 2, pad_new)]), torch.cat([pad(v, 2, pad_old), pad(nv, 2, pad_new)]))
+            for (k, v), (nk, nv) in zip(cache, new_cache)
+        ]
+        return layers, torch.cat([pad(mask, 1, pad_old), pad(new_mask, 1, pad_new)])
@@ -1,9 +1,41 @@
 """
 Language detection and multilingual response generation
+
+Detection uses langdetect's character n-gram profiles, loaded once per
+process on first use and seeded, so the same text always gets the same
+language (langdetect samples n-grams at random). Results are kept in an LRU
+cache keyed by a hash of the text, shared by all detectors: an email
+detected when fetched is not detected again when its draft is generated.
 """
 
-from langdetect import detect, LangDetectException
+from collections import OrderedDict
+import hashlib
 import re
+import threading
+
+from langdetect import LangDetectException
+from langdetect.detector_factory import DetectorFactory, PROFILES_DIRECTORY
+
+import config
+
+
+_factory = None
+_factory_lock = threading.Lock()
+_cache = OrderedDict()  # sha1 of text -> language code
+_cache_lock = threading.Lock()
+
+
+def get_detector_factory():
+    """langdetect factory with all profiles loaded and a fixed seed (singleton)"""
+    global _factory
+    if _factory is None:
+        with _factory_lock:
+            if _factory is None:
+                factory = DetectorFactory()
+                factory.load_profile(PROFILES_DIRECTORY)
+                factory.seed = config.LANGUAGE_DETECT_SEED
+                _factory = factory
+    return _factory
 
 
 class LanguageDetector:
@@ -34,18 +66,74 @@ class LanguageDetector:
         Returns:
             Language code (e.g., 'it', 'en', 'ar') or 'unknown'
         """
-        # Clean text for better detection
-        cleaned_text = self._clean_text(text)
+        return self.detect_many([text])[0]
+    
+    def detect_many(self, texts):
+        """
+        Detect the language of many texts
         
+        Repeated and previously seen texts are detected once.
+        
+        Args:
+            texts: Input texts to analyze
+        
+        Returns:
+            Language codes, in the order of texts
+        """
+        keys = []
+        languages = {}
+        pending = {}
+        for text in texts:
+            text = text or ''
+            key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+            keys.append(key)
+            if key in languages or key in pending:
+                continue
+            lang_code = self._cached(key)
+            if lang_code is None:
+                pending[key] = text
+            else:
+                languages[key] = lang_code
+        
+        # Clean text for better detection
+        detected = {key: self._detect(self._clean_text(text)) for key, text in pending.items()}
+        if detected:
+            self._store(detected)
+            languages.update(detected)
+        return [languages[key] for key in keys]
+    
+    def _detect(self, cleaned_text):
+        """Language code of a cleaned text (not cached)"""
         if not cleaned_text or len(cleaned_text) < 10:
             return 'unknown'
         
         try:
-            lang_code = detect(cleaned_text)
-            return lang_code if lang_code in self.LANGUAGE_NAMES else lang_code
+            detector = get_detector_factory().create()
+            detector.set_max_text_length(config.LANGUAGE_DETECT_MAX_CHARS)
+            detector.append(cleaned_text)
+            return detector.detect()
         except LangDetectException:
             return 'unknown'
     
+    @staticmethod
+    def _cached(key):
+        """Cached language code for a text hash, or None"""
+        with _cache_lock:
+            lang_code = _cache.get(key)
+            if lang_code is not None:
+                _cache.move_to_end(key)
+            return lang_code
+    
+    @staticmethod
+    def _store(detected):
+        """Cache text hash -> language code, evicting the least recently used"""
+        with _cache_lock:
+            _cache.update(detected)
+            for key in detected:
+                _cache.move_to_end(key)
+            while len(_cache) > config.LANGUAGE_CACHE_ENTRIES:
+                _cache.popitem(last=False)
+    
     def _clean_text(self, text):
         """Remove HTML tags and excessive whitespace"""
         # Remove HTML tags
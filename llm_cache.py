@@ -0,0 +1,286 @@
+"""
+Caches that avoid repeated LLM generations
+
+GenerationCache: exact prompt match, persisted in a local SQLite file. A
+prompt built by DualRAGSystem already contains the retrieved contexts and the
+workspace system prompt, so an identical prompt means identical inputs: a
+re-sent email or a regenerated draft reuses the stored response instead of
+paying for another API call.
+
+SemanticAnswerCache: near-identical questions (by email embedding) that
+retrieve the same chunks reuse a previous answer. Also SQLite-backed, one
+file per workspace.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+import config
+
+
+# Global cache instance shared by every workspace
+_generation_cache = None
+_generation_cache_lock = threading.Lock()
+
+
+def get_generation_cache():
+    """Get or create the generation cache (singleton pattern)"""
+    global _generation_cache
+    with _generation_cache_lock:
+        if _generation_cache is None:
+            _generation_cache = GenerationCache()
+        return _generation_cache
+
+
+class GenerationCache:
+    """Prompt/response cache with TTL expiry and least-recently-used eviction"""
+
+    def __init__(self, path: str = config.LLM_CACHE_PATH,
+                 ttl: int = config.LLM_CACHE_TTL,
+                 max_entries: int = config.LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS generations (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_accessed ON generations (accessed_at)")
+
+    @contextmanager
+    def _connect(self):
+        """One short-lived connection per operation (safe across threads and processes), committed on exit"""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(provider: str, model: str, temperature: float, max_new_tokens: int, prompt: str) -> str:
+        """Cache key of a generation request"""
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        return f"{provider}|{model}|{temperature}|{max_new_tokens}|{prompt_hash}"
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached response, or None if missing or expired"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response, created_at FROM generations WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+                row = None
+
+            if row is not None:
+                conn.execute("UPDATE generations SET accessed_at = ? WHERE key = ?", (now, key))
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return row[0] if row is not None else None
+
+    def set(self, key: str, response: str):
+        """Store a response, evicting expired and least recently used entries"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO generations (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            conn.execute("DELETE FROM generations WHERE created_at < ?", (now - self.ttl,))
+            conn.execute("""
+                DELETE FROM generations WHERE key IN (
+                    SELECT key FROM generations ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def clear(self):
+        """Remove every cached generation"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM generations")
+
+    def stats(self) -> dict:
+        """Entry count and hit rate since this process started"""
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+
+def answer_cache_path(workspace_id=None) -> str:
+    """SQLite file holding a workspace's cached answers"""
+    name = f"answer_cache_ws{workspace_id}" if workspace_id else "answer_cache"
+    return os.path.join(config.CHROMA_DB_DIR, f"{name}.sqlite")
+
+
+class SemanticAnswerCache:
+    """
+    Per-workspace cache of generated answers, matched by email embedding
+
+    A cached answer is reused when a new email embeds within `threshold`
+    cosine similarity of a cached one AND retrieval returns exactly the same
+    chunks under the same context key (system prompt and language), i.e. the
+    LLM would be given the same facts. Persisted in a SQLite file next to the
+    workspace's FAISS collections, so the web process and the CLI can store
+    answers at the same time without overwriting each other's entries.
+    """
+
+    def __init__(self, workspace_id=None,
+                 threshold: float = config.SEMANTIC_CACHE_THRESHOLD,
+                 ttl: int = config.SEMANTIC_CACHE_TTL,
+                 max_entries: int = config.SEMANTIC_CACHE_MAX_ENTRIES):
+        self.path = answer_cache_path(workspace_id)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    vector BLOB NOT NULL,
+                    chunk_ids TEXT NOT NULL,
+                    context_key TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_match ON answers (context_key, chunk_ids)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_accessed ON answers (accessed_at)")
+
+    @contextmanager
+    def _connect(self):
+        """One short-lived connection per operation (safe across threads and processes), committed on exit"""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype='float32').ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    @staticmethod
+    def _chunk_key(chunk_ids) -> str:
+        """Order-independent text form of a set of chunk ids"""
+        return json.dumps(sorted(chunk_ids))
+
+    def lookup(self, vector, chunk_ids, context_key) -> Optional[str]:
+        """Cached answer for a similar email with the same retrieved chunks, or None"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+            rows = conn.execute(
+                "SELECT id, vector, response FROM answers WHERE context_key = ? AND chunk_ids = ?",
+                (context_key, self._chunk_key(chunk_ids))
+            ).fetchall()
+
+            best = None
+            if rows:
+                query = self._normalize(vector)
+                vectors = [np.frombuffer(row[1], dtype='float32') for row in rows]
+                # Answers stored under a different embedding model never match
+                similarities = [float(v @ query) if v.shape == query.shape else -1.0 for v in vectors]
+                i = int(np.argmax(similarities))
+                if similarities[i] >= self.threshold:
+                    best = rows[i]
+                    conn.execute("UPDATE answers SET accessed_at = ? WHERE id = ?", (now, best[0]))
+                    print(f"⚡ Risposta simile riutilizzata (similarità {similarities[i]:.3f})")
+
+        with self._lock:
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best[2] if best is not None else None
+
+    def add(self, vector, chunk_ids, context_key, response: str):
+        """Store an answer, evicting expired and least recently used entries beyond max_entries"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO answers (vector, chunk_ids, context_key, response, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self._normalize(vector).tobytes(), self._chunk_key(chunk_ids), context_key, response, now, now)
+            )
+            conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+            conn.execute("""
+                DELETE FROM answers WHERE id IN (
+                    SELECT id FROM answers ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def prune(self, valid_chunk_ids) -> int:
+        """
+        Drop answers citing chunks that are no longer indexed (edited or removed)
+
+        Returns:
+            Number of entries dropped
+        """
+        with self._connect() as conn:
+            stale = [
+                (answer_id,)
+                for answer_id, chunk_key in conn.execute("SELECT id, chunk_ids FROM answers")
+                if not set(json.loads(chunk_key)) <= valid_chunk_ids
+            ]
+            conn.executemany("DELETE FROM answers WHERE id = ?", stale)
+        return len(stale)
+
+    def clear(self):
+        """Remove every cached answer"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM answers")
+
+    def stats(self) -> dict:
+        """Entry count and hit rate since this process started"""
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
@@ -2,18 +2,37 @@
 Local LLM for text generation
 """
 
-from transformers import AutoTokenizer, AutoModelForCausalLM, AutoModelForSeq2SeqLM, pipeline
+from transformers import (AutoTokenizer, AutoModelForCausalLM, AutoModelForSeq2SeqLM, BatchEncoding,
+                          TextIteratorStreamer, pipeline)
+from threading import Thread
+import os
+import time
 import torch
 import config
+from generation_scheduler import GenerationScheduler, PrefixCache, model_cache
+from prompt_budget import fit_segments
+
+
+def cpu_threads():
+    """CPUs this process may run on (respects container/affinity limits), or config.LOCAL_NUM_THREADS"""
+    if config.LOCAL_NUM_THREADS > 0:
+        return config.LOCAL_NUM_THREADS
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
 
 
 class LocalLLM:
     """Local language model for generating responses"""
     
-    def __init__(self):
+    def __init__(self, use_cache: bool = config.LOCAL_USE_KV_CACHE, quantize: bool = config.LOCAL_QUANTIZE_INT8,
+                 batching: bool = config.LOCAL_BATCHING_ENABLED):
         print(f"\nLoading LLM: {config.LLM_MODEL}")
         print("This may take a few minutes on first run (downloading model)...")
         
+        if config.DEVICE == "cpu":
+            torch.set_num_threads(cpu_threads())
+        
         # Load tokenizer
         self.tokenizer = AutoTokenizer.from_pretrained(config.LLM_MODEL, trust_remote_code=True)
         
@@ -36,6 +55,14 @@ class LocalLLM:
             )
             self.is_causal = True
         
+        self.max_input_tokens = config.LOCAL_MAX_INPUT_TOKENS
+        self.last_new_tokens = 0
+        
+        # Identify the generation settings (generation cache key)
+        self.provider = "local"
+        self.model_name = config.LLM_MODEL
+        self.temperature = 0.7 if self.is_causal else 0.3
+        
         # Move model to device
         self.model.to(config.DEVICE)
         self.model.eval()
@@ -44,62 +71,288 @@ class LocalLLM:
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
         
-        print(f"✓ LLM loaded on {config.DEVICE}")
+        self.quantized = quantize and config.DEVICE == "cpu" and self._quantize()
+        self.use_cache = use_cache and self._kv_cache_works()
+        
+        # KV cache of shared prompt prefixes (workspace system prompt), reused across drafts
+        self.prefix_cache = None
+        if self.is_causal and self.use_cache and config.LOCAL_PREFIX_CACHE_ENTRIES > 0:
+            self.prefix_cache = PrefixCache(self.model)
+        self._prefix_ids = {}  # prefix text -> token ids
+        
+        # Concurrent generations share batched forward passes (needs a causal model and the KV cache)
+        self.scheduler = None
+        if batching and self.is_causal and self.use_cache:
+            self.scheduler = GenerationScheduler(self.model, self.tokenizer, self.temperature,
+                                                 prefix_cache=self.prefix_cache)
+        
+        mode = ", ".join(filter(None, [
+            "KV cache" if self.use_cache else "no KV cache",
+            "int8" if self.quantized else None,
+            f"continuous batching x{self.scheduler.max_batch_size}" if self.scheduler else None,
+            f"{torch.get_num_threads()} threads" if config.DEVICE == "cpu" else None
+        ]))
+        print(f"✓ LLM loaded on {config.DEVICE} ({mode})")
+    
+    def usage(self):
+        """Generation mode and, with the scheduler, batch statistics since startup"""
+        return {
+            'provider': self.provider,
+            'kv_cache': self.use_cache,
+            'int8': self.quantized,
+            'prefix_cache': self.prefix_cache.stats() if self.prefix_cache else None,
+            'scheduler': self.scheduler.stats() if self.scheduler else None
+        }
+    
+    def clear_prefix_cache(self):
+        """Drop cached prompt prefixes (e.g. after the system prompt changed)"""
+        if self.prefix_cache:
+            self.prefix_cache.clear()
+    
+    def _cached_prefix(self, input_ids, prefix):
+        """
+        Leading ids of input_ids to take from the prefix cache, or ()
+        
+        The prefix text is tokenized alone and its last token dropped, since
+        tokenization can merge it with what follows; the remaining ids must
+        match the start of the prompt exactly.
+        """
+        if not prefix or not self.prefix_cache:
+            return ()
+        if prefix not in self._prefix_ids:
+            self._prefix_ids[prefix] = tuple(self.tokenizer(prefix)['input_ids'][:-1])
+        ids = self._prefix_ids[prefix]
+        # At least two prompt tokens must follow (see _prefill_prefix)
+        if len(ids) + 2 > len(input_ids) or tuple(input_ids[:len(ids)]) != ids:
+            return ()
+        return ids
+    
+    def _prefill_prefix(self, kwargs, prefix_ids):
+        """
+        Start model.generate from the cached prefix
+        
+        The rest of the prompt except its last token is run on top of the
+        prefix cache here; generate then only feeds the last prompt token
+        (transformers versions differ in how they slice a longer remainder).
+        """
+        input_ids = kwargs['input_ids']
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=input_ids[:, len(prefix_ids):-1],
+                attention_mask=kwargs['attention_mask'][:, :-1],
+                past_key_values=model_cache(self.prefix_cache.get(prefix_ids)),
+                use_cache=True
+            )
+        kwargs['past_key_values'] = outputs.past_key_values
+        return kwargs
+    
+    def _quantize(self) -> bool:
+        """
+        Dynamic int8 quantization of the linear layers (weights int8, activations quantized on the fly)
+        
+        The output projection (lm_head) stays in fp32: it picks every next
+        token, so its rounding errors change the text the most.
+        """
+        try:
+            output_layer = self.model.get_output_embeddings()
+            layers = {
+                name for name, module in self.model.named_modules()
+                if isinstance(module, torch.nn.Linear) and module is not output_layer
+            }
+            self.model = torch.quantization.quantize_dynamic(self.model, layers, dtype=torch.qint8)
+            return True
+        except Exception as e:
+            print(f"⚠ Quantizzazione int8 non disponibile, modello in fp32: {e}")
+            return False
+    
+    def _kv_cache_works(self) -> bool:
+        """
+        Generate a couple of tokens with the KV cache on
+        
+        Some remote-code models break with the cache classes of the installed
+        transformers version; only those fall back to recomputing attention
+        over the whole sequence at every step.
+        """
+        try:
+            inputs = self.tokenizer("Hello", return_tensors="pt").to(config.DEVICE)
+            with torch.no_grad():
+                self.model.generate(**inputs, max_new_tokens=2, do_sample=False, use_cache=True,
+                                    pad_token_id=self.tokenizer.eos_token_id)
+            return True
+        except Exception as e:
+            print(f"⚠ KV cache non compatibile con {config.LLM_MODEL}, disattivata: {e}")
+            return False
     
-    def generate(self, prompt: str, max_new_tokens: int = config.MAX_NEW_TOKENS) -> str:
+    def generate(self, prompt: str, max_new_tokens: int = config.MAX_NEW_TOKENS, prefix: str = None,
+                 segments: list = None, time_limit: float = None) -> str:
         """
         Generate text based on prompt
         
         Args:
             prompt: Input prompt
             max_new_tokens: Maximum number of new tokens to generate
+            prefix: Start of prompt shared by many calls (system prompt), whose KV cache is reused
+            segments: (text, shrink order) parts of prompt, used if it exceeds max_input_tokens (see _tokenize)
+            time_limit: Accepted for parity with ApiLLM; local generation is bounded by max_new_tokens
         
         Returns:
             Generated text
         """
-        # Tokenize input
-        inputs = self.tokenizer(
-            prompt, 
-            return_tensors="pt", 
-            truncation=True, 
-            max_length=2048
-        ).to(config.DEVICE)
+        inputs = self._tokenize(prompt, segments)
+        prefix_ids = self._cached_prefix(inputs['input_ids'][0].tolist(), prefix)
+        
+        if self.scheduler:
+            request = self.scheduler.submit(inputs['input_ids'][0].tolist(), max_new_tokens, prefix=prefix_ids)
+            response = request.result()
+            self.last_new_tokens = len(request.generated)
+            print(f"\n📏 Tokens generati: {self.last_new_tokens} | Lunghezza risposta: {len(response)} caratteri")
+            return response
+        
+        kwargs = self._generation_kwargs(inputs, max_new_tokens)
+        if prefix_ids:
+            kwargs = self._prefill_prefix(kwargs, prefix_ids)
         
         # Generate based on model type
         with torch.no_grad():
-            if self.is_causal:
-                # Causal LM generation (Phi, Llama, etc.)
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=max_new_tokens,
-                    temperature=0.7,
-                    do_sample=True,
-                    top_p=0.9,
-                    repetition_penalty=1.1,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    use_cache=False  # Disable cache to avoid compatibility issues
-                )
-                # Decode and remove input prompt
-                full_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-                response = full_text[len(prompt):].strip()
-            else:
-                # Seq2Seq generation (T5)
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=max_new_tokens,
-                    min_length=100,
-                    temperature=0.3,
-                    do_sample=False,
-                    num_beams=4,
-                    repetition_penalty=1.2,
-                    no_repeat_ngram_size=3,
-                    early_stopping=True
-                )
-                response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        
-        print(f"\n📏 Tokens generati: {len(outputs[0])} | Lunghezza risposta: {len(response)} caratteri")
+            outputs = self.model.generate(**kwargs)
+        
+        # Causal models return prompt + new tokens: decode only the new ones
+        new_tokens = outputs[0][inputs['input_ids'].shape[-1]:] if self.is_causal else outputs[0]
+        response = self.tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
+        self.last_new_tokens = len(new_tokens)
+        print(f"\n📏 Tokens generati: {self.last_new_tokens} | Lunghezza risposta: {len(response)} caratteri")
         return response
     
+    def generate_stream(self, prompt: str, max_new_tokens: int = config.MAX_NEW_TOKENS, prefix: str = None,
+                        segments: list = None, time_limit: float = None):
+        """
+        Stream generated text as tokens are decoded
+        
+        With the scheduler, pieces come from the shared batch; otherwise
+        model.generate runs in a background thread feeding a
+        TextIteratorStreamer. Beam search can't stream, so Seq2Seq models
+        generate greedily here.
+        
+        Args:
+            prompt: Input prompt
+            max_new_tokens: Maximum number of new tokens to generate
+            prefix: Start of prompt shared by many calls (system prompt), whose KV cache is reused
+            segments: (text, shrink order) parts of prompt, as in generate
+            time_limit: Ignored, as in generate
+        
+        Yields:
+            Text pieces as they are decoded
+        """
+        inputs = self._tokenize(prompt, segments)
+        start = time.perf_counter()
+        prefix_ids = self._cached_prefix(inputs['input_ids'][0].tolist(), prefix)
+        
+        if self.scheduler:
+            request = self.scheduler.submit(inputs['input_ids'][0].tolist(), max_new_tokens, stream=True,
+                                            prefix=prefix_ids)
+            pieces, thread = request.stream(), None
+        else:
+            request = None
+            streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+            
+            kwargs = self._generation_kwargs(inputs, max_new_tokens)
+            if not self.is_causal:
+                kwargs.update(num_beams=1, early_stopping=False)
+            if prefix_ids:
+                kwargs = self._prefill_prefix(kwargs, prefix_ids)
+            kwargs['streamer'] = streamer
+            
+            def run():
+                with torch.no_grad():
+                    self.model.generate(**kwargs)
+            
+            thread = Thread(target=run, daemon=True)
+            thread.start()
+            pieces = streamer
+        
+        first_token_ms = None
+        length = 0
+        try:
+            for piece in pieces:
+                if not piece:
+                    continue
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - start) * 1000
+                length += len(piece)
+                yield piece
+        finally:
+            if request:
+                request.cancel()  # the consumer stopped early: free the batch slot
+        if thread:
+            thread.join()
+        
+        total_ms = (time.perf_counter() - start) * 1000
+        print(f"\n📏 Streaming: primo token dopo {first_token_ms or 0:.0f} ms | Totale {total_ms:.0f} ms | Lunghezza risposta: {length} caratteri")
+    
+    def _tokenize(self, prompt: str, segments: list = None):
+        """
+        Tokenize input, within max_input_tokens
+        
+        A longer prompt is cut with prompt_budget.fit_segments: segments with
+        a shrink order (retrieved context) lose their end first, and the end
+        of the prompt (student email, response cue) is always kept. Without
+        segments, the middle of the prompt is dropped.
+        
+        Args:
+            prompt: Input prompt
+            segments: (text, shrink order or None) whose texts joined are prompt
+        """
+        inputs = self.tokenizer(prompt, return_tensors="pt")
+        length = inputs['input_ids'].shape[-1]
+        if length > self.max_input_tokens:
+            # Special tokens the tokenizer put around the prompt (BOS, EOS) are kept as they are
+            full = inputs['input_ids'][0].tolist()
+            specials = set(self.tokenizer.all_special_ids)
+            head = next((i for i, token in enumerate(full) if token not in specials), length)
+            tail = next((i for i, token in enumerate(reversed(full)) if token not in specials), 0)
+            
+            parts = [(self.tokenizer(text, add_special_tokens=False)['input_ids'], order)
+                     for text, order in segments or [(prompt, None)]]
+            ids = full[:head] + fit_segments(parts, self.max_input_tokens - head - tail) + full[length - tail:]
+            print(f"⚠ Prompt di {length} token oltre il limite di {self.max_input_tokens}: contesto ridotto")
+            inputs = BatchEncoding({
+                'input_ids': torch.tensor([ids]),
+                'attention_mask': torch.ones(1, len(ids), dtype=torch.long)
+            })
+        return inputs.to(config.DEVICE)
+    
+    def count_tokens(self, text: str) -> int:
+        """Number of tokens the model sees for text (prompt budgeting)"""
+        return len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+    
+    def _generation_kwargs(self, inputs, max_new_tokens: int) -> dict:
+        """model.generate arguments for the loaded model type"""
+        if self.is_causal:
+            # Causal LM generation (Phi, Llama, etc.)
+            return dict(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                temperature=self.temperature,
+                do_sample=True,
+                top_p=0.9,
+                repetition_penalty=1.1,
+                pad_token_id=self.tokenizer.eos_token_id,
+                use_cache=self.use_cache
+            )
+        # Seq2Seq generation (T5)
+        return dict(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            min_length=100,
+            temperature=self.temperature,
+            do_sample=False,
+            num_beams=4,
+            repetition_penalty=1.2,
+            no_repeat_ngram_size=3,
+            early_stopping=True,
+            use_cache=self.use_cache
+        )
+    
     def generate_with_context(self, query: str, context_chunks: list) -> str:
         """
         Generate response using retrieved context
@@ -22,7 +22,8 @@ def print_menu():
     print("  2. Query the system (ask questions)")
     print("  3. Show statistics")
     print("  4. Clear index")
-    print("  5. Exit")
+    print("  5. Watch documents folder (auto-index changes)")
+    print("  6. Exit")
     print("-" * 70)
 
 
@@ -70,7 +71,8 @@ def query_interactive(rag: RAGSystem):
             print("📚 SOURCES:")
             print("-" * 70)
             for i, source in enumerate(result['sources'], 1):
-                print(f"\n{i}. From: {source['filename']}")
+                page = f" (p. {source['page']})" if source.get('page') else ""
+                print(f"\n{i}. From: {source['filename']}{page}")
                 print(f"   Relevance: {1 - source['distance']:.2%}")
                 print(f"   Excerpt: {source['text']}")
         
@@ -107,7 +109,7 @@ def main():
     # Main loop
     while True:
         print_menu()
-        choice = input("\nEnter your choice (1-5): ").strip()
+        choice = input("\nEnter your choice (1-6): ").strip()
         
         if choice == '1':
             index_documents_interactive(rag)
@@ -125,11 +127,14 @@ def main():
                 print("✓ Index cleared")
         
         elif choice == '5':
+            rag.watch_documents()
+        
+        elif choice == '6':
             print("\n👋 Goodbye!")
             break
         
         else:
-            print("\n❌ Invalid choice. Please enter 1-5.")
+            print("\n❌ Invalid choice. Please enter 1-6.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+"""
+MinHash signatures and LSH banding for near-duplicate chunk detection
+"""
+
+import re
+import zlib
+from typing import Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+import config
+
+
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+NUMBER_PATTERN = re.compile(r'\d+(?:[.,]\d+)*')
+
+# Fixed seed: signatures are persisted with the index and must stay comparable
+_rng = np.random.RandomState(20240607)
+_PERM_A = _rng.randint(0, 2 ** 64 - 1, size=config.MINHASH_NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.randint(0, 2 ** 64 - 1, size=config.MINHASH_NUM_PERM, dtype=np.uint64)
+
+
+def shingles(text: str, size: int = 3) -> Set[str]:
+    """Lower-cased word n-grams (the whole word list for very short texts)"""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def normalize(text: str) -> str:
+    """Lower-cased words of a text, without punctuation and spacing differences"""
+    return ' '.join(WORD_PATTERN.findall(text.lower()))
+
+
+def numbers(text: str) -> Set[str]:
+    """Numeric tokens (fees, dates, deadlines) that must match for a merge"""
+    return set(NUMBER_PATTERN.findall(text))
+
+
+def signature(text: str) -> np.ndarray:
+    """
+    MinHash signature of a text's word shingles
+
+    Uses multiply-shift hashing ((a * x + b) mod 2^64) >> 32 per permutation.
+
+    Returns:
+        uint32 array of length config.MINHASH_NUM_PERM
+    """
+    shingle_set = shingles(text)
+    if not shingle_set:
+        return np.full(config.MINHASH_NUM_PERM, 0xFFFFFFFF, dtype=np.uint32)
+
+    hashes = np.array([zlib.crc32(s.encode('utf-8')) for s in shingle_set], dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        permuted = (hashes[:, None] * _PERM_A[None, :] + _PERM_B[None, :]) >> np.uint64(32)
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def jaccard(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.mean(sig_a == sig_b))
+
+
+def is_near_duplicate(text_a: str, sig_a: np.ndarray, text_b: str, sig_b: np.ndarray,
+                      threshold: float = config.DEDUP_THRESHOLD) -> bool:
+    """
+    Near-duplicate test used before merging two chunks
+
+    Chunks that differ in any number are never merged: boilerplate with a
+    different fee or date is a different fact, not a duplicate.
+    """
+    return jaccard(sig_a, sig_b) >= threshold and numbers(text_a) == numbers(text_b)
+
+
+class MinHashLSH:
+    """Banded LSH index over MinHash signatures, keyed by position"""
+
+    def __init__(self, bands: int = config.MINHASH_BANDS):
+        self.bands = bands
+        self.rows = config.MINHASH_NUM_PERM // bands
+        self.buckets: Dict[Tuple[int, bytes], List[int]] = {}
+
+    def _keys(self, sig: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        for band in range(self.bands):
+            yield band, sig[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, key: int, sig: np.ndarray):
+        for bucket in self._keys(sig):
+            self.buckets.setdefault(bucket, []).append(key)
+
+    def query(self, sig: np.ndarray) -> Set[int]:
+        """Keys sharing at least one band with the signature"""
+        candidates = set()
+        for bucket in self._keys(sig):
+            candidates.update(self.buckets.get(bucket, ()))
+        return candidates
@@ -0,0 +1,292 @@
+"""
+Local mock of the Groq / OpenAI-compatible chat completions API
+
+Answers POST /openai/v1/chat/completions (the Groq path) and
+/v1/chat/completions, plain and stream: true, with a deterministic reply
+derived from the prompt and a `usage` block, so tests and load runs need no
+network, API key or quota. Latency, generation speed and failures are
+configurable to reproduce production conditions:
+
+- latency distribution before the first token (fixed, uniform, normal, lognormal)
+- tokens per second while generating (paces streaming, adds to plain calls)
+- injected 500 and 429 responses (with Retry-After), and an optional
+  requests-per-minute quota answered like Groq's
+
+Events are sent as raw UTF-8 under a charset-less text/event-stream, as
+real servers do, so clients must not rely on the headers to decode them.
+
+Random draws use a generator seeded with --seed and the request number, so a
+run with the same requests in the same order behaves the same way.
+
+Usage:
+    python mock_llm_server.py --port 8765 --latency 0.3 --latency-dist lognormal --tokens-per-second 300
+    GROQ_BASE_URL=http://127.0.0.1:8765/openai/v1 GROQ_API_KEY=mock flask generate-drafts --workspace 1
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+
+SENTENCES = [
+    "Gentile studente, grazie per averci contattato.",
+    "Le iscrizioni sono aperte fino alla scadenza indicata nel bando.",
+    "Per l'ammissione è richiesto il diploma di scuola superiore.",
+    "Le lezioni iniziano a ottobre presso la nostra sede.",
+    "Trova tutti i dettagli sul nostro sito ufficiale.",
+    "Restiamo a disposizione per ulteriori informazioni.",
+    "Cordiali saluti, la segreteria didattica.",
+]
+
+CHAT_PATHS = ("/openai/v1/chat/completions", "/v1/chat/completions", "/chat/completions")
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+
+
+def mock_reply(prompt, max_tokens):
+    """
+    Deterministic reply: the same prompt always gets the same text
+
+    Returns:
+        (text, finish_reason): 'length' if the reply was cut at max_tokens words
+    """
+    seed = int(hashlib.sha256(prompt.encode('utf-8')).hexdigest(), 16)
+    count = 3 + seed % 4
+    words = " ".join(SENTENCES[(seed >> (8 * i)) % len(SENTENCES)] for i in range(count)).split()
+    finish_reason = "length" if len(words) > max_tokens else "stop"
+    return " ".join(words[:max_tokens]), finish_reason
+
+
+class MockBehavior:
+    """Latency, speed and failure settings of the mock, with seeded per-request randomness"""
+
+    def __init__(self, latency=0.0, latency_dist="fixed", latency_jitter=0.0, tokens_per_second=0.0,
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0, requests_per_minute=0, seed=0):
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{latency_dist}' (available: {', '.join(LATENCY_DISTRIBUTIONS)})")
+        self.latency = latency
+        self.latency_dist = latency_dist
+        self.latency_jitter = latency_jitter
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.requests_per_minute = requests_per_minute
+        self.seed = seed
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._recent = deque()  # arrival times within the last minute (quota)
+
+    def next_request(self):
+        """Number and random generator of a new request"""
+        with self._lock:
+            self._requests += 1
+            number = self._requests
+        return number, random.Random(f"{self.seed}:{number}")
+
+    def sample_latency(self, rng):
+        """Seconds before the first token; `latency` is the mean, `latency_jitter` the spread"""
+        if self.latency_dist == "uniform":
+            value = rng.uniform(self.latency - self.latency_jitter, self.latency + self.latency_jitter)
+        elif self.latency_dist == "normal":
+            value = rng.gauss(self.latency, self.latency_jitter)
+        elif self.latency_dist == "lognormal" and self.latency > 0:
+            # Parameters chosen so the distribution has the requested mean and standard deviation
+            sigma2 = math.log(1 + (self.latency_jitter / self.latency) ** 2)
+            value = rng.lognormvariate(math.log(self.latency) - sigma2 / 2, math.sqrt(sigma2))
+        else:
+            value = self.latency
+        return max(0.0, value)
+
+    def generation_seconds(self, tokens):
+        return tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def quota_exceeded(self):
+        """Seconds until the next request fits the requests-per-minute quota (0 if it fits now)"""
+        if not self.requests_per_minute:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0] >= 60:
+                self._recent.popleft()
+            if len(self._recent) >= self.requests_per_minute:
+                return 60 - (now - self._recent[0])
+            self._recent.append(now)
+            return 0.0
+
+    def describe(self):
+        parts = [f"latenza {self.latency_dist} {self.latency}s±{self.latency_jitter}s"]
+        if self.tokens_per_second:
+            parts.append(f"{self.tokens_per_second:g} token/s")
+        if self.error_rate or self.rate_limit_rate:
+            parts.append(f"errori {self.error_rate:.0%}, 429 {self.rate_limit_rate:.0%}")
+        if self.requests_per_minute:
+            parts.append(f"quota {self.requests_per_minute} richieste/min")
+        return ", ".join(parts)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Chat completions endpoint; behaviour comes from server.behavior"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # keep load runs quiet
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status, error_type, message, headers=None):
+        self._send_json(status, {"error": {"message": message, "type": error_type}}, headers)
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0].rstrip('/')
+        if path not in CHAT_PATHS:
+            self._send_error(404, "not_found", f"Unknown path {self.path}")
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            prompt = "\n".join(m.get("content", "") for m in payload["messages"])
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self._send_error(400, "invalid_request_error", f"Invalid request: {e}")
+            return
+
+        behavior = self.server.behavior
+        number, rng = behavior.next_request()
+
+        wait = behavior.quota_exceeded()
+        if wait:
+            self._send_error(429, "rate_limit_exceeded", "Rate limit reached for requests per minute (RPM)",
+                             {"Retry-After": str(math.ceil(wait)), "x-ratelimit-remaining-requests": "0"})
+            return
+        if rng.random() < behavior.rate_limit_rate:
+            self._send_error(429, "rate_limit_exceeded", "Injected rate limit",
+                             {"Retry-After": f"{behavior.retry_after:g}"})
+            return
+        if rng.random() < behavior.error_rate:
+            time.sleep(behavior.sample_latency(rng))
+            self._send_error(500, "internal_server_error", "Injected server error")
+            return
+
+        time.sleep(behavior.sample_latency(rng))
+
+        reply, finish_reason = mock_reply(prompt, int(payload.get("max_tokens") or 1024))
+        words = reply.split(" ")
+        prompt_tokens = len(prompt.split())
+        completion_tokens = len(reply.split())
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "completion_time": round(behavior.generation_seconds(completion_tokens), 3)
+        }
+        completion_id = f"chatcmpl-mock-{number}-{hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:12]}"
+        common = {"id": completion_id, "created": int(time.time()), "model": payload.get("model", "mock-llm")}
+
+        if not payload.get("stream"):
+            time.sleep(behavior.generation_seconds(completion_tokens))
+            self._send_json(200, {
+                **common,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply},
+                             "finish_reason": finish_reason}],
+                "usage": usage
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        try:
+            for i, word in enumerate(words):
+                piece = word if i == 0 else " " + word
+                event = {**common, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+                if behavior.tokens_per_second:
+                    self.wfile.flush()
+                    time.sleep(behavior.generation_seconds(1))
+
+            final = {**common, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}
+            # Groq reports streaming usage under x_groq, OpenAI-style servers at the top level
+            if path.startswith("/openai/"):
+                final["x_groq"] = {"id": completion_id, "usage": usage}
+            else:
+                final["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(final, ensure_ascii=False)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client went away mid-stream
+
+
+def create_server(port=config.MOCK_LLM_PORT, latency=0.0, host="127.0.0.1", **behavior):
+    """Build the mock server (not started); behavior options are MockBehavior's"""
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.behavior = MockBehavior(latency=latency, **behavior)
+    return server
+
+
+def start_in_thread(port=config.MOCK_LLM_PORT, latency=0.0, **behavior):
+    """Start the mock server in a background thread; call server.shutdown() to stop it"""
+    server = create_server(port, latency, **behavior)
+    threading.Thread(target=server.serve_forever, daemon=True, name='mock-llm').start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Groq / OpenAI-compatible chat completions server")
+    parser.add_argument('--port', type=int, default=config.MOCK_LLM_PORT)
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--latency', type=float, default=0.0, help="Mean seconds before the first token")
+    parser.add_argument('--latency-dist', choices=LATENCY_DISTRIBUTIONS, default="fixed")
+    parser.add_argument('--latency-jitter', type=float, default=0.0,
+                        help="Spread of the latency: half-width (uniform) or standard deviation (normal, lognormal)")
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help="Generation speed (0 = instant)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="Retry-After seconds of injected 429s")
+    parser.add_argument('--rpm', type=int, default=0, help="Requests per minute quota (0 = unlimited)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of latency and failure draws")
+    args = parser.parse_args()
+
+    server = create_server(
+        args.port, args.latency, args.host,
+        latency_dist=args.latency_dist, latency_jitter=args.latency_jitter,
+        tokens_per_second=args.tokens_per_second, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+        requests_per_minute=args.rpm, seed=args.seed
+    )
+    print(f"🧪 Mock LLM in ascolto su http://{args.host}:{args.port}/openai/v1 ({server.behavior.describe()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
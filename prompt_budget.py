@@ -0,0 +1,119 @@
+"""
+Token budget for prompt assembly
+
+Sections are fitted in priority order against the LLM's own tokenizer, so
+high-priority text (instructions, the student's email, corrections) is never
+crowded out by retrieved context, and context is cut at sentence boundaries
+instead of a fixed number of characters.
+
+fit_segments is the last line of defence on the model side: when a prompt
+still exceeds the context window it shrinks the context segments first and
+never cuts the end of the prompt (student email and response cue).
+"""
+
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from text_chunker import SENTENCE_SPLIT
+
+
+class PromptBudget:
+    """Remaining token budget of a prompt being assembled"""
+
+    def __init__(self, count_tokens: Callable[[str], int], max_tokens: int):
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.remaining = max_tokens
+
+    def reserve(self, text: str) -> int:
+        """Account for text that is always included (may overdraw the budget)"""
+        tokens = self.count_tokens(text)
+        self.remaining -= tokens
+        return tokens
+
+    def fit(self, text: str, limit: int = None, partial: bool = False) -> str:
+        """
+        Take as much of text as fits in the budget (and in limit, if given)
+
+        Text is cut after the last whole sentence that fits. If not even the
+        first sentence fits, nothing is taken, unless partial is set, in which
+        case the text is cut at the last fitting word.
+
+        Args:
+            text: Section text
+            limit: Maximum tokens for this section
+            partial: Allow cutting inside a sentence
+
+        Returns:
+            The fitted text ('' if nothing fits)
+        """
+        text = text.strip()
+        available = self.remaining if limit is None else min(limit, self.remaining)
+        if not text or available <= 0:
+            return ''
+
+        tokens = self.count_tokens(text)
+        if tokens <= available:
+            self.remaining -= tokens
+            return text
+
+        fitted = self._cut(text, self._sentence_ends(text), available)
+        if not fitted and partial:
+            fitted = self._cut(text, self._word_ends(text), available)
+        if fitted:
+            self.remaining -= self.count_tokens(fitted)
+        return fitted
+
+    def _cut(self, text: str, ends: List[int], available: int) -> str:
+        """Longest prefix ending at one of ends whose pieces fit in available tokens"""
+        used = 0
+        start = 0
+        cut = 0
+        for end in ends:
+            used += self.count_tokens(text[start:end])
+            if used > available:
+                break
+            cut = end
+            start = end
+        return text[:cut].rstrip()
+
+    @staticmethod
+    def _sentence_ends(text: str) -> List[int]:
+        return [match.start() for match in SENTENCE_SPLIT.finditer(text)] + [len(text)]
+
+    @staticmethod
+    def _word_ends(text: str) -> List[int]:
+        ends = [i for i in range(1, len(text)) if text[i].isspace() and not text[i - 1].isspace()]
+        return ends + [len(text)]
+
+
+def fit_segments(segments: Sequence[Tuple[List[int], Optional[int]]], max_tokens: int) -> List[int]:
+    """
+    Token ids of a prompt cut down to max_tokens, context first
+
+    Segments with a shrink order lose tokens from their end, lowest order
+    first, until the prompt fits. If the fixed segments alone are too long,
+    the middle of the prompt is dropped: its start (instructions) and end
+    (email and response cue) are kept.
+
+    Args:
+        segments: (token ids, shrink order or None if never shrunk) in prompt order
+        max_tokens: Maximum prompt length
+
+    Returns:
+        The token ids of the fitted prompt
+    """
+    ids = [list(part) for part, _ in segments]
+    orders = [order for _, order in segments]
+    overflow = sum(len(part) for part in ids) - max_tokens
+    for index in sorted((i for i, order in enumerate(orders) if order is not None), key=lambda i: orders[i]):
+        if overflow <= 0:
+            break
+        cut = min(overflow, len(ids[index]))
+        ids[index] = ids[index][:len(ids[index]) - cut]
+        overflow -= cut
+
+    fitted = [token for part in ids for token in part]
+    if len(fitted) > max_tokens:
+        tail = max_tokens // 2
+        fitted = fitted[:max_tokens - tail] + fitted[len(fitted) - tail:]
+    return fitted
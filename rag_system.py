@@ -7,6 +7,10 @@ from text_chunker import TextChunker
 from vector_store import VectorStore
 from local_llm import LocalLLM
 import config
+import hashlib
+import json
+import os
+import time
 
 
 class RAGSystem:
@@ -28,7 +32,11 @@ class RAGSystem:
     
     def index_documents(self, documents_dir: str = "./documents"):
         """
-        Load and index all documents from a directory
+        Incrementally index the documents in a directory
+        
+        A manifest of (path, size, mtime, sha256) is kept next to the index:
+        unchanged files are skipped, new and modified files are (re-)indexed,
+        and the chunks of files that disappeared are purged.
         
         Args:
             documents_dir: Directory containing documents to index
@@ -36,28 +44,152 @@ class RAGSystem:
         print(f"\n{'=' * 60}")
         print("Starting Document Indexing")
         print("=" * 60)
+        start_time = time.perf_counter()
         
         # Update document loader directory
         self.document_loader.documents_dir = documents_dir
         
-        # Load documents
-        documents = self.document_loader.load_all_documents()
+        # Compare the directory with the manifest
+        manifest = self._load_manifest()
+        new_manifest = {}
+        added, changed, skipped = [], [], []
+        
+        for path in self.document_loader.list_files():
+            stat = os.stat(path)
+            entry = manifest.get(path)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                new_manifest[path] = entry
+                skipped.append(path)
+                continue
+            
+            # Size or mtime changed: only the content hash can tell
+            digest = self._file_hash(path)
+            new_manifest[path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': digest}
+            if entry and entry['sha256'] == digest:
+                skipped.append(path)
+            elif entry:
+                changed.append(path)
+            else:
+                added.append(path)
+        
+        removed = [path for path in manifest if path not in new_manifest]
         
-        if not documents:
-            print("\n⚠ No documents found to index!")
-            return
+        # Purge stale chunks (also clears chunks indexed before the manifest existed)
+        for path in removed + changed + added:
+            self.vector_store.remove_sources({'path': path}, save=False)
         
-        # Chunk documents
-        chunks = self.text_chunker.chunk_documents(documents)
+        # Load documents (streamed in completion order when extracting in parallel)
+        to_index = added + changed
+        loaded = set()
+        total = 0
+        if to_index:
+            if config.LOADER_WORKERS > 1:
+                documents = self.document_loader.iter_documents_parallel(paths=to_index)
+            else:
+                documents = self.document_loader.iter_documents(paths=to_index)
+            
+            # Chunk and embed documents batch by batch, as they arrive
+            batches = self.text_chunker.iter_chunk_batches(self._track_loaded(documents, loaded))
+            total = self.vector_store.add_document_batches(batches)
         
-        # Add to vector store
-        self.vector_store.add_documents(chunks)
+        if removed or changed or added:
+            self.vector_store.save()
         
+        # Files that failed or timed out are retried on the next run
+        for path in to_index:
+            if path not in loaded:
+                new_manifest.pop(path, None)
+        self._save_manifest(new_manifest)
+        
+        elapsed = time.perf_counter() - start_time
         print(f"\n{'=' * 60}")
         print("✓ Indexing Complete!")
+        print(f"Files: {len(added)} added, {len(changed)} changed, {len(removed)} removed, {len(skipped)} skipped")
+        print(f"Chunks created: {total} | Time: {elapsed:.1f}s")
         print(f"Total chunks in database: {self.vector_store.get_collection_count()}")
         print("=" * 60)
     
+    def watch_documents(self, documents_dir: str = "./documents",
+                        poll_interval: float = config.WATCH_POLL_INTERVAL,
+                        debounce: float = config.WATCH_DEBOUNCE):
+        """
+        Keep the index in sync with a directory until interrupted (Ctrl+C)
+        
+        The directory is polled for (size, mtime) changes; once it has been
+        quiet for `debounce` seconds, index_documents runs and only the
+        created, modified and deleted files go through the pipeline.
+        
+        Args:
+            documents_dir: Directory to watch
+            poll_interval: Seconds between scans
+            debounce: Quiet period before re-indexing
+        """
+        # Taken before the first run, so files changed while it runs are seen as changes
+        snapshot = self._snapshot(documents_dir)
+        self.index_documents(documents_dir)
+        last_change = None
+        
+        print(f"\n👀 Watching {documents_dir} (Ctrl+C to stop)...")
+        try:
+            while True:
+                time.sleep(poll_interval)
+                current = self._snapshot(documents_dir)
+                if current != snapshot:
+                    snapshot = current
+                    last_change = time.monotonic()
+                    continue
+                
+                if last_change is not None and time.monotonic() - last_change >= debounce:
+                    last_change = None
+                    self.index_documents(documents_dir)
+                    print(f"\n👀 Watching {documents_dir} (Ctrl+C to stop)...")
+        except KeyboardInterrupt:
+            print("\n✓ Watch mode stopped")
+    
+    def _snapshot(self, documents_dir: str) -> dict:
+        """path -> (size, mtime) for the files in a directory"""
+        snapshot = {}
+        if not os.path.isdir(documents_dir):
+            return snapshot
+        for entry in os.scandir(documents_dir):
+            if entry.is_file():
+                stat = entry.stat()
+                snapshot[entry.path] = (stat.st_size, stat.st_mtime)
+        return snapshot
+    
+    def _track_loaded(self, documents, loaded: set):
+        """Pass documents through, recording which paths were actually loaded"""
+        for doc in documents:
+            loaded.add(doc['path'])
+            yield doc
+    
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(config.CHROMA_DB_DIR, f"{self.vector_store.collection_name}.manifest.json")
+    
+    def _load_manifest(self) -> dict:
+        """Indexed files from the previous run: path -> {size, mtime, sha256}"""
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠ Could not read manifest, re-indexing everything: {e}")
+            return {}
+    
+    def _save_manifest(self, manifest: dict):
+        with open(self.manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+    
+    def _file_hash(self, path: str) -> str:
+        """SHA-256 of a file's bytes, read in 1 MB blocks"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
     def query(self, question: str, top_k: int = config.TOP_K_RESULTS) -> dict:
         """
         Query the RAG system
@@ -102,6 +234,7 @@ class RAGSystem:
         for chunk in relevant_chunks:
             sources.append({
                 'filename': chunk['metadata'].get('filename', 'unknown'),
+                'page': chunk['metadata'].get('page'),
                 'text': chunk['text'][:200] + "..." if len(chunk['text']) > 200 else chunk['text'],
                 'distance': chunk.get('distance', 0.0)
             })
@@ -114,6 +247,8 @@ class RAGSystem:
     def clear_index(self):
         """Clear all indexed documents"""
         self.vector_store.clear_collection()
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
     
     def get_stats(self):
         """Get system statistics"""
@@ -0,0 +1,215 @@
+"""
+Token-bucket rate limiter shared across processes through a SQLite file
+
+Every gunicorn worker and batch job debits the same per-provider buckets, one
+for requests per minute and one for tokens per minute, so together they stay
+under the provider's quotas instead of bursting into 429s. Callers wait for
+capacity, up to a deadline, instead of failing.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+
+class RateLimitTimeout(Exception):
+    """No capacity became available before the caller's deadline"""
+
+
+# One limiter object per provider name in this process
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name):
+    """Shared limiter for a provider, or None if config.API_RATE_LIMITS has no (non-zero) limits for it"""
+    requests_per_minute, tokens_per_minute = config.API_RATE_LIMITS.get(name, (0, 0))
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(name, requests_per_minute, tokens_per_minute)
+        return _limiters[name]
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets for one provider"""
+
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int,
+                 path: str = config.RATE_LIMIT_PATH):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.path = path
+
+        # Process-local wait statistics
+        self._stats_lock = threading.Lock()
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    requests REAL NOT NULL,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    blocked_until REAL NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute(
+                "INSERT OR IGNORE INTO buckets (name, requests, tokens, updated_at) VALUES (?, ?, ?, ?)",
+                (name, float(requests_per_minute), float(tokens_per_minute), time.time())
+            )
+
+    @contextmanager
+    def _transaction(self):
+        """Exclusive write transaction: bucket updates are serialized across processes"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def _refilled(self, row, now):
+        """Bucket levels after refilling at the per-minute rates since the last update"""
+        requests, tokens, updated_at, blocked_until = row
+        elapsed = max(0.0, now - updated_at)
+        if self.requests_per_minute:
+            requests = min(self.requests_per_minute, requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            tokens = min(self.tokens_per_minute, tokens + elapsed * self.tokens_per_minute / 60)
+        return requests, tokens, blocked_until
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Debit one request and tokens if available; otherwise seconds to wait before retrying"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT requests, tokens, updated_at, blocked_until FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            available_requests, available_tokens, blocked_until = self._refilled(row, now)
+
+            # A request larger than the whole bucket can only ever wait for a full one
+            tokens = min(tokens, self.tokens_per_minute) if self.tokens_per_minute else 0
+
+            wait = max(0.0, blocked_until - now)
+            if self.requests_per_minute and available_requests < 1:
+                wait = max(wait, (1 - available_requests) * 60 / self.requests_per_minute)
+            if self.tokens_per_minute and available_tokens < tokens:
+                wait = max(wait, (tokens - available_tokens) * 60 / self.tokens_per_minute)
+
+            if wait == 0:
+                if self.requests_per_minute:
+                    available_requests -= 1
+                available_tokens -= tokens
+
+            conn.execute(
+                "UPDATE buckets SET requests = ?, tokens = ?, updated_at = ? WHERE name = ?",
+                (available_requests, available_tokens, now, self.name)
+            )
+        return wait
+
+    def acquire(self, tokens: int, max_wait: float = config.RATE_LIMIT_MAX_WAIT) -> float:
+        """
+        Wait until one request and the estimated tokens fit, then debit them
+
+        Args:
+            tokens: Estimated tokens of the call (prompt + expected completion)
+            max_wait: Seconds to queue before giving up
+
+        Returns:
+            Seconds spent waiting
+
+        Raises:
+            RateLimitTimeout: if capacity isn't available within max_wait
+        """
+        start = time.monotonic()
+        deadline = start + max_wait
+        queued = False
+
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait == 0:
+                waited = time.monotonic() - start if queued else 0.0
+                with self._stats_lock:
+                    self.acquired += 1
+                    if queued:
+                        self.waits += 1
+                        self.wait_seconds += waited
+                return waited
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or wait > remaining:
+                with self._stats_lock:
+                    self.timeouts += 1
+                raise RateLimitTimeout(
+                    f"Quota {self.name} esaurita: servirebbero {wait:.1f}s di attesa (limite {max_wait:.0f}s)"
+                )
+            # Re-check at least every second: other processes may give tokens back
+            queued = True
+            time.sleep(min(wait, 1.0))
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """Correct the token bucket once the provider reports actual usage"""
+        if not self.tokens_per_minute or actual_tokens == estimated_tokens:
+            return
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT requests, tokens, updated_at, blocked_until FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            available_requests, available_tokens, _ = self._refilled(row, now)
+            available_tokens = min(self.tokens_per_minute, available_tokens + estimated_tokens - actual_tokens)
+            conn.execute(
+                "UPDATE buckets SET requests = ?, tokens = ?, updated_at = ? WHERE name = ?",
+                (available_requests, available_tokens, now, self.name)
+            )
+
+    def block(self, seconds: float):
+        """Pause every caller (all processes) after the provider answered 429"""
+        until = time.time() + seconds
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE buckets SET blocked_until = MAX(blocked_until, ?) WHERE name = ?", (until, self.name)
+            )
+
+    def stats(self) -> dict:
+        """Current utilization of the shared buckets and this process's waits"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT requests, tokens, updated_at, blocked_until FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+        available_requests, available_tokens, blocked_until = self._refilled(row, now)
+
+        with self._stats_lock:
+            return {
+                'requests_per_minute': self.requests_per_minute,
+                'tokens_per_minute': self.tokens_per_minute,
+                'request_utilization': round(1 - available_requests / self.requests_per_minute, 3)
+                if self.requests_per_minute else None,
+                'token_utilization': round(1 - available_tokens / self.tokens_per_minute, 3)
+                if self.tokens_per_minute else None,
+                'blocked_for': round(max(0.0, blocked_until - now), 1),
+                'acquired': self.acquired,
+                'waits': self.waits,
+                'mean_wait_seconds': round(self.wait_seconds / self.waits, 2) if self.waits else 0.0,
+                'timeouts': self.timeouts
+            }
@@ -0,0 +1,65 @@
+"""API provider tests against mock_llm_server.py (no network or API key)"""
+
+import socket
+
+import pytest
+
+import mock_llm_server
+from api_llm import LLMRequestError, OpenAICompatibleProvider
+from rate_limiter import RateLimiter
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def mock_server():
+    server = mock_llm_server.start_in_thread(port=free_port())
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_provider(server, path="/v1"):
+    port = server.server_address[1]
+    return OpenAICompatibleProvider("mock", f"http://127.0.0.1:{port}{path}", "mock", "mock-llm", 8192)
+
+
+def accented_prompt(max_tokens):
+    """A prompt whose mock reply contains non-ASCII characters"""
+    for i in range(1000):
+        prompt = f"Richiesta informazioni {i}"
+        reply, _ = mock_llm_server.mock_reply(prompt, max_tokens)
+        if "è" in reply:
+            return prompt, reply
+    raise AssertionError("no mock reply with accented characters")
+
+
+def test_stream_decodes_utf8(mock_server):
+    prompt, reply = accented_prompt(256)
+    provider = make_provider(mock_server)
+
+    streamed = "".join(provider.generate_stream(prompt, max_new_tokens=256))
+
+    assert streamed == reply
+    assert "è" in streamed
+
+
+def test_stream_matches_plain_generation(mock_server):
+    prompt, _ = accented_prompt(256)
+    provider = make_provider(mock_server)
+
+    assert "".join(provider.generate_stream(prompt, max_new_tokens=256)) == provider.generate(prompt, max_new_tokens=256)
+
+
+def test_failed_call_refunds_quota(mock_server, tmp_path):
+    provider = make_provider(mock_server, path="/missing")  # answered with 404: not retried
+    provider.rate_limiter = RateLimiter("test", 1000, 100000, path=str(tmp_path / "rate_limits.sqlite"))
+
+    with pytest.raises(LLMRequestError):
+        provider.generate("Richiesta informazioni " * 2000, max_new_tokens=256)
+
+    assert provider.rate_limiter.stats()['token_utilization'] < 0.01
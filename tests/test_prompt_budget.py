@@ -0,0 +1,47 @@
+"""Prompt token budget: section caps follow the LLM's context window"""
+
+import math
+
+import config
+from dual_rag_system import DualRAGSystem
+
+
+class FakeLLM:
+    """Counts ~3.5 characters per token, like ApiLLM without a tokenizer"""
+
+    def __init__(self, max_input_tokens):
+        self.max_input_tokens = max_input_tokens
+
+    def count_tokens(self, text):
+        return math.ceil(len(text) / 3.5)
+
+
+def build_prompt(max_input_tokens, email_body):
+    rag = DualRAGSystem.__new__(DualRAGSystem)  # prompt assembly needs only the LLM
+    rag.llm = FakeLLM(max_input_tokens)
+    segments = rag._build_generation_prompt(email_body, "Iscrizione", [], [], "Rispondi in italiano.",
+                                            base_instruction="Sei un assistente email.")
+    return "".join(text for text, _ in segments)
+
+
+def long_email():
+    sentence = "Vorrei sapere quali documenti servono per l'iscrizione e quando scade il bando. "
+    return sentence * (config.PROMPT_EMAIL_MAX_TOKENS * 4 // len(sentence) + 10)
+
+
+def test_long_email_untruncated_with_large_context():
+    email_body = long_email()
+
+    prompt = build_prompt(131072 - config.MAX_NEW_TOKENS, email_body)
+
+    assert email_body.strip() in prompt
+    assert "[...]" not in prompt
+
+
+def test_long_email_truncated_for_local_context():
+    email_body = long_email()
+
+    prompt = build_prompt(config.LOCAL_MAX_INPUT_TOKENS, email_body)
+
+    assert email_body.strip() not in prompt
+    assert "[...]" in prompt
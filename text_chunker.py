@@ -2,17 +2,67 @@
 Text chunking utilities for breaking documents into smaller pieces
 """
 
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional
+import hashlib
+import random
+import re
 import config
 
 
+# Paragraphs are separated by one or more blank lines
+PARAGRAPH_SPLIT = re.compile(r'\n\s*\n')
+
+# Sentence terminators: Latin (. ! ? …), Arabic question mark and full stop (؟ ۔),
+# Devanagari danda (। ॥) and CJK full stop (。), followed by whitespace or end of text
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?…؟۔।॥。])["\'”’»)\]]*\s+')
+
+# Gear rolling hash table for content-defined chunking (fixed seed: boundaries
+# must be identical across processes and restarts)
+_gear_rng = random.Random(0x9E3779B9)
+GEAR_TABLE = [_gear_rng.getrandbits(64) for _ in range(256)]
+GEAR_MASK = (1 << 64) - 1
+
+
+def chunk_hash(text: str) -> str:
+    """Stable content hash used to match chunks across re-indexing"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
 class TextChunker:
     """Split text into overlapping chunks"""
     
-    def __init__(self, chunk_size: int = config.CHUNK_SIZE, 
-                 chunk_overlap: int = config.CHUNK_OVERLAP):
+    def __init__(self, chunk_size: int = config.CHUNK_SIZE,
+                 chunk_overlap: int = config.CHUNK_OVERLAP,
+                 mode: str = config.CHUNKING_MODE,
+                 max_tokens: int = config.CHUNK_MAX_TOKENS,
+                 overlap_sentences: int = config.CHUNK_OVERLAP_SENTENCES,
+                 min_tokens: int = config.CHUNK_CDC_MIN_TOKENS,
+                 avg_sentences: int = config.CHUNK_CDC_AVG_SENTENCES,
+                 tokenizer=None):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.mode = mode
+        self.max_tokens = max_tokens
+        self.overlap_sentences = overlap_sentences
+        self.min_tokens = min_tokens
+        # Cut when the top bits of the hash are zero: probability 1/avg_sentences
+        self.cut_bits = max(1, (avg_sentences - 1).bit_length())
+        self._tokenizer = tokenizer
+    
+    @property
+    def tokenizer(self):
+        """Embedding model tokenizer, loaded on first use"""
+        if self._tokenizer is None:
+            from vector_store import get_embedding_model
+            self._tokenizer = get_embedding_model().tokenizer
+        return self._tokenizer
+    
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """Count embedding word-pieces for each text (without special tokens)"""
+        if not texts:
+            return []
+        encoded = self.tokenizer(texts, add_special_tokens=False)['input_ids']
+        return [len(ids) for ids in encoded]
     
     def chunk_text(self, text: str, metadata: Optional[dict] = None) -> List[dict]:
         """
@@ -25,22 +75,83 @@ class TextChunker:
         Returns:
             List of dictionaries with 'text' and 'metadata' keys
         """
+        return list(self.iter_chunks(text, metadata))
+    
+    def iter_chunks(self, text: str, metadata: Optional[dict] = None) -> Iterator[dict]:
+        """
+        Lazily yield chunks of a text
+        
+        All chunks of the same text share one metadata dict.
+        
+        Args:
+            text: The text to chunk
+            metadata: Optional metadata to attach to each chunk
+        
+        Yields:
+            Dictionaries with 'text' and 'metadata' keys
+        """
         if not text:
-            return []
+            return
         
-        chunks = []
+        metadata = metadata or {}
+        if self.mode == 'character':
+            pieces = self._split_by_characters(text)
+        else:
+            pieces = (self._join_units(group) for group in self._pack_units(self._sentence_units([{'text': text}])))
+        
+        for piece in pieces:
+            yield {'text': piece, 'metadata': metadata}
+    
+    def iter_record_chunks(self, records: Iterable[dict], metadata: Optional[dict] = None) -> Iterator[dict]:
+        """
+        Lazily chunk a stream of page/paragraph records
+        
+        Records come from DocumentLoader.iter_records: dicts with 'text' and a
+        source offset ('page' or 'paragraph'). Sentences are packed across
+        records, and each chunk's metadata cites where it starts ('page') and,
+        if it spans records, where it ends ('page_end').
+        
+        Args:
+            records: Iterable of record dicts
+            metadata: Optional metadata to attach to each chunk
+        
+        Yields:
+            Dictionaries with 'text' and 'metadata' keys
+        """
+        metadata = metadata or {}
+        
+        if self.mode == 'character':
+            # Character windows never span records
+            for record in records:
+                location = self._record_location(record)
+                for piece in self._split_by_characters(record.get('text', '')):
+                    yield {'text': piece, 'metadata': dict(metadata, **location)}
+            return
+        
+        for group in self._pack_units(self._sentence_units(records)):
+            chunk_metadata = dict(metadata, **group[0][3])
+            for key, value in group[-1][3].items():
+                if chunk_metadata.get(key) != value:
+                    chunk_metadata[f"{key}_end"] = value
+            yield {'text': self._join_units(group), 'metadata': chunk_metadata}
+    
+    def _record_location(self, record: dict) -> dict:
+        """Source offset keys of a record"""
+        return {key: record[key] for key in ('page', 'paragraph') if key in record}
+    
+    def _pack_units(self, units: Iterator[tuple]) -> Iterator[List[tuple]]:
+        """Group sentence units into chunks according to the chunking mode"""
+        if self.mode == 'content':
+            return self._split_by_content(units)
+        return self._split_by_sentences(units)
+    
+    def _split_by_characters(self, text: str) -> Iterator[str]:
+        """Fixed-size character windows with character overlap"""
         start = 0
         
         while start < len(text):
             end = start + self.chunk_size
-            chunk_text = text[start:end]
-            
-            # Create chunk with metadata
-            chunk = {
-                'text': chunk_text,
-                'metadata': metadata or {}
-            }
-            chunks.append(chunk)
+            yield text[start:end]
             
             # Move to next chunk with overlap
             start = end - self.chunk_overlap
@@ -48,15 +159,144 @@ class TextChunker:
             # Break if we've reached the end
             if end >= len(text):
                 break
+    
+    def _split_sentences(self, paragraph: str) -> List[str]:
+        """Split a paragraph into sentences on multilingual terminators"""
+        sentences = SENTENCE_SPLIT.split(paragraph)
+        return [s.strip() for s in sentences if s and s.strip()]
+    
+    def _split_long_sentence(self, sentence: str) -> List[str]:
+        """Break a sentence that exceeds the token budget on word boundaries"""
+        words = sentence.split()
+        pieces = []
+        current = []
+        current_tokens = 0
+        
+        for word, tokens in zip(words, self.count_tokens(words)):
+            if current and current_tokens + tokens > self.max_tokens:
+                pieces.append(' '.join(current))
+                current = []
+                current_tokens = 0
+            current.append(word)
+            current_tokens += tokens
         
-        return chunks
+        if current:
+            pieces.append(' '.join(current))
+        return pieces
+    
+    def _iter_paragraphs(self, text: str) -> Iterator[str]:
+        """Yield non-empty paragraphs without splitting the whole text up front"""
+        start = 0
+        for match in PARAGRAPH_SPLIT.finditer(text):
+            paragraph = text[start:match.start()].strip()
+            if paragraph:
+                yield paragraph
+            start = match.end()
+        paragraph = text[start:].strip()
+        if paragraph:
+            yield paragraph
+    
+    def _sentence_units(self, records: Iterable[dict]) -> Iterator[tuple]:
+        """
+        Break records into (sentence, token_count, paragraph_index, location)
+        units, each of which fits within the token budget
+        """
+        para_idx = 0
+        for record in records:
+            location = self._record_location(record)
+            for paragraph in self._iter_paragraphs(record.get('text', '')):
+                sentences = self._split_sentences(paragraph)
+                for sentence, tokens in zip(sentences, self.count_tokens(sentences)):
+                    if tokens <= self.max_tokens:
+                        yield (sentence, tokens, para_idx, location)
+                        continue
+                    parts = self._split_long_sentence(sentence)
+                    for part, part_tokens in zip(parts, self.count_tokens(parts)):
+                        yield (part, part_tokens, para_idx, location)
+                para_idx += 1
+    
+    def _join_units(self, units: List[tuple]) -> str:
+        """Rebuild chunk text, keeping paragraph breaks between sentences"""
+        text = units[0][0]
+        for prev, unit in zip(units, units[1:]):
+            separator = ' ' if unit[2] == prev[2] else '\n\n'
+            text += separator + unit[0]
+        return text
+    
+    def _split_by_sentences(self, units: Iterator[tuple]) -> Iterator[List[tuple]]:
+        """
+        Pack whole sentences into chunks of at most max_tokens embedding tokens,
+        repeating the last overlap_sentences sentences at the start of the next chunk
+        """
+        current = []
+        current_tokens = 0
+        
+        for unit in units:
+            tokens = unit[1]
+            if current and current_tokens + tokens > self.max_tokens:
+                yield current
+                
+                # Carry trailing sentences over as overlap, as long as they leave room
+                overlap = current[-self.overlap_sentences:] if self.overlap_sentences > 0 else []
+                while overlap and sum(u[1] for u in overlap) + tokens > self.max_tokens:
+                    overlap = overlap[1:]
+                current = list(overlap)
+                current_tokens = sum(u[1] for u in current)
+            
+            current.append(unit)
+            current_tokens += tokens
+        
+        if current:
+            yield current
+    
+    def _is_cut_point(self, sentence: str) -> bool:
+        """
+        Gear rolling hash over the bytes ending this sentence
+        
+        A 64-bit Gear hash only depends on the last 64 bytes, so the decision
+        is local to the end of the sentence and unaffected by edits elsewhere.
+        """
+        h = 0
+        for byte in sentence.encode('utf-8')[-64:]:
+            h = ((h << 1) + GEAR_TABLE[byte]) & GEAR_MASK
+        return (h >> (64 - self.cut_bits)) == 0
+    
+    def _split_by_content(self, units: Iterator[tuple]) -> Iterator[List[tuple]]:
+        """
+        Content-defined chunking on sentence boundaries
+        
+        A chunk ends after a sentence whose rolling hash hits the cut pattern
+        (once it has at least min_tokens), or when the next sentence would
+        exceed max_tokens. Boundaries depend on local content, so an edit to
+        one paragraph only changes the chunks around it. No overlap is added,
+        which would make each chunk depend on its predecessor.
+        """
+        current = []
+        current_tokens = 0
+        
+        for unit in units:
+            if current and current_tokens + unit[1] > self.max_tokens:
+                yield current
+                current = []
+                current_tokens = 0
+            
+            current.append(unit)
+            current_tokens += unit[1]
+            
+            if current_tokens >= self.min_tokens and self._is_cut_point(unit[0]):
+                yield current
+                current = []
+                current_tokens = 0
+        
+        if current:
+            yield current
     
     def chunk_documents(self, documents: List[dict]) -> List[dict]:
         """
         Chunk multiple documents
         
         Args:
-            documents: List of documents with 'content' and optional metadata
+            documents: List of documents with 'content' (or 'records') and optional metadata
         
         Returns:
             List of chunks with metadata
@@ -64,14 +304,49 @@ class TextChunker:
         all_chunks = []
         
         for doc in documents:
-            content = doc.get('content', '')
-            metadata = {
-                'filename': doc.get('filename', 'unknown'),
-                'path': doc.get('path', '')
-            }
-            
-            chunks = self.chunk_text(content, metadata)
-            all_chunks.extend(chunks)
+            all_chunks.extend(self._iter_document_chunks(doc))
         
         print(f"Created {len(all_chunks)} chunks from {len(documents)} documents")
         return all_chunks
+    
+    def iter_chunk_batches(self, documents: Iterable[dict],
+                           batch_size: int = config.EMBEDDING_BATCH_SIZE) -> Iterator[List[dict]]:
+        """
+        Stream chunks of multiple documents in fixed-size batches
+        
+        Only one batch of chunks is held at a time, so the caller can embed and
+        store each batch before the next one is produced.
+        
+        Args:
+            documents: Iterable of documents with 'content' (or 'records') and optional metadata
+            batch_size: Maximum number of chunks per batch
+        
+        Yields:
+            Lists of at most batch_size chunks
+        """
+        batch = []
+        
+        for doc in documents:
+            for chunk in self._iter_document_chunks(doc):
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        
+        if batch:
+            yield batch
+    
+    def _iter_document_chunks(self, doc: dict) -> Iterator[dict]:
+        """Chunks of a document given either as 'content' or as streamed 'records'"""
+        if 'records' in doc:
+            return self.iter_record_chunks(doc['records'], self._document_metadata(doc))
+        return self.iter_chunks(doc.get('content', ''), self._document_metadata(doc))
+    
+    def _document_metadata(self, doc: dict) -> dict:
+        """Metadata shared by every chunk of a document"""
+        metadata = {
+            'filename': doc.get('filename', 'unknown'),
+            'path': doc.get('path', '')
+        }
+        metadata.update(doc.get('metadata') or {})
+        return metadata
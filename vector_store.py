@@ -5,9 +5,9 @@ Vector store using FAISS for semantic search
 
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Optional
+from typing import Iterable, List, Dict, Optional
 import config
+import minhash
 import os
 import pickle
 
@@ -18,9 +18,16 @@ def get_embedding_model():
     """Get or create the embedding model (singleton pattern)"""
     global _embedding_model_cache
     if _embedding_model_cache is None:
+        # Imported here: sentence_transformers pulls in torch and transformers
+        from sentence_transformers import SentenceTransformer
+        
         print(f"Loading embedding model: {config.EMBEDDING_MODEL}")
         _embedding_model_cache = SentenceTransformer(config.EMBEDDING_MODEL)
         _embedding_model_cache.to(config.DEVICE)
+        dimension = _embedding_model_cache.get_sentence_embedding_dimension()
+        if dimension != config.EMBEDDING_DIMENSION:
+            raise ValueError(f"EMBEDDING_DIMENSION is {config.EMBEDDING_DIMENSION} but {config.EMBEDDING_MODEL} "
+                             f"produces {dimension}-dimensional vectors: update config.py")
         print("✓ Embedding model loaded")
     return _embedding_model_cache
 
@@ -34,12 +41,8 @@ class VectorStore:
         # Set collection name
         self.collection_name = collection_name or config.COLLECTION_NAME
         
-        # Defer model loading until first use
-        self._embedding_model = None
-        
-        # Get embedding dimension (requires model)
-        model = get_embedding_model()
-        self.dimension = model.get_sentence_embedding_dimension()
+        # The embedding model is loaded on first use (see embedding_model)
+        self.dimension = config.EMBEDDING_DIMENSION
         
         # Initialize FAISS index
         os.makedirs(config.CHROMA_DB_DIR, exist_ok=True)
@@ -54,6 +57,10 @@ class VectorStore:
                     data = pickle.load(f)
                     self.documents = data['documents']
                     self.metadatas = data['metadatas']
+                    self.signatures = data.get('signatures')
+                    self.clusters = data.get('clusters')
+                if self.signatures is None or self.clusters is None:
+                    self._build_signatures()
                 print(f"Loaded existing index '{self.collection_name}' with {len(self.documents)} documents")
             except Exception as e:
                 print(f"⚠️ Warning: Could not load index '{self.collection_name}': {e}")
@@ -62,6 +69,8 @@ class VectorStore:
                 self.index = faiss.IndexFlatL2(self.dimension)
                 self.documents = []
                 self.metadatas = []
+                self.signatures = []
+                self.clusters = []
                 # Remove corrupted files
                 try:
                     if os.path.exists(self.index_path):
@@ -75,7 +84,56 @@ class VectorStore:
             self.index = faiss.IndexFlatL2(self.dimension)
             self.documents = []
             self.metadatas = []
+            self.signatures = []
+            self.clusters = []
             print(f"Created new FAISS index '{self.collection_name}'")
+        
+        self._lsh = None
+    
+    def _build_signatures(self):
+        """Compute MinHash signatures and duplicate clusters for an index saved without them"""
+        print(f"🔧 Calcolo firme MinHash per {len(self.documents)} chunk...")
+        self.signatures = []
+        self.clusters = []
+        self._lsh = minhash.MinHashLSH()
+        for idx, text in enumerate(self.documents):
+            sig = minhash.signature(text)
+            match = self._find_duplicate(text, sig)
+            self.signatures.append(sig)
+            self.clusters.append(self.clusters[match] if match is not None else idx)
+            self._lsh.add(idx, sig)
+    
+    @property
+    def lsh(self) -> minhash.MinHashLSH:
+        """LSH buckets over stored signatures, rebuilt lazily after deletions"""
+        if self._lsh is None:
+            self._lsh = minhash.MinHashLSH()
+            for idx, sig in enumerate(self.signatures):
+                self._lsh.add(idx, sig)
+        return self._lsh
+    
+    def _find_duplicate(self, text: str, sig: np.ndarray, pending=((), ())) -> Optional[int]:
+        """
+        Position of a near-duplicate of text, if any
+        
+        A chunk with the same normalized text is preferred over one that is
+        only similar. pending holds (texts, signatures) not yet stored, at
+        the positions following the stored chunks.
+        """
+        base = len(self.documents)
+        normalized = minhash.normalize(text)
+        match = None
+        for idx in sorted(self.lsh.query(sig)):
+            if idx < base:
+                other_text, other_sig = self.documents[idx], self.signatures[idx]
+            else:
+                other_text, other_sig = pending[0][idx - base], pending[1][idx - base]
+            if minhash.is_near_duplicate(text, sig, other_text, other_sig):
+                if minhash.normalize(other_text) == normalized:
+                    return idx
+                if match is None:
+                    match = idx
+        return match
     
     @property
     def embedding_model(self):
@@ -100,40 +158,120 @@ class VectorStore:
             return embeddings.tolist()
         return embeddings
     
-    def add_documents(self, chunks: List[dict]):
+    def add_documents(self, chunks: List[dict], save: bool = True, dedupe: bool = config.DEDUP_ENABLED) -> int:
         """
         Add document chunks to the vector store
         
+        With dedupe, a chunk whose normalized text equals a stored one is not
+        embedded again: its metadata is appended to the stored chunk's
+        'duplicates' list as an extra source reference. Near-duplicates found
+        by MinHash + LSH are stored with their own text and only share a
+        cluster: a small edit ("è richiesto" -> "non è richiesto") can
+        change the fact, so the edited text must stay retrievable.
+        
         Args:
             chunks: List of dicts with 'text' and 'metadata' keys
+            save: Write the index to disk after adding
+            dedupe: Merge identical chunks instead of storing them
+        
+        Returns:
+            Number of new vectors stored
         """
         if not chunks:
             print("No chunks to add")
-            return
+            return 0
         
         print(f"\nAdding {len(chunks)} chunks to vector store...")
         
-        # Extract texts and metadata
-        texts = [chunk['text'] for chunk in chunks]
-        metadatas = [chunk['metadata'] for chunk in chunks]
+        # Extract texts and metadata, routing identical chunks to existing entries
+        base = len(self.documents)
+        next_cluster = max(self.clusters, default=-1) + 1
+        texts = []
+        metadatas = []
+        signatures = []
+        clusters = []
+        merged = 0
+        for chunk in chunks:
+            sig = minhash.signature(chunk['text'])
+            match = self._find_duplicate(chunk['text'], sig, pending=(texts, signatures))
+            match_text = None
+            if match is not None:
+                match_text = self.documents[match] if match < base else texts[match - base]
+            
+            if dedupe and match_text is not None and minhash.normalize(match_text) == minhash.normalize(chunk['text']):
+                # Copy: chunks of one document share a metadata dict
+                target = self.metadatas[match] if match < base else metadatas[match - base]
+                target = dict(target, duplicates=target.get('duplicates', []) + [chunk['metadata']])
+                if match < base:
+                    self.metadatas[match] = target
+                else:
+                    metadatas[match - base] = target
+                merged += 1
+                continue
+            
+            if match is None:
+                cluster = next_cluster
+                next_cluster += 1
+            else:
+                cluster = self.clusters[match] if match < base else clusters[match - base]
+            
+            # New chunks join the LSH right away so duplicates within the batch merge too
+            self.lsh.add(base + len(texts), sig)
+            texts.append(chunk['text'])
+            metadatas.append(chunk['metadata'])
+            signatures.append(sig)
+            clusters.append(cluster)
         
-        # Generate embeddings
-        embeddings = self.embed_texts(texts)
+        if texts:
+            try:
+                # Generate embeddings
+                embeddings = self.embed_texts(texts)
+                
+                # Convert to numpy array for FAISS
+                embeddings_array = np.array(embeddings).astype('float32')
+                
+                # Add to FAISS index
+                self.index.add(embeddings_array)  # type: ignore
+            except Exception:
+                self._lsh = None  # drop the pending positions
+                raise
+            
+            # Store documents and metadata
+            self.documents.extend(texts)
+            self.metadatas.extend(metadatas)
+            self.signatures.extend(signatures)
+            self.clusters.extend(clusters)
+        
+        # Save to disk
+        if save:
+            self._save_index()
         
-        # Convert to numpy array for FAISS
-        embeddings_array = np.array(embeddings).astype('float32')
+        if merged:
+            print(f"♻️ {merged} chunk duplicati uniti a chunk esistenti")
+        print(f"✓ Successfully added {len(texts)} chunks to vector store")
+        return len(texts)
+    
+    def add_document_batches(self, batches: Iterable[List[dict]]) -> int:
+        """
+        Embed and add chunk batches as they are produced
         
-        # Add to FAISS index
-        self.index.add(embeddings_array)  # type: ignore
+        Keeps peak memory bounded by the batch size instead of the document
+        size; the index is written to disk once at the end.
         
-        # Store documents and metadata
-        self.documents.extend(texts)
-        self.metadatas.extend(metadatas)
+        Args:
+            batches: Iterable of chunk lists (e.g. TextChunker.iter_chunk_batches)
         
-        # Save to disk
-        self._save_index()
+        Returns:
+            Number of chunks added
+        """
+        total = 0
+        for batch in batches:
+            self.add_documents(batch, save=False)
+            total += len(batch)
         
-        print(f"✓ Successfully added {len(chunks)} chunks to vector store")
+        if total:
+            self._save_index()
+        return total
     
     def search(self, query: str, top_k: int = config.TOP_K_RESULTS) -> List[Dict]:
         """
@@ -149,26 +287,156 @@ class VectorStore:
         if len(self.documents) == 0:
             return []
         
-        # Generate query embedding
-        query_embedding = self.embed_text(query)
-        query_vector = np.array([query_embedding]).astype('float32')
+        return self.search_vectors([self.embed_text(query)], top_k)[0]
+    
+    def search_vectors(self, query_vectors, top_k: int = config.TOP_K_RESULTS) -> List[List[Dict]]:
+        """
+        Search for several already-embedded queries in one FAISS call
         
-        # Search FAISS index
-        top_k = min(top_k, len(self.documents))  # Don't request more than we have
-        distances, indices = self.index.search(query_vector, top_k)  # type: ignore
+        Args:
+            query_vectors: Query embeddings, one row per query
+            top_k: Number of results to return per query
         
-        # Format results
+        Returns:
+            One list of relevant document chunks per query
+        """
+        query_vectors = np.asarray(query_vectors, dtype='float32')
+        if len(self.documents) == 0:
+            return [[] for _ in range(len(query_vectors))]
+        
+        # Search FAISS index, over-fetching so duplicate clusters can be collapsed
+        fetch_k = min(top_k * config.DEDUP_SEARCH_OVERFETCH, len(self.documents))  # Don't request more than we have
+        distances, indices = self.index.search(query_vectors, fetch_k)  # type: ignore
+        
+        return [self._format_results(distances[row], indices[row], top_k) for row in range(len(query_vectors))]
+    
+    def _format_results(self, distances, indices, top_k: int) -> List[Dict]:
+        """Format results, one representative (the closest) per duplicate cluster"""
         formatted_results = []
-        for i, idx in enumerate(indices[0]):
-            if idx < len(self.documents):  # Ensure valid index
+        seen_clusters = set()
+        for i, idx in enumerate(indices):
+            if len(formatted_results) >= top_k:
+                break
+            if 0 <= idx < len(self.documents):  # Ensure valid index
+                if self.clusters[idx] in seen_clusters:
+                    continue
+                seen_clusters.add(self.clusters[idx])
                 formatted_results.append({
                     'text': self.documents[idx],
                     'metadata': self.metadatas[idx] if idx < len(self.metadatas) else {},
-                    'distance': float(distances[0][i])
+                    'distance': float(distances[i])
                 })
         
         return formatted_results
     
+    @staticmethod
+    def _sources(metadata: dict) -> List[dict]:
+        """A chunk's own metadata followed by its merged duplicate references"""
+        return [metadata] + metadata.get('duplicates', [])
+    
+    @staticmethod
+    def _matches(source: dict, where: dict) -> bool:
+        return all(source.get(key) == value for key, value in where.items())
+    
+    def find_indices(self, **where) -> List[int]:
+        """
+        Positions of the chunks with a source whose metadata matches every given key/value
+        
+        Example:
+            store.find_indices(doc_id=12)
+        """
+        return [
+            i for i, metadata in enumerate(self.metadatas)
+            if any(self._matches(source, where) for source in self._sources(metadata))
+        ]
+    
+    def find_sources(self, **where) -> List[dict]:
+        """Source references (own or merged duplicate metadata) matching every given key/value"""
+        return [
+            source for metadata in self.metadatas
+            for source in self._sources(metadata)
+            if self._matches(source, where)
+        ]
+    
+    def remove_sources(self, where: dict, hash_counts: Optional[Dict[str, int]] = None,
+                       save: bool = True) -> int:
+        """
+        Remove source references and delete chunks left without any source
+        
+        When a chunk's own source is removed but merged duplicates remain, the
+        first duplicate is promoted to be the chunk's metadata.
+        
+        Args:
+            where: Metadata key/values a reference must match
+            hash_counts: If given, remove at most n references per 'chunk_hash'
+            save: Write the index to disk afterwards
+        
+        Returns:
+            Number of references removed
+        """
+        budget = dict(hash_counts) if hash_counts is not None else None
+        removed = 0
+        orphaned = []
+        
+        for idx, metadata in enumerate(self.metadatas):
+            kept = []
+            for source in self._sources(metadata):
+                if self._matches(source, where):
+                    if budget is None:
+                        removed += 1
+                        continue
+                    h = source.get('chunk_hash')
+                    if budget.get(h, 0) > 0:
+                        budget[h] -= 1
+                        removed += 1
+                        continue
+                kept.append(source)
+            
+            if not kept:
+                orphaned.append(idx)
+            elif len(kept) < len(self._sources(metadata)):
+                # Rebuild the entry; the first remaining source becomes its metadata
+                primary = {k: v for k, v in kept[0].items() if k != 'duplicates'}
+                if len(kept) > 1:
+                    primary['duplicates'] = kept[1:]
+                self.metadatas[idx] = primary
+        
+        self.delete_indices(orphaned, save=False)
+        if save:
+            self._save_index()
+        return removed
+    
+    def delete_indices(self, indices: List[int], save: bool = True) -> int:
+        """
+        Remove chunks by position
+        
+        IndexFlatL2.remove_ids compacts the remaining vectors in order, so the
+        documents/metadatas lists stay aligned with the FAISS ids.
+        
+        Returns:
+            Number of chunks removed
+        """
+        to_remove = sorted(set(i for i in indices if 0 <= i < len(self.documents)))
+        if not to_remove:
+            return 0
+        
+        self.index.remove_ids(np.array(to_remove, dtype='int64'))  # type: ignore
+        
+        removed = set(to_remove)
+        self.documents = [d for i, d in enumerate(self.documents) if i not in removed]
+        self.metadatas = [m for i, m in enumerate(self.metadatas) if i not in removed]
+        self.signatures = [s for i, s in enumerate(self.signatures) if i not in removed]
+        self.clusters = [c for i, c in enumerate(self.clusters) if i not in removed]
+        self._lsh = None  # positions shifted
+        
+        if save:
+            self._save_index()
+        return len(to_remove)
+    
+    def save(self):
+        """Write the index to disk (after add/delete calls with save=False)"""
+        self._save_index()
+    
     def clear_collection(self):
         """Delete all documents from the collection"""
         try:
@@ -176,6 +444,9 @@ class VectorStore:
             self.index = faiss.IndexFlatL2(self.dimension)
             self.documents = []
             self.metadatas = []
+            self.signatures = []
+            self.clusters = []
+            self._lsh = None
             
             # Delete saved files
             if os.path.exists(self.index_path):
@@ -198,7 +469,9 @@ class VectorStore:
             with open(self.metadata_path, 'wb') as f:
                 pickle.dump({
                     'documents': self.documents,
-                    'metadatas': self.metadatas
+                    'metadatas': self.metadatas,
+                    'signatures': self.signatures,
+                    'clusters': self.clusters
                 }, f)
             print(f"✓ Index saved to {self.index_path}")
         except Exception as e: